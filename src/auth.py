@@ -1,40 +1,46 @@
 # src/auth.py
 from sqlalchemy.orm import Session
-from passlib.context import CryptContext
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
 import os
+import time
 import uuid
 from dotenv import load_dotenv
 
-from . import crud, schemas, database  # Importar crud, schemas e database
+from . import crud, crud_async, schemas, database  # Importar crud, schemas e database
+from .password_hasher import password_hasher
+from .principal_cache import VerifiedToken, principal_cache
+from .revocation_filter import revocation_filter
 
 # Carregar variáveis de ambiente
 load_dotenv()
 
 # --- CONFIGURAÇÃO DE SEGURANÇA DO TOKEN ---
-SECRET_KEY = os.getenv("SECRET_KEY", "your-super-secret-key-here-change-in-production-32-chars-minimum")
+SECRET_KEY = os.getenv(
+    "SECRET_KEY", "your-super-secret-key-here-change-in-production-32-chars-minimum"
+)
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
 
-# --- Contexto de Senha ---
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 # --- OAuth2 ---
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/token")
 
 # --- Modelo para dados do token movido para schemas.py ---
 
+# O bcrypt roda no pool de processos (password_hasher); com a fila cheia
+# estas funções levantam PasswordHasherBusy, respondido com 503
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_hasher.verify_sync(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return password_hasher.hash_sync(password)
 
 # --- FUNÇÃO DE AUTENTICAÇÃO CORRIGIDA E CENTRALIZADA ---
 def authenticate_user(db: Session, username: str, password: str) -> Optional[schemas.UserInDB]:
@@ -49,6 +55,15 @@ def authenticate_user(db: Session, username: str, password: str) -> Optional[sch
         return None
     return user
 
+async def authenticate_user_async(db: AsyncSession, username: str, password: str):
+    """Versão assíncrona de authenticate_user; o bcrypt roda no pool de processos."""
+    user = await crud_async.get_user_by_username(db, username=username)
+    if not user:
+        return None
+    if not await password_hasher.verify(password, user.hashed_password):
+        return None
+    return user
+
 # --- FUNÇÕES JWT ---
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -81,7 +96,11 @@ def is_token_revoked(jti: str, db: Session) -> bool:
     from .cache import is_token_revoked_cache
     from .models import RevokedToken
     
-    # Primeiro verifica no cache Redis
+    # Negativo do filtro: certamente não revogado, sem ir ao Redis nem ao banco
+    if not revocation_filter.might_be_revoked(jti):
+        return False
+    
+    # Depois verifica no cache Redis
     if is_token_revoked_cache(jti):
         return True
     
@@ -90,20 +109,62 @@ def is_token_revoked(jti: str, db: Session) -> bool:
     
     # Se encontrou no banco, adiciona ao cache
     if revoked_token:
-        from .cache import cache_revoked_token
-        # Calcula tempo até expiração
-        import time
-        expire_seconds = int(revoked_token.expires_at.timestamp() - time.time())
-        if expire_seconds > 0:
-            cache_revoked_token(jti, expire_seconds)
+        _cache_revoked(jti, revoked_token.expires_at)
+        return True
+    
+    return False
+
+async def is_token_revoked_async(jti: str, db: AsyncSession) -> bool:
+    """Versão assíncrona de is_token_revoked (cache asyncio, sem bloquear o event loop)"""
+    from .cache import is_token_revoked_cache_async
+    
+    if not revocation_filter.might_be_revoked(jti):
+        return False
+    
+    if await is_token_revoked_cache_async(jti):
+        return True
+    
+    revoked_token = await crud_async.get_revoked_token(db, jti)
+    if revoked_token:
+        await _cache_revoked_async(jti, revoked_token.expires_at)
         return True
     
     return False
 
-def revoke_token(jti: str, user_id: str, token_type: str, reason: str, expires_at: datetime, db: Session):
+def _cache_revoked(jti: str, expires_at: datetime):
+    """Guarda o JTI revogado no Redis até a expiração natural do token"""
+    from .cache import cache_revoked_token
+    
+    # Calcula tempo até expiração
+    expire_seconds = int(expires_at.timestamp() - time.time())
+    if expire_seconds > 0:
+        cache_revoked_token(jti, expire_seconds)
+
+async def _cache_revoked_async(jti: str, expires_at: datetime):
+    from .cache import cache_revoked_token_async
+    
+    expire_seconds = int(expires_at.timestamp() - time.time())
+    if expire_seconds > 0:
+        await cache_revoked_token_async(jti, expire_seconds)
+
+def _after_token_revoked(jti: str, user_id: str, expires_at: datetime):
+    """Atualiza os caches depois que a revogação foi gravada no banco"""
+    from .cache import invalidate_user_session
+    
+    # Filtro local e das outras instâncias
+    revocation_filter.add(jti)
+    revocation_filter.publish(jti)
+    
+    # Adiciona ao cache Redis
+    _cache_revoked(jti, expires_at)
+    
+    # Invalida sessão do usuário no cache
+    invalidate_user_session(user_id)
+
+def revoke_token(jti: str, user_id: str, token_type: str, reason: str, expires_at: datetime,
+                 db: Session):
     """Adiciona um token à blacklist (com cache Redis)"""
     from .models import RevokedToken
-    from .cache import cache_revoked_token, invalidate_user_session
     
     # Adiciona ao banco
     revoked_token = RevokedToken(
@@ -117,14 +178,18 @@ def revoke_token(jti: str, user_id: str, token_type: str, reason: str, expires_a
     db.add(revoked_token)
     db.commit()
     
-    # Adiciona ao cache Redis
-    import time
-    expire_seconds = int(expires_at.timestamp() - time.time())
-    if expire_seconds > 0:
-        cache_revoked_token(jti, expire_seconds)
+    _after_token_revoked(jti, user_id, expires_at)
+
+async def revoke_token_async(jti: str, user_id: str, token_type: str, reason: str,
+                             expires_at: datetime, db: AsyncSession):
+    """Versão assíncrona de revoke_token"""
+    from .cache import invalidate_user_session_async
     
-    # Invalida sessão do usuário no cache
-    invalidate_user_session(user_id)
+    await crud_async.create_revoked_token(db, jti, user_id, token_type, reason, expires_at)
+    revocation_filter.add(jti)
+    await revocation_filter.publish_async(jti)
+    await _cache_revoked_async(jti, expires_at)
+    await invalidate_user_session_async(user_id)
 
 def revoke_all_user_tokens(user_id: str, reason: str, db: Session):
     """Revoga todos os tokens de um usuário (útil para mudança de senha)"""
@@ -134,29 +199,74 @@ def revoke_all_user_tokens(user_id: str, reason: str, db: Session):
     # Em produção, considere usar Redis para performance
     pass
 
-def get_current_user_from_token(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)) -> schemas.TokenData:
+def _on_revocation_event(kind: str, value: Optional[str]):
+    """Eventos do filtro de revogação, locais ou de outras instâncias"""
+    if kind == "token":
+        principal_cache.evict_token(value)
+    elif kind == "user":
+        principal_cache.evict_user(value)
+    else:
+        principal_cache.clear()
+
+revocation_filter.listeners.append(_on_revocation_event)
+
+def invalidate_user_principals(user_id: str):
+    """Descarta os tokens em cache do usuário em todas as instâncias (ex.: desativação)"""
+    revocation_filter.user_changed(user_id)
+
+def _decode_claims(token: str) -> Optional[dict]:
+    """Claims de um token com assinatura válida e campos obrigatórios, ou None"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    if payload.get("sub") is None or payload.get("user_id") is None or payload.get("jti") is None:
+        return None
+    return payload
+
+def _verify_token(token: str, db: Session) -> Optional[VerifiedToken]:
+    """Token verificado e não revogado: do cache por digest ou decodificado e checado agora"""
+    entry = principal_cache.get(token)
+    if entry is not None:
+        return entry
+    
+    payload = _decode_claims(token)
+    if payload is None:
+        return None
+    
+    # Verifica se o token foi revogado
+    if is_token_revoked(payload["jti"], db):
+        return None
+    
+    return principal_cache.put(
+        token, jti=payload["jti"], user_id=payload["user_id"], username=payload["sub"],
+        expires_at=payload.get("exp", 0), synced=revocation_filter.ready
+    )
+
+def _load_principal(entry: VerifiedToken, db: Session) -> Optional[schemas.UserPrincipal]:
+    """Usuário do token sem relacionamentos; consultado uma vez por entrada do cache"""
+    if entry.principal is None:
+        user = crud.get_user_by_username(db, username=entry.username)
+        if user is None:
+            return None
+        entry.principal = schemas.UserPrincipal(
+            id=user.id, username=user.username, is_active=user.is_active
+        )
+    return entry.principal
+
+def get_current_user_from_token(
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(database.get_db)
+) -> schemas.TokenData:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        user_id: str = payload.get("user_id")
-        jti: str = payload.get("jti")
-        
-        if username is None or user_id is None or jti is None:
-            raise credentials_exception
-        
-        # Verifica se o token foi revogado
-        if is_token_revoked(jti, db):
-            raise credentials_exception
-        
-        token_data = schemas.TokenData(username=username, user_id=user_id)
-    except JWTError:
+    entry = _verify_token(token, db)
+    if entry is None:
         raise credentials_exception
-    return token_data
+    return entry.token_data
 
 def get_current_user_from_token_string(token: str, db: Session) -> Optional[schemas.UserInDB]:
     """
@@ -185,6 +295,38 @@ def get_current_user_from_token_string(token: str, db: Session) -> Optional[sche
     except JWTError:
         return None
 
+def _load_websocket_user(token: str) -> Optional[schemas.TokenData]:
+    """Consultas bloqueantes do handshake WebSocket (executadas no threadpool)"""
+    db = database.SessionLocal()
+    try:
+        entry = _verify_token(token, db)
+        if entry is None:
+            return None
+        
+        principal = _load_principal(entry, db)
+        if principal is None or not principal.is_active:
+            return None
+        
+        return entry.token_data
+    finally:
+        db.close()
+
+async def get_websocket_principal(token: str) -> Optional[schemas.TokenData]:
+    """
+    Valida o token do handshake WebSocket sem bloquear o event loop.
+    Tokens já verificados vêm do cache de principals; em caso de miss, a
+    assinatura é verificada aqui e revogação e usuário vêm do banco no threadpool.
+    """
+    entry = principal_cache.get(token)
+    if entry is not None and entry.principal is not None:
+        return entry.token_data if entry.principal.is_active else None
+    
+    # Assinatura inválida é recusada sem passar pelo threadpool
+    if entry is None and _decode_claims(token) is None:
+        return None
+    
+    return await run_in_threadpool(_load_websocket_user, token)
+
 def verify_password_reset_token(token: str) -> Optional[str]:
     """Decodifica um token de reset, verifica sua validade e retorna o email."""
     try:
@@ -196,6 +338,23 @@ def verify_password_reset_token(token: str) -> Optional[str]:
     except JWTError:
         return None
 
+def get_current_active_principal(
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(database.get_db)
+) -> schemas.UserPrincipal:
+    """Usuário ativo sem relacionamentos; num hit do cache não toca no banco"""
+    entry = _verify_token(token, db)
+    if entry is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    principal = _load_principal(entry, db)
+    if principal is None or not principal.is_active:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return principal
+
 def get_current_active_user(
     token_data: schemas.TokenData = Depends(get_current_user_from_token),
     db: Session = Depends(database.get_db)
@@ -1,21 +1,196 @@
 # src/cache.py
+import asyncio
 import redis
 import json
+import logging
 import os
-from typing import Optional, Any, Dict
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, Any, Awaitable, Callable, Dict, Iterable, List, Tuple
 from datetime import timedelta
 from dotenv import load_dotenv
+from redis.client import NEVER_DECODE
+
+from .cache_codec import TABLE_CODEC, TABLE_LIST_CODEC, SchemaCodec
 
 # Carrega variáveis de ambiente
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# L1 em memória na frente do Redis (por processo)
+CACHE_L1_MAX_ENTRIES = int(os.getenv("CACHE_L1_MAX_ENTRIES", "10000"))
+CACHE_L1_MAX_BYTES = int(os.getenv("CACHE_L1_MAX_BYTES", str(32 * 1024 * 1024)))
+CACHE_L1_TTL = float(os.getenv("CACHE_L1_TTL", "30"))
+# Ausências também ficam no L1 (ex.: token não revogado), por menos tempo
+CACHE_L1_NEGATIVE_TTL = float(os.getenv("CACHE_L1_NEGATIVE_TTL", "5"))
+# Canal em que cada escrita avisa os outros workers para descartar a chave do L1
+CACHE_INVALIDATION_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL", "cache:invalidate")
+
+# Single-flight: depois que uma chave expira, a cópia antiga continua servível
+# por mais CACHE_STALE_TTL segundos enquanto um único chamador a recarrega
+CACHE_STALE_TTL = int(os.getenv("CACHE_STALE_TTL", "300"))
+# Trava do recarregamento no cluster; quem espera sem cópia antiga desiste após esse tempo
+CACHE_LOAD_LOCK_MS = int(os.getenv("CACHE_LOAD_LOCK_MS", "5000"))
+CACHE_LOAD_POLL_INTERVAL = float(os.getenv("CACHE_LOAD_POLL_INTERVAL", "0.05"))
+
+STALE_KEY_PREFIX = "cache:stale:"
+LOAD_LOCK_KEY_PREFIX = "cache:lock:"
+
+# Libera a trava apenas se ela ainda pertence a quem a criou
+RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Marca no L1 de chave ausente no Redis
+_ABSENT = object()
+
+def stale_key(key: str) -> str:
+    """Chave da cópia antiga usada enquanto `key` é recarregada"""
+    return f"{STALE_KEY_PREFIX}{key}"
+
+def _serialize(value: Any) -> str:
+    """Texto gravado no Redis: strings como estão, o resto em JSON"""
+    return json.dumps(value) if not isinstance(value, str) else value
+
+def _deserialize(raw: str) -> Any:
+    # Tenta deserializar JSON; se não for JSON, retorna como string
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        return raw
+
+def _encode(value: Any, codec: Optional[SchemaCodec] = None) -> Any:
+    """Texto JSON, ou bytes versionados quando há codec"""
+    return codec.encode(value) if codec is not None else _serialize(value)
+
+def _decode(raw: Any, codec: Optional[SchemaCodec] = None) -> Any:
+    """Valor da entrada; com codec, None se ela é de outra versão do schema"""
+    return codec.unpack(raw) if codec is not None else _deserialize(raw)
+
+def _queue_get(pipe, key: str, binary: bool):
+    # Os clientes usam decode_responses: entradas binárias são lidas sem decodificar
+    if binary:
+        return pipe.execute_command("GET", key, **{NEVER_DECODE: True})
+    return pipe.get(key)
+
+class TTLCache:
+    """Cache em memória do processo com expiração (TTL) e limite de entradas (LRU).
+
+    `maxbytes` limita também a soma dos tamanhos informados em `set(..., size=)`.
+    `on_evict(key, value)` é chamado (com o lock interno adquirido) quando uma
+    entrada sai por expiração, LRU, substituição ou `delete`; não em `clear`.
+    """
+    
+    def __init__(self, maxsize: int = 1024, ttl: float = 30.0, maxbytes: Optional[int] = None,
+                 on_evict: Optional[Callable[[Any, Any], None]] = None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: Any) -> Optional[Any]:
+        """Obtém um valor ainda válido, ou None"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            value, expires_at, size = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self._bytes -= size
+                self.misses += 1
+                if self.on_evict is not None:
+                    self.on_evict(key, value)
+                return None
+            
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def set(self, key: Any, value: Any, ttl: Optional[float] = None, size: int = 0):
+        """Define um valor; remove os menos usados recentemente se exceder os limites"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+                if self.on_evict is not None:
+                    self.on_evict(key, previous[0])
+            self._data[key] = (value, expires_at, size)
+            self._bytes += size
+            while len(self._data) > self.maxsize or (
+                self.maxbytes is not None and self._bytes > self.maxbytes and len(self._data) > 1
+            ):
+                evicted_key, evicted = self._data.popitem(last=False)
+                self._bytes -= evicted[2]
+                if self.on_evict is not None:
+                    self.on_evict(evicted_key, evicted[0])
+    
+    def delete(self, key: Any) -> bool:
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return False
+            self._bytes -= entry[2]
+            if self.on_evict is not None:
+                self.on_evict(key, entry[0])
+            return True
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+    
+    def __len__(self) -> int:
+        return len(self._data)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "bytes": self._bytes,
+            "maxbytes": self.maxbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0
+        }
+
 class RedisCache:
-    """Cache Redis para sessões e dados frequentes"""
+    """Cache Redis para sessões e dados frequentes, com L1 em memória à frente.
+
+    O L1 guarda o texto serializado (cada leitura devolve um objeto novo) e
+    também as ausências. Escritas e remoções publicam a chave no canal de
+    invalidação para que os outros workers descartem suas cópias; o TTL do
+    L1 limita a defasagem se alguma invalidação se perder.
+    """
     
     def __init__(self):
         # Configuração do Redis
         redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
         
+        self.local = TTLCache(
+            maxsize=CACHE_L1_MAX_ENTRIES, ttl=CACHE_L1_TTL, maxbytes=CACHE_L1_MAX_BYTES
+        )
+        self.instance_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.l2_hits = 0
+        self.l2_misses = 0
+        self.invalidations_received = 0
+        self._invalidation_thread = None
+        
         try:
             self.redis_client = redis.from_url(
                 redis_url,
@@ -32,44 +207,127 @@ class RedisCache:
             print(f"⚠️ Redis não disponível: {e}")
             self.redis_client = None
             self.available = False
+            # Sem o canal de invalidação o L1 não é coerente entre workers
+            self.local = None
+            return
+        
+        self._start_invalidation_listener()
+    
+    def _start_invalidation_listener(self):
+        """Escuta o canal de invalidação em uma thread daemon"""
+        try:
+            pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{CACHE_INVALIDATION_CHANNEL: self._on_invalidation})
+            self._invalidation_thread = pubsub.run_in_thread(
+                sleep_time=1.0, daemon=True, exception_handler=self._on_invalidation_error
+            )
+        except Exception as e:
+            # Sem o canal, o L1 poderia servir dados que outro worker já alterou
+            logger.warning(f"Invalidação do cache L1 indisponível, L1 desativado: {e}")
+            self.local = None
+    
+    def _on_invalidation(self, message: Dict[str, Any]):
+        # "<instância>\n<chave>[\n<chave>...]"
+        origin, *keys = message["data"].split("\n")
+        if origin == self.instance_id:
+            return
+        self.invalidations_received += 1
+        for key in keys:
+            if key == "*":
+                self.local.clear()
+            else:
+                self.local.delete(key)
+    
+    def _on_invalidation_error(self, error: Exception, pubsub, thread):
+        # Mensagens podem ter se perdido durante a falha: descarta o L1 inteiro
+        logger.warning(f"Erro no canal de invalidação do cache: {error}")
+        self.local.clear()
+        time.sleep(1.0)
+    
+    def _publish_invalidation(self, pipe, *keys: str):
+        """Enfileira no pipeline (síncrono ou asyncio) o aviso de invalidação das chaves"""
+        pipe.publish(CACHE_INVALIDATION_CHANNEL, "\n".join((self.instance_id, *keys)))
+    
+    def _forget(self, *keys: str):
+        if self.local is not None:
+            for key in keys:
+                self.local.delete(key)
+    
+    def _lookup_local(self, key: str) -> Tuple[bool, Optional[str]]:
+        """(encontrado, texto) no L1; uma ausência conhecida é (True, None)"""
+        if self.local is None:
+            return False, None
+        cached = self.local.get(key)
+        if cached is None:
+            return False, None
+        return True, None if cached is _ABSENT else cached
+    
+    def _record_fetch(self, key: str, raw: Optional[str], pttl: int):
+        """Contabiliza uma leitura do Redis e a guarda no L1"""
+        if raw is None:
+            self.l2_misses += 1
+        else:
+            self.l2_hits += 1
+        self._remember(key, raw, pttl)
+    
+    def _remember(self, key: str, raw: Optional[str], pttl: int):
+        """Guarda no L1 o valor lido do Redis (ou a ausência) sem ultrapassar o TTL do Redis"""
+        if self.local is None:
+            return
+        if raw is None:
+            self.local.set(key, _ABSENT, ttl=CACHE_L1_NEGATIVE_TTL, size=len(key))
+            return
+        ttl = CACHE_L1_TTL if pttl is None or pttl < 0 else min(CACHE_L1_TTL, pttl / 1000)
+        self.local.set(key, raw, ttl=ttl, size=len(key) + len(raw))
+    
+    def _get_raw(self, key: str, binary: bool = False) -> Optional[Any]:
+        """Texto bruto da chave: L1, depois Redis (GET + PTTL em uma ida)"""
+        found, raw = self._lookup_local(key)
+        if found:
+            return raw
+        
+        pipe = self.redis_client.pipeline(transaction=False)
+        _queue_get(pipe, key, binary)
+        pipe.pttl(key)
+        raw, pttl = pipe.execute()
+        self._record_fetch(key, raw, pttl)
+        return raw
     
     def is_available(self) -> bool:
         """Verifica se o Redis está disponível"""
         return self.available and self.redis_client is not None
     
-    def set(self, key: str, value: Any, expire: Optional[int] = None) -> bool:
-        """Define um valor no cache"""
+    def set(self, key: str, value: Any, expire: Optional[int] = None,
+            codec: Optional[SchemaCodec] = None) -> bool:
+        """Define um valor no cache (com `codec`, serializado pelo schema em msgpack)"""
         if not self.is_available():
             return False
         
         try:
-            # Serializa o valor para JSON
-            serialized_value = json.dumps(value) if not isinstance(value, str) else value
+            serialized_value = _encode(value, codec)
             
+            pipe = self.redis_client.pipeline(transaction=False)
             if expire:
-                return self.redis_client.setex(key, expire, serialized_value)
+                pipe.setex(key, expire, serialized_value)
             else:
-                return self.redis_client.set(key, serialized_value)
+                pipe.set(key, serialized_value)
+            self._publish_invalidation(pipe, key)
+            result = pipe.execute()[0]
+            
+            self._remember(key, serialized_value, expire * 1000 if expire else -1)
+            return result
         except Exception as e:
             print(f"Erro ao definir cache {key}: {e}")
             return False
     
-    def get(self, key: str) -> Optional[Any]:
-        """Obtém um valor do cache"""
+    def get(self, key: str, codec: Optional[SchemaCodec] = None) -> Optional[Any]:
+        """Obtém um valor do cache (gravado com o mesmo `codec`, se houver)"""
         if not self.is_available():
             return None
         
         try:
-            value = self.redis_client.get(key)
-            if value is None:
-                return None
-            
-            # Tenta deserializar JSON
-            try:
-                return json.loads(value)
-            except json.JSONDecodeError:
-                # Se não for JSON, retorna como string
-                return value
+            value = self._get_raw(key, binary=codec is not None)
+            return None if value is None else _decode(value, codec)
         except Exception as e:
             print(f"Erro ao obter cache {key}: {e}")
             return None
@@ -80,7 +338,13 @@ class RedisCache:
             return False
         
         try:
-            return bool(self.redis_client.delete(key))
+            self._forget(key)
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.delete(key)
+            # Uma remoção explícita é uma mudança: a cópia antiga não pode mais ser servida
+            pipe.delete(stale_key(key))
+            self._publish_invalidation(pipe, key)
+            return bool(pipe.execute()[0])
         except Exception as e:
             print(f"Erro ao deletar cache {key}: {e}")
             return False
@@ -91,7 +355,7 @@ class RedisCache:
             return False
         
         try:
-            return bool(self.redis_client.exists(key))
+            return self._get_raw(key) is not None
         except Exception as e:
             print(f"Erro ao verificar existência {key}: {e}")
             return False
@@ -102,7 +366,12 @@ class RedisCache:
             return False
         
         try:
-            return bool(self.redis_client.expire(key, seconds))
+            # O L1 local pode ter um TTL maior que o novo: relê do Redis na próxima vez
+            self._forget(key)
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.expire(key, seconds)
+            self._publish_invalidation(pipe, key)
+            return bool(pipe.execute()[0])
         except Exception as e:
             print(f"Erro ao definir expiração {key}: {e}")
             return False
@@ -113,7 +382,12 @@ class RedisCache:
             return False
         
         try:
-            return bool(self.redis_client.flushdb())
+            if self.local is not None:
+                self.local.clear()
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.flushdb()
+            self._publish_invalidation(pipe, "*")
+            return bool(pipe.execute()[0])
         except Exception as e:
             print(f"Erro ao limpar cache: {e}")
             return False
@@ -123,10 +397,22 @@ class RedisCache:
         if not self.is_available():
             return {"available": False}
         
+        l2_total = self.l2_hits + self.l2_misses
+        tiers = {
+            "l1": self.local.get_stats() if self.local is not None else {"enabled": False},
+            "l2": {
+                "hits": self.l2_hits,
+                "misses": self.l2_misses,
+                "hit_ratio": self.l2_hits / l2_total if l2_total else 0.0
+            },
+            "invalidations_received": self.invalidations_received
+        }
+        
         try:
             info = self.redis_client.info()
             return {
                 "available": True,
+                **tiers,
                 "connected_clients": info.get("connected_clients", 0),
                 "used_memory_human": info.get("used_memory_human", "0B"),
                 "keyspace_hits": info.get("keyspace_hits", 0),
@@ -135,13 +421,292 @@ class RedisCache:
             }
         except Exception as e:
             print(f"Erro ao obter estatísticas: {e}")
-            return {"available": False, "error": str(e)}
+            return {"available": False, "error": str(e), **tiers}
+
+class AsyncRedisCache:
+    """API asyncio do cache, para rotas `async def` e para o WebSocket.
+
+    Usa o cliente redis.asyncio do websocket_manager (um só pool de conexões
+    por processo) e compartilha com o cache síncrono o L1, as estatísticas e
+    o canal de invalidação. Sem esse cliente (Redis fora do ar ou antes do
+    startup) as leituras são misses e as escritas retornam False.
+    """
+    
+    def __init__(self, sync_cache: RedisCache):
+        self.sync = sync_cache
+        # Recarregamentos em andamento neste processo: chave -> task compartilhada
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._release_script = None
+        self._release_script_client = None
+        self.stats = {
+            "loads": 0,
+            "coalesced": 0,
+            "stale_served": 0,
+            "peer_waits": 0,
+            "peer_wait_timeouts": 0
+        }
+    
+    @property
+    def redis_client(self):
+        from .websocket_manager import websocket_manager
+        if not websocket_manager.stats["redis_available"]:
+            return None
+        return websocket_manager.redis_client
+    
+    def is_available(self) -> bool:
+        return self.redis_client is not None
+    
+    def pipeline(self):
+        """Pipeline sem MULTI: vários comandos em uma única ida ao Redis"""
+        return self.redis_client.pipeline(transaction=False)
+    
+    async def get_many(self, keys: Iterable[str],
+                       codec: Optional[SchemaCodec] = None) -> Dict[str, Any]:
+        """Valores das chaves presentes (L1, depois MGET + PTTLs em uma ida).
+
+        Com `codec`, entradas de outra versão do schema ficam de fora (miss).
+        """
+        found: Dict[str, Any] = {}
+        missing: List[str] = []
+        for key in dict.fromkeys(keys):
+            hit, raw = self.sync._lookup_local(key)
+            if not hit:
+                missing.append(key)
+            elif raw is not None:
+                self._collect(found, key, raw, codec)
+        if not missing or not self.is_available():
+            return found
+        
+        try:
+            pipe = self.pipeline()
+            if codec is not None:
+                pipe.execute_command("MGET", *missing, **{NEVER_DECODE: True})
+            else:
+                pipe.mget(missing)
+            for key in missing:
+                pipe.pttl(key)
+            values, *pttls = await pipe.execute()
+        except Exception as e:
+            print(f"Erro ao obter cache {missing}: {e}")
+            return found
+        
+        for key, raw, pttl in zip(missing, values, pttls):
+            self.sync._record_fetch(key, raw, pttl)
+            if raw is not None:
+                self._collect(found, key, raw, codec)
+        return found
+    
+    @staticmethod
+    def _collect(found: Dict[str, Any], key: str, raw: Any, codec: Optional[SchemaCodec]):
+        value = _decode(raw, codec)
+        if codec is None or value is not None:
+            found[key] = value
+    
+    async def get(self, key: str, codec: Optional[SchemaCodec] = None) -> Optional[Any]:
+        """Obtém um valor do cache"""
+        return (await self.get_many([key], codec)).get(key)
+    
+    async def exists(self, key: str) -> bool:
+        """Verifica se uma chave existe no cache"""
+        return key in await self.get_many([key])
+    
+    async def set_many(self, mapping: Dict[str, Any], expire: Optional[int] = None,
+                       codec: Optional[SchemaCodec] = None) -> bool:
+        """Define vários valores (MSET, ou SETEX em pipeline se expira) e uma invalidação"""
+        if not mapping or not self.is_available():
+            return False
+        
+        try:
+            serialized = {key: _encode(value, codec) for key, value in mapping.items()}
+            pipe = self.pipeline()
+            if expire:
+                for key, value in serialized.items():
+                    pipe.setex(key, expire, value)
+            else:
+                pipe.mset(serialized)
+            self.sync._publish_invalidation(pipe, *serialized)
+            results = await pipe.execute()
+        except Exception as e:
+            print(f"Erro ao definir cache {list(mapping)}: {e}")
+            return False
+        
+        for key, value in serialized.items():
+            self.sync._remember(key, value, expire * 1000 if expire else -1)
+        return all(results[:-1])
+    
+    async def set(self, key: str, value: Any, expire: Optional[int] = None,
+                  codec: Optional[SchemaCodec] = None) -> bool:
+        """Define um valor no cache"""
+        return await self.set_many({key: value}, expire, codec)
+    
+    async def delete_many(self, keys: Iterable[str]) -> int:
+        """Remove as chaves; retorna quantas existiam no Redis"""
+        keys = list(dict.fromkeys(keys))
+        if not keys or not self.is_available():
+            return 0
+        
+        try:
+            self.sync._forget(*keys)
+            pipe = self.pipeline()
+            pipe.delete(*keys)
+            pipe.delete(*[stale_key(key) for key in keys])
+            self.sync._publish_invalidation(pipe, *keys)
+            return int((await pipe.execute())[0])
+        except Exception as e:
+            print(f"Erro ao deletar cache {keys}: {e}")
+            return 0
+    
+    async def delete(self, key: str) -> bool:
+        """Remove um valor do cache"""
+        return await self.delete_many([key]) > 0
+    
+    async def expire(self, key: str, seconds: int) -> bool:
+        """Define expiração para uma chave"""
+        if not self.is_available():
+            return False
+        
+        try:
+            self.sync._forget(key)
+            pipe = self.pipeline()
+            pipe.expire(key, seconds)
+            self.sync._publish_invalidation(pipe, key)
+            return bool((await pipe.execute())[0])
+        except Exception as e:
+            print(f"Erro ao definir expiração {key}: {e}")
+            return False
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]], expire: int,
+                          stale_ttl: int = CACHE_STALE_TTL,
+                          codec: Optional[SchemaCodec] = None) -> Any:
+        """Valor da chave; num miss, um único chamador por chave executa `loader`.
+
+        No processo, chamadas concorrentes aguardam a mesma task. No cluster,
+        quem obtém a trava Redis recarrega e os demais recebem a cópia antiga
+        (stale-while-revalidate) ou aguardam o resultado. `loader` deve
+        retornar um valor serializável em JSON, ou o que `codec` aceita (linhas
+        ORM), caso em que o retorno é `codec.dump` do resultado; None não é cacheado.
+        """
+        found = await self.get_many([key], codec)
+        if key in found:
+            return found[key]
+        
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key, loader, expire, stale_ttl, codec))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._done_loading(key, done))
+        else:
+            self.stats["coalesced"] += 1
+        # shield: um chamador cancelado não cancela a carga dos outros
+        return await asyncio.shield(task)
+    
+    def _done_loading(self, key: str, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # Evita o aviso de exceção não lida se todos desistiram
+    
+    async def _run_loader(self, loader: Callable[[], Awaitable[Any]],
+                          codec: Optional[SchemaCodec]) -> Any:
+        self.stats["loads"] += 1
+        value = await loader()
+        return codec.dump(value) if codec is not None and value is not None else value
+    
+    async def _load(self, key: str, loader: Callable[[], Awaitable[Any]], expire: int,
+                    stale_ttl: int, codec: Optional[SchemaCodec]) -> Any:
+        client = self.redis_client
+        if client is None:
+            # Sem Redis resta a coalescência dentro do processo
+            return await self._run_loader(loader, codec)
+        
+        lock_key = f"{LOAD_LOCK_KEY_PREFIX}{key}"
+        token = uuid.uuid4().hex
+        try:
+            acquired = await client.set(lock_key, token, nx=True, px=CACHE_LOAD_LOCK_MS)
+        except Exception as e:
+            print(f"Erro ao obter trava de recarga {key}: {e}")
+            return await self._run_loader(loader, codec)
+        
+        if not acquired:
+            value = await self._wait_for_peer(client, key, codec)
+            if value is not _ABSENT:
+                return value
+        
+        try:
+            return await self._load_and_store(client, key, loader, expire, stale_ttl, codec)
+        finally:
+            if acquired:
+                await self._release_lock(client, lock_key, token)
+    
+    async def _wait_for_peer(self, client, key: str, codec: Optional[SchemaCodec]) -> Any:
+        """Cópia antiga, ou o valor gravado por quem tem a trava; _ABSENT se nenhum vier"""
+        binary = codec is not None
+        try:
+            raw = await _queue_get(client, stale_key(key), binary)
+            stale = None if raw is None else _decode(raw, codec)
+            if stale is not None:
+                self.stats["stale_served"] += 1
+                return stale
+            
+            self.stats["peer_waits"] += 1
+            lock_key = f"{LOAD_LOCK_KEY_PREFIX}{key}"
+            deadline = asyncio.get_running_loop().time() + CACHE_LOAD_LOCK_MS / 1000
+            while asyncio.get_running_loop().time() < deadline:
+                await asyncio.sleep(CACHE_LOAD_POLL_INTERVAL)
+                pipe = client.pipeline(transaction=False)
+                _queue_get(pipe, key, binary)
+                pipe.pttl(key)
+                pipe.exists(lock_key)
+                raw, pttl, locked = await pipe.execute()
+                value = None if raw is None else _decode(raw, codec)
+                if value is not None:
+                    self.sync._record_fetch(key, raw, pttl)
+                    return value
+                if not locked:
+                    break  # O dono da trava falhou ou o valor não é cacheável
+        except Exception as e:
+            print(f"Erro ao aguardar recarga {key}: {e}")
+        self.stats["peer_wait_timeouts"] += 1
+        return _ABSENT
+    
+    async def _load_and_store(self, client, key: str, loader: Callable[[], Awaitable[Any]],
+                              expire: int, stale_ttl: int, codec: Optional[SchemaCodec]) -> Any:
+        value = await self._run_loader(loader, codec)
+        if value is None:
+            return None
+        
+        try:
+            serialized = codec.pack(value) if codec is not None else _serialize(value)
+            pipe = client.pipeline(transaction=False)
+            pipe.setex(key, expire, serialized)
+            if stale_ttl > 0:
+                pipe.setex(stale_key(key), expire + stale_ttl, serialized)
+            self.sync._publish_invalidation(pipe, key)
+            await pipe.execute()
+            self.sync._remember(key, serialized, expire * 1000)
+        except Exception as e:
+            print(f"Erro ao definir cache {key}: {e}")
+        return value
+    
+    async def _release_lock(self, client, lock_key: str, token: str):
+        try:
+            if self._release_script is None or self._release_script_client is not client:
+                self._release_script = client.register_script(RELEASE_LOCK_LUA)
+                self._release_script_client = client
+            await self._release_script(keys=[lock_key], args=[token])
+        except Exception as e:
+            # A trava expira sozinha após CACHE_LOAD_LOCK_MS
+            print(f"Erro ao liberar trava {lock_key}: {e}")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "inflight": len(self._inflight)}
 
-# Instância global do cache
+# Instâncias globais do cache (síncrona para rotas em threadpool, asyncio para as demais)
 cache = RedisCache()
+async_cache = AsyncRedisCache(cache)
 
 # Funções de conveniência para cache de sessões
-def cache_user_session(user_id: str, session_data: Dict[str, Any], expire_minutes: int = 30) -> bool:
+def cache_user_session(user_id: str, session_data: Dict[str, Any],
+                       expire_minutes: int = 30) -> bool:
     """Cacheia dados de sessão do usuário"""
     key = f"session:user:{user_id}"
     return cache.set(key, session_data, expire_minutes * 60)
@@ -168,34 +733,36 @@ def get_user_characters(user_id: str) -> Optional[list]:
     return cache.get(key)
 
 def cache_active_tables(tables: list, expire_minutes: int = 5) -> bool:
-    """Cacheia lista de mesas ativas"""
+    """Cacheia lista de mesas ativas (linhas ORM ou dicts no formato de schemas.Table)"""
     key = "tables:active"
-    return cache.set(key, tables, expire_minutes * 60)
+    return cache.set(key, tables, expire_minutes * 60, codec=TABLE_LIST_CODEC)
 
 def get_active_tables() -> Optional[list]:
     """Obtém lista de mesas ativas do cache"""
     key = "tables:active"
-    return cache.get(key)
+    return cache.get(key, codec=TABLE_LIST_CODEC)
 
-def cache_table_details(table_id: str, table_data: Dict[str, Any], expire_minutes: int = 15) -> bool:
-    """Cacheia detalhes de uma mesa"""
+def cache_table_details(table_id: str, table_data: Dict[str, Any],
+                        expire_minutes: int = 15) -> bool:
+    """Cacheia detalhes de uma mesa (linha ORM ou dict no formato de schemas.Table)"""
     key = f"table:details:{table_id}"
-    return cache.set(key, table_data, expire_minutes * 60)
+    return cache.set(key, table_data, expire_minutes * 60, codec=TABLE_CODEC)
 
 def get_table_details(table_id: str) -> Optional[Dict[str, Any]]:
     """Obtém detalhes de uma mesa do cache"""
     key = f"table:details:{table_id}"
-    return cache.get(key)
+    return cache.get(key, codec=TABLE_CODEC)
 
-def invalidate_table_cache(table_id: str) -> bool:
-    """Invalida cache relacionado a uma mesa"""
-    keys_to_delete = [
+def _table_cache_keys(table_id: str) -> List[str]:
+    return [
         f"table:details:{table_id}",
         "tables:active"  # Invalida lista de mesas ativas também
     ]
-    
+
+def invalidate_table_cache(table_id: str) -> bool:
+    """Invalida cache relacionado a uma mesa"""
     success = True
-    for key in keys_to_delete:
+    for key in _table_cache_keys(table_id):
         if not cache.delete(key):
             success = False
     
@@ -210,4 +777,35 @@ def cache_revoked_token(jti: str, expire_seconds: int) -> bool:
 def is_token_revoked_cache(jti: str) -> bool:
     """Verifica se token está revogado no cache"""
     key = f"revoked:token:{jti}"
-    return cache.exists(key)
\ No newline at end of file
+    return cache.exists(key)
+
+# Variantes asyncio das funções de conveniência
+async def invalidate_user_session_async(user_id: str) -> bool:
+    return await async_cache.delete(f"session:user:{user_id}")
+
+async def get_active_tables_or_load(loader: Callable[[], Awaitable[list]],
+                                    expire_minutes: int = 5) -> list:
+    """Lista de mesas ativas; num miss, uma única carga (linhas ORM) por vez no cluster"""
+    return await async_cache.get_or_load("tables:active", loader, expire_minutes * 60,
+                                         codec=TABLE_LIST_CODEC)
+
+async def get_table_details_or_load(table_id: str, loader: Callable[[], Awaitable[Any]],
+                                    expire_minutes: int = 15) -> Optional[Dict[str, Any]]:
+    """Detalhes da mesa (None = não existe); num miss, uma única carga por vez no cluster"""
+    return await async_cache.get_or_load(f"table:details:{table_id}", loader, expire_minutes * 60,
+                                         codec=TABLE_CODEC)
+
+async def invalidate_table_cache_async(table_id: str) -> bool:
+    """Invalida os detalhes da mesa e a lista de mesas ativas em uma ida ao Redis"""
+    return await invalidate_tables_cache_async([table_id]) > 0
+
+async def invalidate_tables_cache_async(table_ids: Iterable[str]) -> int:
+    """Invalida várias mesas (e a lista de mesas ativas) em uma ida ao Redis"""
+    keys = [key for table_id in table_ids for key in _table_cache_keys(table_id)]
+    return await async_cache.delete_many(keys)
+
+async def cache_revoked_token_async(jti: str, expire_seconds: int) -> bool:
+    return await async_cache.set(f"revoked:token:{jti}", "revoked", expire_seconds)
+
+async def is_token_revoked_cache_async(jti: str) -> bool:
+    return await async_cache.exists(f"revoked:token:{jti}")
@@ -0,0 +1,91 @@
+# src/cache_codec.py
+import hashlib
+import json
+import logging
+import os
+from typing import Any, List, Optional, Type
+
+from dotenv import load_dotenv
+from pydantic import BaseModel, TypeAdapter
+
+from . import schemas
+
+# MessagePack é opcional: sem ele as entradas são gravadas em JSON (mesmo envelope)
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Carrega variáveis de ambiente
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Incrementar invalida todas as entradas codificadas, mesmo sem mudança de schema
+CACHE_SCHEMA_VERSION = os.getenv("CACHE_SCHEMA_VERSION", "1")
+
+FORMAT_MSGPACK = b"m"
+FORMAT_JSON = b"j"
+
+
+class SchemaCodec:
+    """Serializa objetos ORM (ou dicts) pelo schema Pydantic de resposta.
+
+    Cada entrada começa com "<formato><versão>\\n". A versão deriva do JSON
+    Schema do modelo, então um deploy que muda campos deixa de ler as entradas
+    antigas: `unpack` retorna None e o cache trata como miss.
+    """
+
+    def __init__(self, schema: Type[BaseModel], many: bool = False):
+        self.name = f"{schema.__name__}[]" if many else schema.__name__
+        self.adapter = TypeAdapter(List[schema] if many else schema)
+        self._header: Optional[bytes] = None
+        self.mismatches = 0
+
+    @property
+    def version(self) -> str:
+        return self.header[1:-1].decode()
+
+    @property
+    def header(self) -> bytes:
+        # Calculado na primeira utilização: o JSON Schema resolve as referências entre modelos
+        if self._header is None:
+            schema_text = json.dumps(self.adapter.json_schema(), sort_keys=True)
+            digest = hashlib.sha1(f"{CACHE_SCHEMA_VERSION}:{schema_text}".encode()).hexdigest()[:10]
+            self._header = (FORMAT_MSGPACK if msgpack is not None else FORMAT_JSON) + digest.encode() + b"\n"
+        return self._header
+
+    def dump(self, obj: Any) -> Any:
+        """Dados serializáveis (os mesmos da resposta da API) a partir de linhas ORM ou dicts"""
+        return self.adapter.dump_python(self.adapter.validate_python(obj, from_attributes=True), mode="json")
+
+    def pack(self, data: Any) -> bytes:
+        if msgpack is not None:
+            return self.header + msgpack.packb(data, use_bin_type=True)
+        return self.header + json.dumps(data, separators=(",", ":")).encode()
+
+    def encode(self, obj: Any) -> bytes:
+        return self.pack(self.dump(obj))
+
+    def unpack(self, payload: Any) -> Optional[Any]:
+        """Dados da entrada, ou None se ela é de outra versão/formato (ou ilegível)"""
+        header = self.header
+        if not isinstance(payload, bytes) or not payload.startswith(header):
+            self.mismatches += 1
+            return None
+        body = payload[len(header):]
+        try:
+            if header[:1] == FORMAT_MSGPACK:
+                return msgpack.unpackb(body, raw=False)
+            return json.loads(body)
+        except Exception as e:
+            logger.warning(f"Entrada de cache {self.name} ilegível: {e}")
+            return None
+
+    def get_stats(self):
+        return {"version": self.version, "msgpack": msgpack is not None, "mismatches": self.mismatches}
+
+
+# Codecs das entradas de mesa (mesma forma de schemas.Table nas respostas)
+TABLE_CODEC = SchemaCodec(schemas.Table)
+TABLE_LIST_CODEC = SchemaCodec(schemas.Table, many=True)
@@ -0,0 +1,274 @@
+# src/compression.py
+import gzip
+import logging
+import os
+import sys
+import zlib
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+# Brotli e Zstandard são opcionais: sem eles a negociação oferece só o que estiver instalado
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Carrega variáveis de ambiente
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Pedaços a partir deste tamanho são comprimidos numa thread (zlib, brotli e zstd liberam o GIL)
+COMPRESSION_OFFLOAD_SIZE = int(os.getenv("COMPRESSION_OFFLOAD_SIZE", "65536"))
+
+# Preferência do servidor entre codificações aceitas com o mesmo q
+AVAILABLE_ENCODINGS: Tuple[str, ...] = tuple(
+    encoding for encoding, module in (("zstd", zstandard), ("br", brotli), ("gzip", zlib)) if module is not None
+)
+# Níveis por requisição: rápidos, o corpo muda a cada resposta
+DYNAMIC_LEVELS = {"zstd": 3, "br": 4, "gzip": 6}
+# Níveis das cópias pré-comprimidas: geradas uma vez, no upload ou no build
+STATIC_LEVELS = {"zstd": 19, "br": 11, "gzip": 9}
+PRECOMPRESSED_SUFFIXES = {"zstd": ".zst", "br": ".br", "gzip": ".gz"}
+# Arquivos de texto que valem a pena pré-comprimir (imagens já vêm comprimidas)
+PRECOMPRESSIBLE_EXTENSIONS = {
+    ".js", ".mjs", ".css", ".html", ".svg", ".json", ".map", ".txt", ".xml", ".wasm"
+}
+# Uma cópia só é mantida se economizar pelo menos 5%
+PRECOMPRESS_MIN_RATIO = 0.95
+
+
+@lru_cache(maxsize=256)
+def negotiate(accept_encoding: str, available: Tuple[str, ...] = AVAILABLE_ENCODINGS) -> Optional[str]:
+    """Codificação preferida para um Accept-Encoding (com q-values), ou None para identity.
+
+    Memoizada: os clientes enviam poucas variações do header.
+    """
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.partition(";")
+        name = name.strip()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name] = quality
+
+    wildcard = accepted.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for encoding in available:
+        quality = accepted.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress_bytes(data: bytes, encoding: str, level: int) -> bytes:
+    """Compressão de uma vez só (cópias pré-comprimidas)"""
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+class Encoder:
+    """Compressor incremental de um corpo de resposta"""
+
+    def __init__(self, encoding: str, level: int):
+        self.encoding = encoding
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=level)
+            self._compress, self._finish = compressor.process, compressor.finish
+        elif encoding == "zstd":
+            compressor = zstandard.ZstdCompressor(level=level).compressobj()
+            self._compress, self._finish = compressor.compress, compressor.flush
+        else:
+            # wbits=31: formato gzip (cabeçalho + CRC)
+            compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+            self._compress, self._finish = compressor.compress, compressor.flush
+
+    def process(self, data: bytes, final: bool) -> bytes:
+        chunk = self._compress(data) if data else b""
+        if final:
+            chunk += self._finish()
+        return chunk
+
+
+class Compression:
+    """Negociação (zstd/br/gzip) e compressão do corpo, inclusive em streaming.
+
+    Pedaços grandes são comprimidos no threadpool para não travar o event
+    loop. Paths em `skip_prefixes` (assets servidos por
+    PrecompressedStaticFiles) nunca são comprimidos por requisição.
+    """
+
+    COMPRESSIBLE_TYPES = (
+        'text/', 'application/json', 'application/javascript',
+        'application/xml', 'application/rss+xml', 'image/svg+xml'
+    )
+
+    def __init__(self, minimum_size: int = 500, levels: Optional[Dict[str, int]] = None,
+                 offload_size: int = COMPRESSION_OFFLOAD_SIZE, skip_prefixes: Tuple[str, ...] = ()):
+        self.minimum_size = minimum_size
+        self.levels = {**DYNAMIC_LEVELS, **(levels or {})}
+        self.offload_size = offload_size
+        self.skip_prefixes = skip_prefixes
+        self.stats = {
+            "responses": {encoding: 0 for encoding in AVAILABLE_ENCODINGS},
+            "offloaded_chunks": 0,
+            "bytes_in": 0,
+            "bytes_out": 0
+        }
+        if brotli is None:
+            logger.warning("Brotli não disponível. Instale com: pip install brotli")
+
+    def negotiate(self, path: str, request_headers: Headers) -> Optional[str]:
+        accept_encoding = request_headers.get('accept-encoding')
+        if not accept_encoding or path.startswith(self.skip_prefixes):
+            return None
+        return negotiate(accept_encoding)
+
+    def should_compress(self, headers: MutableHeaders, first_chunk: bytes, more_body: bool) -> bool:
+        if 'content-encoding' in headers:
+            return False
+        content_type = headers.get('content-type', '')
+        if not content_type.startswith(self.COMPRESSIBLE_TYPES) or content_type.startswith('text/event-stream'):
+            return False
+        # Corpos em streaming são sempre comprimidos; corpos únicos só acima do mínimo
+        return more_body or len(first_chunk) >= self.minimum_size
+
+    def encoder(self, encoding: str) -> Encoder:
+        self.stats["responses"][encoding] += 1
+        return Encoder(encoding, self.levels[encoding])
+
+    async def compress(self, encoder: Encoder, data: bytes, final: bool) -> bytes:
+        if len(data) >= self.offload_size:
+            self.stats["offloaded_chunks"] += 1
+            chunk = await run_in_threadpool(encoder.process, data, final)
+        else:
+            chunk = encoder.process(data, final)
+        self.stats["bytes_in"] += len(data)
+        self.stats["bytes_out"] += len(chunk)
+        return chunk
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "responses": dict(self.stats["responses"]), "encodings": list(AVAILABLE_ENCODINGS)}
+
+
+def precompressed_path(path: Path, encoding: str) -> Path:
+    return path.with_name(path.name + PRECOMPRESSED_SUFFIXES[encoding])
+
+
+def precompress_file(path: Path) -> List[Path]:
+    """Gera as cópias .zst/.br/.gz de um asset de texto (no upload ou no build).
+
+    Cópias que não economizam o suficiente são removidas, para que uma versão
+    antiga nunca seja servida no lugar do arquivo atual.
+    """
+    path = Path(path)
+    if path.suffix.lower() not in PRECOMPRESSIBLE_EXTENSIONS:
+        return []
+    data = path.read_bytes()
+    written = []
+    for encoding in AVAILABLE_ENCODINGS:
+        target = precompressed_path(path, encoding)
+        compressed = compress_bytes(data, encoding, STATIC_LEVELS[encoding])
+        if len(compressed) > len(data) * PRECOMPRESS_MIN_RATIO:
+            target.unlink(missing_ok=True)
+            continue
+        # Escrita atômica: uma requisição concorrente nunca lê a cópia pela metade
+        temporary = target.with_name(target.name + ".tmp")
+        temporary.write_bytes(compressed)
+        os.replace(temporary, target)
+        written.append(target)
+    return written
+
+
+def precompress_directory(root: Path) -> int:
+    """Pré-comprime os assets de um diretório cujas cópias faltam ou estão desatualizadas"""
+    count = 0
+    for path in Path(root).rglob("*"):
+        if not path.is_file() or path.suffix.lower() not in PRECOMPRESSIBLE_EXTENSIONS:
+            continue
+        source_mtime = path.stat().st_mtime
+        siblings = [precompressed_path(path, encoding) for encoding in AVAILABLE_ENCODINGS]
+        if all(sibling.exists() and sibling.stat().st_mtime >= source_mtime for sibling in siblings):
+            continue
+        if precompress_file(path):
+            count += 1
+    return count
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles que serve a cópia .zst/.br/.gz do arquivo quando o cliente aceita.
+
+    As cópias são geradas por `precompress_file`/`precompress_directory`;
+    uma cópia mais antiga que o arquivo original é ignorada.
+    """
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        response = await super().get_response(path, scope)
+        if response.status_code != 200 or not isinstance(response, FileResponse):
+            return response
+        request_headers = Headers(scope=scope)
+        accept_encoding = request_headers.get("accept-encoding")
+        if not accept_encoding or Path(response.path).suffix.lower() not in PRECOMPRESSIBLE_EXTENSIONS:
+            return response
+
+        found = await run_in_threadpool(self._find_precompressed, response.path, accept_encoding)
+        if found is None:
+            return response
+        encoding, sibling, stat_result = found
+        precompressed = FileResponse(
+            sibling, stat_result=stat_result, media_type=response.media_type,
+            headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"}
+        )
+        if self.is_not_modified(precompressed.headers, request_headers):
+            return NotModifiedResponse(precompressed.headers)
+        return precompressed
+
+    @staticmethod
+    def _find_precompressed(path: str, accept_encoding: str) -> Optional[Tuple[str, str, os.stat_result]]:
+        source_mtime = os.stat(path).st_mtime
+        available = list(AVAILABLE_ENCODINGS)
+        # Negocia só entre as cópias existentes e atualizadas
+        while available:
+            encoding = negotiate(accept_encoding, tuple(available))
+            if encoding is None:
+                return None
+            sibling = path + PRECOMPRESSED_SUFFIXES[encoding]
+            try:
+                stat_result = os.stat(sibling)
+            except OSError:
+                stat_result = None
+            if stat_result is not None and stat_result.st_mtime >= source_mtime:
+                return encoding, sibling, stat_result
+            available.remove(encoding)
+        return None
+
+
+if __name__ == "__main__":
+    # Etapa de build: python -m src.compression static frontend/build
+    for directory in sys.argv[1:] or ["static"]:
+        if os.path.isdir(directory):
+            print(f"{directory}: {precompress_directory(Path(directory))} arquivo(s) pré-comprimido(s)")
@@ -193,6 +193,10 @@ def update_user(db: Session, user_id: str, user_update: schemas.UserUpdate | sch
             setattr(db_user, key, value)
         db.commit()
         db.refresh(db_user)
+        if "is_active" in update_data:
+            # Tokens em cache de um usuário desativado não podem continuar valendo
+            from .auth import invalidate_user_principals
+            invalidate_user_principals(user_id)
     return db_user
 
 # --- NOVAS FUNÇÕES CRUD PARA ITENS ---
@@ -330,4 +334,14 @@ def update_table_tokens_state(db: Session, table_id: str, tokens_state: list[sch
         db_table.tokens_state = [token.model_dump() for token in tokens_state]
         db.commit()
         db.refresh(db_table)
-    return db_table
\ No newline at end of file
+    return db_table
+
+def bulk_update_table_states(db: Session, states: dict[str, dict]):
+    """Grava o estado de várias mesas em uma única transação, sem SELECT nem refresh."""
+    if not states:
+        return
+    db.bulk_update_mappings(
+        models.Table,
+        [{"id": table_id, **fields} for table_id, fields in states.items()]
+    )
+    db.commit()
@@ -0,0 +1,111 @@
+# src/crud_async.py
+# Variantes assíncronas (AsyncSession) das funções de crud.py, para as rotas que
+# migrarem para get_async_db. Relacionamentos usados pelos schemas de resposta
+# são carregados antecipadamente: AsyncSession não faz lazy loading.
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from datetime import datetime
+import uuid
+
+from . import models, schemas
+
+def _table_load_options():
+    """Relacionamentos serializados por schemas.Table"""
+    return (
+        selectinload(models.Table.story).selectinload(models.Story.items),
+        selectinload(models.Table.story).selectinload(models.Story.monsters),
+        selectinload(models.Table.story).selectinload(models.Story.npcs),
+        selectinload(models.Table.players),
+        selectinload(models.Table.join_requests),
+    )
+
+# --- FUNÇÕES CRUD PARA USUÁRIOS ---
+async def get_user_by_username(db: AsyncSession, username: str):
+    result = await db.execute(select(models.User).filter(models.User.username == username))
+    return result.scalars().first()
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    from .password_hasher import password_hasher
+
+    # O hash é CPU-bound: roda no pool de processos, fora do event loop
+    hashed_password = await password_hasher.hash(user.password)
+    db_user = models.User(
+        id=str(uuid.uuid4()),
+        username=user.username,
+        email=user.email,
+        hashed_password=hashed_password
+    )
+    db.add(db_user)
+    await db.commit()
+    return db_user
+
+# --- FUNÇÕES CRUD PARA MESAS ---
+async def get_tables(db: AsyncSession, skip: int = 0, limit: int = 100):
+    result = await db.execute(
+        select(models.Table).options(*_table_load_options()).offset(skip).limit(limit)
+    )
+    return result.scalars().all()
+
+async def get_table(db: AsyncSession, table_id: str, with_relationships: bool = False):
+    """Busca uma mesa por ID; `with_relationships` carrega o que schemas.Table serializa."""
+    query = select(models.Table).filter(models.Table.id == table_id)
+    if with_relationships:
+        query = query.options(*_table_load_options())
+    result = await db.execute(query)
+    return result.scalars().first()
+
+async def create_table(db: AsyncSession, table: schemas.TableCreate, master_id: str):
+    db_table = models.Table(
+        id=str(uuid.uuid4()),
+        title=table.title,
+        description=table.description,
+        master_id=master_id,
+        story_id=table.story_id
+    )
+    db.add(db_table)
+    await db.commit()
+    return await get_table(db, db_table.id, with_relationships=True)
+
+async def update_table_tokens_state(db: AsyncSession, table_id: str, tokens_state: list[schemas.TokenState]):
+    """Atualiza o estado dos tokens de uma mesa específica."""
+    await db.execute(
+        update(models.Table)
+        .where(models.Table.id == table_id)
+        .values(tokens_state=[token.model_dump() for token in tokens_state])
+    )
+    await db.commit()
+
+async def bulk_update_table_states(db: AsyncSession, states: dict[str, dict]):
+    """Grava o estado de várias mesas em uma única transação, sem SELECT nem refresh."""
+    if not states:
+        return
+    await db.execute(
+        update(models.Table),
+        [{"id": table_id, **fields} for table_id, fields in states.items()]
+    )
+    await db.commit()
+
+# --- FUNÇÕES CRUD PARA PERSONAGENS ---
+async def get_characters_by_owner(db: AsyncSession, owner_id: str):
+    result = await db.execute(select(models.Character).filter(models.Character.owner_id == owner_id))
+    return result.scalars().all()
+
+# --- FUNÇÕES CRUD PARA TOKENS REVOGADOS ---
+async def get_revoked_token(db: AsyncSession, jti: str):
+    result = await db.execute(select(models.RevokedToken).filter(models.RevokedToken.jti == jti))
+    return result.scalars().first()
+
+async def create_revoked_token(db: AsyncSession, jti: str, user_id: str, token_type: str,
+                               reason: str, expires_at: datetime):
+    revoked_token = models.RevokedToken(
+        id=str(uuid.uuid4()),
+        jti=jti,
+        user_id=user_id,
+        token_type=token_type,
+        expires_at=expires_at,
+        reason=reason
+    )
+    db.add(revoked_token)
+    await db.commit()
+    return revoked_token
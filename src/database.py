@@ -1,16 +1,25 @@
 # src/database.py
+import logging
 import os
-from typing import Optional
+import time
+from typing import Any, Dict, Optional
 from urllib.parse import quote_plus
 
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+from .metrics import Histogram
+
 # Carrega variáveis de ambiente
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 def build_postgres_url_from_parts() -> Optional[str]:
     """Monta a URL de conexão usando partes fornecidas via variáveis de ambiente.
 
@@ -30,27 +39,198 @@ def build_postgres_url_from_parts() -> Optional[str]:
     return None
 
 
+def build_async_database_url(url: str) -> str:
+    """Converte a URL síncrona para o driver assíncrono equivalente.
+
+    PostgreSQL passa a usar asyncpg e SQLite passa a usar aiosqlite; o restante
+    da URL (credenciais, host, banco) é mantido.
+    """
+    scheme, sep, rest = url.partition("://")
+    if scheme.startswith("sqlite"):
+        return f"sqlite+aiosqlite{sep}{rest}"
+    if scheme in ("postgres", "postgresql") or scheme.startswith("postgresql+"):
+        return f"postgresql+asyncpg{sep}{rest}"
+    return url
+
+
 # Configuração do banco de dados
 # Prioriza DATABASE_URL pronta; se ausente, tenta montar a partir das partes; por fim, usa SQLite local
 DATABASE_URL = os.getenv("DATABASE_URL") or build_postgres_url_from_parts() or "sqlite:///./dungeon_keeper.db"
 
+# Pool de conexões (PostgreSQL e SQLite em arquivo)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+# PRAGMAs aplicados a cada conexão SQLite
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # negativo = KiB (64 MiB)
+
+# Tempo de espera no checkout de conexões, em ms
+POOL_WAIT_BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 250, 500, 1000, 5000, 30000)
+
+
+class PoolMetrics:
+    """Espera no checkout e timeouts de um pool de conexões"""
+
+    def __init__(self):
+        self.checkout_wait = Histogram(POOL_WAIT_BUCKETS_MS)
+        self.timeouts = 0
+
+
+sync_pool_metrics = PoolMetrics()
+async_pool_metrics = PoolMetrics()
+
+
+class _TimedPoolMixin:
+    """Mede quanto tempo cada checkout esperou por uma conexão livre.
+
+    As métricas ficam na classe porque o SQLAlchemy recria o pool com
+    `self.__class__` em `dispose()`.
+    """
+
+    metrics: PoolMetrics
+
+    def connect(self):
+        start_time = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            self.metrics.timeouts += 1
+            raise
+        finally:
+            self.metrics.checkout_wait.observe((time.perf_counter() - start_time) * 1000)
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    metrics = sync_pool_metrics
+
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    metrics = async_pool_metrics
+
+
+def is_sqlite_memory(url: str) -> bool:
+    return url.startswith("sqlite") and (":memory:" in url or url.split("://", 1)[-1] in ("", "/"))
+
+
+def _pool_options(url: str, pool_class) -> Dict[str, Any]:
+    """Opções de pool; SQLite em memória mantém o pool padrão (uma conexão por thread)"""
+    if is_sqlite_memory(url):
+        return {}
+    return {
+        "poolclass": pool_class,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL permite leituras concorrentes com um escritor; busy_timeout evita `database is locked`"""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+    finally:
+        cursor.close()
+
+
+def _configure_sqlite(sync_engine, url: str):
+    if url.startswith("sqlite") and not is_sqlite_memory(url):
+        event.listen(sync_engine, "connect", _apply_sqlite_pragmas)
+
+
 # Configurações específicas por tipo de banco
 if DATABASE_URL.startswith("sqlite"):
     engine = create_engine(
-        DATABASE_URL, connect_args={"check_same_thread": False}
+        DATABASE_URL,
+        connect_args={"check_same_thread": False},
+        **_pool_options(DATABASE_URL, TimedQueuePool)
     )
+    _configure_sqlite(engine, DATABASE_URL)
 else:
     # PostgreSQL
-    engine = create_engine(DATABASE_URL)
+    engine = create_engine(DATABASE_URL, **_pool_options(DATABASE_URL, TimedQueuePool))
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Engine assíncrona paralela, para rotas que migrarem para AsyncSession
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or build_async_database_url(DATABASE_URL)
+
+try:
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL, **_pool_options(ASYNC_DATABASE_URL, TimedAsyncQueuePool)
+    )
+    _configure_sqlite(async_engine.sync_engine, ASYNC_DATABASE_URL)
+    AsyncSessionLocal = async_sessionmaker(
+        async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+    )
+except ImportError as e:
+    # Driver async (asyncpg/aiosqlite) ausente: apenas as rotas síncronas funcionam
+    logger.warning(f"Engine assíncrona indisponível: {e}")
+    async_engine = None
+    AsyncSessionLocal = None
+
 Base = declarative_base()
 
+
+def _pool_stats(pool, metrics: PoolMetrics) -> Dict[str, Any]:
+    stats: Dict[str, Any] = {"pool_class": type(pool).__name__}
+    # Apenas pools com fila (QueuePool) expõem contagens
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "in_use": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": pool.overflow(),
+            "max_overflow": DB_MAX_OVERFLOW,
+            "timeouts": metrics.timeouts,
+            "checkout_wait_ms": metrics.checkout_wait.snapshot(),
+        })
+    return stats
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Uso dos pools de conexão para o /dashboard"""
+    stats = {"sync": _pool_stats(engine.pool, sync_pool_metrics)}
+    if async_engine is not None:
+        stats["async"] = _pool_stats(async_engine.pool, async_pool_metrics)
+    return stats
+
 # Dependência para obter a sessão do DB
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# Sessão assíncrona fora do escopo de uma requisição (cargas compartilhadas, tasks)
+def new_async_session() -> AsyncSession:
+    if AsyncSessionLocal is None:
+        raise RuntimeError("Engine assíncrona indisponível. Instale asyncpg (PostgreSQL) ou aiosqlite (SQLite).")
+    return AsyncSessionLocal()
+
+# Dependência para obter a sessão assíncrona do DB
+async def get_async_db():
+    async with new_async_session() as db:
+        yield db
+
+# Dependência para rotas com caminho síncrono de reserva: None sem engine assíncrona
+async def get_optional_async_db():
+    if AsyncSessionLocal is None:
+        yield None
+        return
+    async with AsyncSessionLocal() as db:
+        yield db
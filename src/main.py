@@ -1,11 +1,12 @@
 # src/main.py
 from fastapi import FastAPI, Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordRequestForm
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.middleware.gzip import GZipMiddleware
-from fastapi.staticfiles import StaticFiles
 from sqlalchemy.orm import Session
-from datetime import timedelta
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from datetime import datetime, timedelta
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
@@ -15,12 +16,13 @@ from sentry_sdk.integrations.fastapi import FastApiIntegration
 from sentry_sdk.integrations.starlette import StarletteIntegration
 import os
 
-from . import crud, models, schemas, auth
-from .database import engine, get_db
-from .routers import users, tables, characters, items, monsters, npcs, stories, backup, game_ws
-from .rate_limiter import cleanup_task
-from .middleware import RequestIDMiddleware, MetricsMiddleware
-from .optimization_middleware import OptimizationMiddleware, BrotliMiddleware, StaticOptimizationMiddleware
+from . import crud, crud_async, models, schemas, auth
+from .database import engine, get_db, get_optional_async_db, SessionLocal
+from .routers import users, tables, characters, items, monsters, npcs, stories, backup, game_ws, dice
+from .middleware import HTTPPipelineMiddleware, ResponseHeaderPolicy, http_metrics
+from .compression import Compression, PrecompressedStaticFiles
+from .password_hasher import PasswordHasherBusy
+from .responses import FastJSONResponse
 
 # Configuração do Sentry para observabilidade
 sentry_dsn = os.getenv("SENTRY_DSN")
@@ -45,32 +47,59 @@ limiter = Limiter(key_func=get_remote_address)
 app = FastAPI(
     title="Dungeon Keeper API",
     description="O motor para o seu universo de RPG.",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse  # JSON compacto serializado uma vez (orjson)
 )
 
 # Adiciona o rate limiter ao app
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
-# Adiciona middlewares de observabilidade e compressão
-app.add_middleware(StaticOptimizationMiddleware)  # Otimizações para assets estáticos
-app.add_middleware(BrotliMiddleware, minimum_size=500, quality=6)  # Compressão Brotli
-app.add_middleware(GZipMiddleware, minimum_size=1000)  # Compressão GZip fallback
-app.add_middleware(OptimizationMiddleware, enable_json_minification=True)  # Otimizações gerais
-app.add_middleware(RequestIDMiddleware)
-app.add_middleware(MetricsMiddleware)
+# Fila do bcrypt cheia: responde 503 na hora em vez de acumular logins esperando
+async def _password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    return FastJSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+app.add_exception_handler(PasswordHasherBusy, _password_hasher_busy_handler)
+
+# Compressão por requisição (zstd/br/gzip); assets estáticos usam as cópias pré-comprimidas
+response_compression = Compression(minimum_size=500, skip_prefixes=("/static/", "/avatars/"))
 
-# Inicia a task de limpeza do rate limiter WebSocket e WebSocket manager
+# Pipeline ASGI de observabilidade, headers e compressão (uma única camada)
+app.add_middleware(
+    HTTPPipelineMiddleware,
+    metrics=http_metrics,  # Request-id, X-Process-Time e métricas
+    header_policy=ResponseHeaderPolicy(),  # Headers de cache, segurança e assets estáticos
+    compression=response_compression,
+)
+
+# Inicia o WebSocket manager e a persistência write-behind
 @app.on_event("startup")
 async def startup_event():
     from .websocket_manager import initialize_websocket_manager
-    asyncio.create_task(cleanup_task())
+    from .write_behind import table_state_writer
+    from .revocation_filter import revocation_filter
+    from .password_hasher import password_hasher
     await initialize_websocket_manager()
+    table_state_writer.start()
+    await revocation_filter.start()
+    password_hasher.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     from .websocket_manager import cleanup_websocket_manager
+    from .write_behind import table_state_writer
+    from .revocation_filter import revocation_filter
+    await revocation_filter.stop()
+    # Grava o estado pendente das mesas antes de encerrar
+    await table_state_writer.stop()
     await cleanup_websocket_manager()
+    # Espera os hashes em andamento num thread para não travar o event loop
+    from .password_hasher import password_hasher
+    await asyncio.get_running_loop().run_in_executor(None, password_hasher.stop)
 
 # --- Configuração do CORS ---
 # Esta é a configuração que permite que seu frontend (localhost:3000)
@@ -91,7 +120,9 @@ app.add_middleware(
 )
 
 # Monte um diretório estático para servir as imagens de avatar
-app.mount("/avatars", StaticFiles(directory="static/avatars"), name="avatars")
+app.mount("/avatars", PrecompressedStaticFiles(directory="static/avatars"), name="avatars")
+# Mapas das mesas (/static/maps) e demais assets, com as cópias .zst/.br/.gz geradas no upload/build
+app.mount("/static", PrecompressedStaticFiles(directory="static"), name="static")
 
 # --- Inclusão dos Roteadores ---
 # Incluindo todos os roteadores que criamos.
@@ -104,6 +135,7 @@ app.include_router(monsters.router)
 app.include_router(npcs.router)
 app.include_router(stories.router)
 app.include_router(tables.router)
+app.include_router(dice.router)
 
 # --- Endpoints de Autenticação Refatorados ---
 @app.post("/api/v1/register", response_model=schemas.UserBase)
@@ -115,11 +147,62 @@ def register_user(request: Request, user_in: schemas.UserCreate, db: Session = D
     created_user = crud.create_user(db=db, user=user_in)
     return schemas.UserBase(username=created_user.username, email=created_user.email)
 
+# Caminho síncrono de reserva (threadpool) para quando a engine assíncrona
+# não está disponível (asyncpg/aiosqlite ausentes)
+def _authenticate_sync(username: str, password: str):
+    db = SessionLocal()
+    try:
+        return auth.authenticate_user(db, username, password)
+    finally:
+        db.close()
+
+def _rotate_refresh_token_sync(jti: str, username: str, user_id: str, expires_at: datetime):
+    db = SessionLocal()
+    try:
+        if auth.is_token_revoked(jti, db):
+            return None
+        user = crud.get_user_by_username(db, username=username)
+        if not user or not user.is_active:
+            return None
+        # Lido antes do commit da revogação, que expira a instância
+        principal = schemas.TokenData(username=user.username, user_id=user.id)
+        auth.revoke_token(jti, user_id, "refresh", "refresh_rotation", expires_at, db)
+        return principal
+    finally:
+        db.close()
+
+async def _rotate_refresh_token(db: Optional[AsyncSession], jti: str, username: str, user_id: str, expires_at: datetime):
+    """Revoga o refresh token atual (rotação) e retorna o dono, ou None se inválido"""
+    if db is None:
+        return await run_in_threadpool(_rotate_refresh_token_sync, jti, username, user_id, expires_at)
+    
+    # Verifica se o refresh token foi revogado
+    if await auth.is_token_revoked_async(jti, db):
+        return None
+    
+    # Busca o usuário
+    user = await crud_async.get_user_by_username(db, username=username)
+    if not user or not user.is_active:
+        return None
+    
+    await auth.revoke_token_async(jti, user_id, "refresh", "refresh_rotation", expires_at, db)
+    return schemas.TokenData(username=user.username, user_id=user.id)
+
+def _revoke_token_sync(jti: str, user_id: str, reason: str, expires_at: datetime):
+    db = SessionLocal()
+    try:
+        auth.revoke_token(jti, user_id, "refresh", reason, expires_at, db)
+    finally:
+        db.close()
+
 @app.post("/api/v1/token", response_model=schemas.TokenWithRefresh)
 @limiter.limit("5/minute")
-async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Optional[AsyncSession] = Depends(get_optional_async_db)):
     # Esta chamada deve usar a função centralizada do módulo auth
-    user = auth.authenticate_user(db, form_data.username, form_data.password)
+    if db is None:
+        user = await run_in_threadpool(_authenticate_sync, form_data.username, form_data.password)
+    else:
+        user = await auth.authenticate_user_async(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -158,24 +241,13 @@ def health_check():
 @app.get("/metrics")
 def get_metrics():
     """Endpoint para métricas básicas (pode ser usado pelo Prometheus)"""
-    # Obtém métricas do middleware
-    metrics_middleware = None
-    for middleware in app.user_middleware:
-        if hasattr(middleware, 'cls') and middleware.cls.__name__ == 'MetricsMiddleware':
-            metrics_middleware = middleware
-            break
-    
-    if metrics_middleware and hasattr(metrics_middleware, 'kwargs'):
-        middleware_instance = metrics_middleware.kwargs.get('app')
-        if hasattr(middleware_instance, 'request_count'):
-            return {
-                "total_requests": middleware_instance.request_count,
-                "total_errors": middleware_instance.error_count,
-                "average_response_time": middleware_instance.total_time / middleware_instance.request_count if middleware_instance.request_count > 0 else 0,
-                "error_rate": middleware_instance.error_count / middleware_instance.request_count if middleware_instance.request_count > 0 else 0,
-                "uptime": "running",
-                "version": "1.0.0"
-            }
+    # Métricas coletadas pelo pipeline HTTP
+    if http_metrics.request_count > 0:
+        return {
+            **http_metrics.get_stats(),
+            "uptime": "running",
+            "version": "1.0.0"
+        }
     
     return {
         "status": "metrics_available",
@@ -220,11 +292,37 @@ def get_dashboard_metrics(db: Session = Depends(get_db)):
     except Exception as e:
         db_metrics = {"error": str(e)}
     
+    # Métricas dos pools de conexão
+    from .database import get_pool_stats
+    pool_metrics = get_pool_stats()
+    
     # Métricas do Redis/Cache
     cache_metrics = cache.get_stats() if cache.is_available() else {"available": False}
+    from .cache import async_cache
+    from .cache_codec import TABLE_CODEC, TABLE_LIST_CODEC
+    cache_metrics["single_flight"] = async_cache.get_stats()
+    cache_metrics["codecs"] = {codec.name: codec.get_stats() for codec in (TABLE_CODEC, TABLE_LIST_CODEC)}
     
     # Métricas do WebSocket
+    from .room_ticker import room_ticker
     ws_metrics = websocket_manager.get_stats()
+    ws_metrics["tick"] = room_ticker.get_stats()
+    from .rate_limiter import ws_rate_limiter
+    ws_metrics["rate_limit"] = ws_rate_limiter.get_stats()
+    
+    # Métricas da persistência write-behind
+    from .write_behind import table_state_writer
+    write_behind_metrics = table_state_writer.get_stats()
+    
+    # Filtro de tokens revogados, cache de principals e pool do bcrypt
+    from .revocation_filter import revocation_filter
+    from .principal_cache import principal_cache
+    from .password_hasher import password_hasher
+    auth_metrics = {
+        "revocation_filter": revocation_filter.get_stats(),
+        "principal_cache": principal_cache.get_stats(),
+        "password_hasher": password_hasher.get_stats()
+    }
     
     # Métricas da aplicação
     app_metrics = {
@@ -237,15 +335,19 @@ def get_dashboard_metrics(db: Session = Depends(get_db)):
     return {
         "system": system_metrics,
         "database": db_metrics,
+        "database_pool": pool_metrics,
         "cache": cache_metrics,
         "websocket": ws_metrics,
+        "write_behind": write_behind_metrics,
+        "auth": auth_metrics,
+        "http": {**http_metrics.get_stats(), "compression": response_compression.get_stats()},
         "application": app_metrics
     }
 
 # Refresh token endpoint
 @app.post("/api/v1/refresh", response_model=schemas.TokenWithRefresh)
 @limiter.limit("10/minute")
-async def refresh_access_token(request: Request, refresh_request: schemas.RefreshTokenRequest, db: Session = Depends(get_db)):
+async def refresh_access_token(request: Request, refresh_request: schemas.RefreshTokenRequest, db: Optional[AsyncSession] = Depends(get_optional_async_db)):
     from jose import JWTError, jwt
     
     credentials_exception = HTTPException(
@@ -265,28 +367,21 @@ async def refresh_access_token(request: Request, refresh_request: schemas.Refres
         if username is None or user_id is None or jti is None or token_type != "refresh":
             raise credentials_exception
         
-        # Verifica se o refresh token foi revogado
-        if auth.is_token_revoked(jti, db):
-            raise credentials_exception
-        
-        # Busca o usuário
-        user = crud.get_user_by_username(db, username=username)
-        if not user or not user.is_active:
-            raise credentials_exception
-        
         # Revoga o refresh token atual (rotação)
         expires_at = datetime.utcfromtimestamp(payload.get("exp"))
-        auth.revoke_token(jti, user_id, "refresh", "refresh_rotation", expires_at, db)
+        principal = await _rotate_refresh_token(db, jti, username, user_id, expires_at)
+        if principal is None:
+            raise credentials_exception
         
         # Cria novos tokens
         access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
         refresh_token_expires = timedelta(days=auth.REFRESH_TOKEN_EXPIRE_DAYS)
         
         new_access_token = auth.create_access_token(
-            data={"sub": user.username, "user_id": user.id}, expires_delta=access_token_expires
+            data={"sub": principal.username, "user_id": principal.user_id}, expires_delta=access_token_expires
         )
         new_refresh_token = auth.create_refresh_token(
-            data={"sub": user.username, "user_id": user.id}, expires_delta=refresh_token_expires
+            data={"sub": principal.username, "user_id": principal.user_id}, expires_delta=refresh_token_expires
         )
         
         return {
@@ -301,7 +396,7 @@ async def refresh_access_token(request: Request, refresh_request: schemas.Refres
 # Logout endpoint
 @app.post("/api/v1/logout")
 @limiter.limit("10/minute")
-async def logout(request: Request, refresh_request: schemas.RefreshTokenRequest, current_user: schemas.TokenData = Depends(auth.get_current_user_from_token), db: Session = Depends(get_db)):
+async def logout(request: Request, refresh_request: schemas.RefreshTokenRequest, current_user: schemas.TokenData = Depends(auth.get_current_user_from_token), db: Optional[AsyncSession] = Depends(get_optional_async_db)):
     from jose import JWTError, jwt
     
     try:
@@ -312,7 +407,10 @@ async def logout(request: Request, refresh_request: schemas.RefreshTokenRequest,
         
         if jti:
             # Revoga o refresh token
-            auth.revoke_token(jti, current_user.user_id, "refresh", "logout", expires_at, db)
+            if db is None:
+                await run_in_threadpool(_revoke_token_sync, jti, current_user.user_id, "logout", expires_at)
+            else:
+                await auth.revoke_token_async(jti, current_user.user_id, "refresh", "logout", expires_at, db)
         
         return {"message": "Successfully logged out"}
         
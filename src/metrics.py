@@ -0,0 +1,57 @@
+# src/metrics.py
+import threading
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional
+
+# Limites padrão dos buckets em milissegundos
+DEFAULT_LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class Histogram:
+    """Histograma cumulativo com buckets fixos (no estilo Prometheus)"""
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_LATENCY_BUCKETS_MS):
+        self.buckets: List[float] = sorted(buckets)
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)  # último = +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Limite superior do bucket que contém o percentil (aproximado).
+
+        Retorna None quando o percentil cai acima do último bucket.
+        """
+        if self.count == 0:
+            return 0.0
+        target = fraction * self.count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return bound
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Resumo serializável para /dashboard e /metrics"""
+        cumulative = 0
+        buckets = {}
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            cumulative += bucket_count
+            buckets[f"le_{bound:g}"] = cumulative
+        buckets["le_inf"] = self.count
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "avg": self.sum / self.count if self.count else 0.0,
+            "p50": self.percentile(0.50),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "buckets": buckets
+        }
@@ -1,10 +1,16 @@
 # src/middleware.py
+import hashlib
 import uuid
 import time
 import logging
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
-from typing import Callable
+from email.utils import formatdate
+from typing import Any, Dict, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .compression import Compression, Encoder
+from .metrics import Histogram
 
 # Configuração de logging estruturado
 logging.basicConfig(
@@ -13,103 +19,266 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-class RequestIDMiddleware(BaseHTTPMiddleware):
-    """Middleware para adicionar request-id único a cada requisição"""
-    
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        # Gera um request-id único
-        request_id = str(uuid.uuid4())
-        
-        # Adiciona o request-id ao contexto da requisição
-        request.state.request_id = request_id
-        
-        # Adiciona headers de correlação
-        start_time = time.time()
-        
-        # Log da requisição de entrada
-        logger.info(
-            "Request started",
-            extra={
-                "request_id": request_id,
-                "method": request.method,
-                "url": str(request.url),
-                "client_ip": request.client.host if request.client else None,
-                "user_agent": request.headers.get("user-agent"),
-            }
-        )
-        
-        try:
-            # Processa a requisição
-            response = await call_next(request)
-            
-            # Calcula o tempo de processamento
-            process_time = time.time() - start_time
-            
-            # Adiciona o request-id ao header da resposta
-            response.headers["X-Request-ID"] = request_id
-            response.headers["X-Process-Time"] = str(process_time)
-            
-            # Log da resposta
+# Um ano, para assets com nome versionado
+STATIC_MAX_AGE = 31536000
+
+
+class HTTPMetrics:
+    """Contadores e latência das requisições HTTP (lidos por /metrics e /dashboard)"""
+
+    def __init__(self, log_every: int = 100):
+        self.log_every = log_every
+        self.request_count = 0
+        self.error_count = 0
+        self.total_time = 0.0
+        self.latency_ms = Histogram()
+
+    def record(self, process_time: float, failed: bool):
+        self.request_count += 1
+        if failed:
+            self.error_count += 1
+        self.total_time += process_time
+        self.latency_ms.observe(process_time * 1000)
+
+        # Log de métricas (pode ser enviado para sistema de monitoramento)
+        if self.request_count % self.log_every == 0:
+            stats = self.get_stats()
             logger.info(
-                "Request completed",
+                "Metrics update",
                 extra={
-                    "request_id": request_id,
-                    "status_code": response.status_code,
-                    "process_time": process_time,
+                    "total_requests": stats["total_requests"],
+                    "total_errors": stats["total_errors"],
+                    "average_response_time": stats["average_response_time"],
+                    "error_rate": stats["error_rate"]
                 }
             )
-            
-            return response
-            
+
+    def get_stats(self) -> Dict[str, Any]:
+        count = self.request_count
+        return {
+            "total_requests": count,
+            "total_errors": self.error_count,
+            "average_response_time": self.total_time / count if count else 0,
+            "error_rate": self.error_count / count if count else 0,
+            "latency_ms": self.latency_ms.snapshot()
+        }
+
+
+def static_etag(path: str, content_length: str, last_modified: str = '') -> str:
+    digest = hashlib.blake2b(
+        f"{path}\0{content_length}\0{last_modified}".encode(), digest_size=12
+    ).hexdigest()
+    return f'"{digest}"'
+
+
+class ResponseHeaderPolicy:
+    """Headers de cache, segurança e performance conforme o tipo do path"""
+
+    # Endpoints dinâmicos que mudam frequentemente
+    DYNAMIC_ENDPOINTS = ('/api/v1/tables', '/api/v1/characters', '/api/v1/users/me')
+
+    SECURITY_HEADERS = {
+        'X-Content-Type-Options': 'nosniff',
+        'X-Frame-Options': 'DENY',
+        'X-XSS-Protection': '1; mode=block',
+        'Referrer-Policy': 'strict-origin-when-cross-origin',
+        'X-DNS-Prefetch-Control': 'on',
+        'X-Permitted-Cross-Domain-Policies': 'none'
+    }
+
+    STATIC_CONTENT_TYPES = (
+        (('.js', '.mjs'), 'application/javascript; charset=utf-8'),
+        (('.css',), 'text/css; charset=utf-8'),
+        (('.svg',), 'image/svg+xml; charset=utf-8'),
+    )
+
+    def __init__(self, cache_headers: bool = True):
+        self.cache_headers = cache_headers
+        self.cache_policies = {
+            # API responses - cache curto
+            'api': {
+                'Cache-Control': 'public, max-age=300',  # 5 minutos
+                'Vary': 'Accept-Encoding, Authorization'
+            },
+            # Dados dinâmicos - sem cache
+            'dynamic': {
+                'Cache-Control': 'no-cache, no-store, must-revalidate',
+                'Pragma': 'no-cache',
+                'Expires': '0'
+            }
+        }
+
+    def kind(self, path: str) -> str:
+        """Determina o tipo de conteúdo baseado no path"""
+        if path.startswith('/static/'):
+            return 'static'
+        if path.startswith('/api/') and not path.startswith(self.DYNAMIC_ENDPOINTS):
+            return 'api'
+        return 'dynamic'
+
+    def apply(self, path: str, headers: MutableHeaders):
+        kind = self.kind(path)
+        if self.cache_headers:
+            if kind == 'static':
+                self._apply_static(path, headers)
+            else:
+                for key, value in self.cache_policies[kind].items():
+                    headers[key] = value
+        for key, value in self.SECURITY_HEADERS.items():
+            if key not in headers:
+                headers[key] = value
+
+    def _apply_static(self, path: str, headers: MutableHeaders):
+        # Cache agressivo para assets
+        headers['Cache-Control'] = f'public, max-age={STATIC_MAX_AGE}, immutable'
+        headers['Expires'] = formatdate(time.time() + STATIC_MAX_AGE, usegmt=True)
+        if 'etag' not in headers:
+            # ETag estável entre processos e reinícios: path, tamanho e data de modificação
+            headers['ETag'] = static_etag(
+                path, headers.get('content-length', '0'), headers.get('last-modified', '')
+            )
+        for suffixes, content_type in self.STATIC_CONTENT_TYPES:
+            if path.endswith(suffixes):
+                headers['Content-Type'] = content_type
+                return
+        if path.endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp')):
+            headers['Content-Type'] = f'image/{path.rsplit(".", 1)[-1]}'
+
+
+def _add_vary(headers: MutableHeaders, value: str):
+    vary = headers.get('vary')
+    if not vary:
+        headers['Vary'] = value
+    elif value.lower() not in (token.strip().lower() for token in vary.split(',')):
+        headers['Vary'] = f'{vary}, {value}'
+
+
+class HTTPPipelineMiddleware:
+    """Pipeline ASGI puro: request-id, tempo, métricas, headers e compressão.
+
+    Substitui as camadas BaseHTTPMiddleware empilhadas (uma task e um stream
+    por camada e por requisição, sem suporte a respostas em streaming). Cada
+    componente é opcional e todos atuam numa única passagem pelo `send`: o
+    início da resposta é retido até o primeiro pedaço do corpo só quando há
+    compressão a decidir.
+    """
+
+    def __init__(self, app: ASGIApp, metrics: Optional[HTTPMetrics] = None,
+                 header_policy: Optional[ResponseHeaderPolicy] = None,
+                 compression: Optional[Compression] = None, request_id: bool = True):
+        self.app = app
+        self.metrics = metrics
+        self.header_policy = header_policy
+        self.compression = compression
+        self.request_id = request_id
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        request_headers = Headers(scope=scope)
+        request_id = None
+        if self.request_id:
+            # Disponível nas rotas como request.state.request_id
+            request_id = str(uuid.uuid4())
+            scope.setdefault("state", {})["request_id"] = request_id
+            if logger.isEnabledFor(logging.INFO):
+                client = scope.get("client")
+                logger.info(
+                    "Request started",
+                    extra={
+                        "request_id": request_id,
+                        "method": scope["method"],
+                        "url": scope["path"],
+                        "client_ip": client[0] if client else None,
+                        "user_agent": request_headers.get("user-agent"),
+                    }
+                )
+
+        encoding = self.compression.negotiate(scope["path"], request_headers) if self.compression else None
+        status_code = 500
+        process_time = None
+        pending_start: Optional[Message] = None
+        encoder: Optional[Encoder] = None
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code, process_time, pending_start, encoder
+            message_type = message["type"]
+            if message_type == "http.response.start":
+                process_time = time.perf_counter() - start_time
+                status_code = message["status"]
+                headers = MutableHeaders(scope=message)
+                if request_id is not None:
+                    headers["X-Request-ID"] = request_id
+                headers["X-Process-Time"] = str(process_time)
+                if self.header_policy is not None:
+                    self.header_policy.apply(scope["path"], headers)
+                if encoding is None:
+                    await send(message)
+                else:
+                    # Espera o primeiro pedaço do corpo para decidir a compressão
+                    pending_start = message
+                return
+
+            if message_type != "http.response.body" or (pending_start is None and encoder is None):
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if pending_start is not None:
+                start, pending_start = pending_start, None
+                headers = MutableHeaders(scope=start)
+                if not self.compression.should_compress(headers, body, more_body):
+                    await send(start)
+                    await send(message)
+                    return
+                encoder = self.compression.encoder(encoding)
+                headers["Content-Encoding"] = encoding
+                _add_vary(headers, "Accept-Encoding")
+                if not more_body:
+                    compressed = await self.compression.compress(encoder, body, final=True)
+                    headers["Content-Length"] = str(len(compressed))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+                del headers["Content-Length"]
+                await send(start)
+
+            chunk = await self.compression.compress(encoder, body, final=not more_body)
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        failed = False
+        try:
+            await self.app(scope, receive, send_wrapper)
         except Exception as e:
-            # Log de erro
-            process_time = time.time() - start_time
+            failed = True
             logger.error(
                 "Request failed",
                 extra={
                     "request_id": request_id,
                     "error": str(e),
-                    "process_time": process_time,
+                    "process_time": time.perf_counter() - start_time,
                 },
                 exc_info=True
             )
             raise
-
-class MetricsMiddleware(BaseHTTPMiddleware):
-    """Middleware para coletar métricas básicas"""
-    
-    def __init__(self, app):
-        super().__init__(app)
-        self.request_count = 0
-        self.error_count = 0
-        self.total_time = 0.0
-    
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        start_time = time.time()
-        self.request_count += 1
-        
-        try:
-            response = await call_next(request)
-            
-            # Coleta métricas
-            process_time = time.time() - start_time
-            self.total_time += process_time
-            
-            # Log de métricas (pode ser enviado para sistema de monitoramento)
-            if self.request_count % 100 == 0:  # Log a cada 100 requisições
-                avg_time = self.total_time / self.request_count
+        finally:
+            total_time = time.perf_counter() - start_time
+            if self.metrics is not None:
+                self.metrics.record(total_time, failed or status_code >= 500)
+            if request_id is not None and not failed and logger.isEnabledFor(logging.INFO):
                 logger.info(
-                    "Metrics update",
+                    "Request completed",
                     extra={
-                        "total_requests": self.request_count,
-                        "total_errors": self.error_count,
-                        "average_response_time": avg_time,
-                        "error_rate": self.error_count / self.request_count if self.request_count > 0 else 0
+                        "request_id": request_id,
+                        "status_code": status_code,
+                        "process_time": process_time,
                     }
                 )
-            
-            return response
-            
-        except Exception as e:
-            self.error_count += 1
-            raise
\ No newline at end of file
+
+
+# Métricas globais do pipeline HTTP
+http_metrics = HTTPMetrics()
@@ -0,0 +1,201 @@
+# src/password_hasher.py
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+from passlib.context import CryptContext
+
+from .metrics import Histogram
+
+# Carrega variáveis de ambiente
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Processos dedicados ao bcrypt; 0 usa threads (ex.: testes, ambientes sem fork/spawn)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# Hashes/verificações admitidos ao mesmo tempo (executando + na fila); acima disso, 503
+PASSWORD_HASH_MAX_PENDING = int(
+    os.getenv("PASSWORD_HASH_MAX_PENDING", str(max(1, PASSWORD_HASH_WORKERS) * 4))
+)
+# Segundos sugeridos no Retry-After quando a fila está cheia
+PASSWORD_HASH_RETRY_AFTER = int(os.getenv("PASSWORD_HASH_RETRY_AFTER", "1"))
+
+# --- Contexto de Senha ---
+# Usado também dentro dos processos do pool (importam só este módulo)
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+class PasswordHasherBusy(Exception):
+    """Fila de hashes cheia: o cliente deve tentar de novo mais tarde (HTTP 503)."""
+
+    def __init__(self, retry_after: int = PASSWORD_HASH_RETRY_AFTER):
+        super().__init__("Serviço de autenticação sobrecarregado")
+        self.retry_after = retry_after
+
+
+# Funções executadas nos processos do pool: retornam (resultado, início, fim) em
+# time.time(), comparável entre processos, para medir a espera na fila
+def _hash_in_worker(password: str) -> Tuple[str, float, float]:
+    started = time.time()
+    hashed = pwd_context.hash(password)
+    return hashed, started, time.time()
+
+
+def _verify_in_worker(plain_password: str, hashed_password: str) -> Tuple[bool, float, float]:
+    started = time.time()
+    valid = pwd_context.verify(plain_password, hashed_password)
+    return valid, started, time.time()
+
+
+def _warm_up() -> int:
+    # Carrega o backend do bcrypt antes do primeiro login
+    pwd_context.handler().get_backend()
+    return os.getpid()
+
+
+class PasswordHasher:
+    """Hash e verificação de senhas num pool de processos, com admissão limitada.
+
+    O bcrypt é CPU-bound e, em threads, disputa o GIL com o event loop e as
+    demais rotas. Aqui ele roda em processos separados; quando `max_pending`
+    operações já estão admitidas, novas chamadas falham imediatamente com
+    PasswordHasherBusy em vez de se acumularem na fila.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._pool: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self.queue_wait_ms = Histogram()
+        self.hash_ms = Histogram()
+        self.stats = {
+            "submitted": 0,
+            "completed": 0,
+            "rejected": 0,
+            "failed": 0,
+            "pool_restarts": 0
+        }
+
+    def _executor(self) -> Executor:
+        if self._pool is None:
+            if self.workers > 0:
+                # spawn: o processo da API tem threads (Redis, write-behind) que não devem ser copiadas por fork
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=max(1, os.cpu_count() or 1), thread_name_prefix="password-hash"
+                )
+        return self._pool
+
+    def start(self):
+        """Cria o pool e sobe os processos antes do primeiro login"""
+        with self._lock:
+            pool = self._executor()
+        if self.workers > 0:
+            for _ in range(self.workers):
+                pool.submit(_warm_up)
+
+    def stop(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _submit(self, fn: Callable, *args) -> Tuple[Future, float]:
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.stats["rejected"] += 1
+                raise PasswordHasherBusy()
+            self.pending += 1
+            self.stats["submitted"] += 1
+            submitted_at = time.time()
+            try:
+                try:
+                    future = self._executor().submit(fn, *args)
+                except BrokenProcessPool:
+                    # Um processo morreu (ex.: OOM): recria o pool uma vez
+                    logger.error("Pool de hash de senhas quebrado, recriando")
+                    self.stats["pool_restarts"] += 1
+                    self._pool.shutdown(wait=False, cancel_futures=True)
+                    self._pool = None
+                    future = self._executor().submit(fn, *args)
+            except Exception:
+                self.pending -= 1
+                raise
+        # Libera a vaga quando o trabalho termina, mesmo se quem esperava desistiu
+        future.add_done_callback(self._release)
+        return future, submitted_at
+
+    def _release(self, future: Future):
+        with self._lock:
+            self.pending -= 1
+
+    def _finish(self, outcome: Tuple[Any, float, float], submitted_at: float) -> Any:
+        result, started, finished = outcome
+        # Chamado por várias threads (rotas síncronas) e pelo event loop ao mesmo tempo
+        with self._lock:
+            self.queue_wait_ms.observe(max(0.0, started - submitted_at) * 1000)
+            self.hash_ms.observe((finished - started) * 1000)
+            self.stats["completed"] += 1
+        return result
+
+    def _record_failure(self):
+        with self._lock:
+            self.stats["failed"] += 1
+
+    def _wait_sync(self, future: Future, submitted_at: float) -> Any:
+        try:
+            outcome = future.result()
+        except Exception:
+            self._record_failure()
+            raise
+        return self._finish(outcome, submitted_at)
+
+    async def _wait(self, future: Future, submitted_at: float) -> Any:
+        try:
+            outcome = await asyncio.wrap_future(future)
+        except Exception:
+            self._record_failure()
+            raise
+        return self._finish(outcome, submitted_at)
+
+    async def hash(self, password: str) -> str:
+        return await self._wait(*self._submit(_hash_in_worker, password))
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._wait(*self._submit(_verify_in_worker, plain_password, hashed_password))
+
+    def hash_sync(self, password: str) -> str:
+        """Para rotas síncronas (threadpool): a thread espera sem segurar o GIL"""
+        return self._wait_sync(*self._submit(_hash_in_worker, password))
+
+    def verify_sync(self, plain_password: str, hashed_password: str) -> bool:
+        return self._wait_sync(*self._submit(_verify_in_worker, plain_password, hashed_password))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.stats,
+                "workers": self.workers,
+                "processes": self.workers > 0,
+                "pending": self.pending,
+                "max_pending": self.max_pending,
+                "queue_wait_ms": self.queue_wait_ms.snapshot(),
+                "hash_ms": self.hash_ms.snapshot()
+            }
+
+
+# Instância global do pool de hash de senhas
+password_hasher = PasswordHasher()
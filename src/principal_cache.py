@@ -0,0 +1,114 @@
+# src/principal_cache.py
+import hashlib
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Set
+
+from dotenv import load_dotenv
+
+from . import schemas
+from .cache import TTLCache
+
+# Carrega variáveis de ambiente
+load_dotenv()
+
+# Tokens verificados mantidos por processo
+AUTH_PRINCIPAL_CACHE_SIZE = int(os.getenv("AUTH_PRINCIPAL_CACHE_SIZE", "20000"))
+# Sem o canal de revogações, revogações e desativações feitas em outras
+# instâncias não chegam aqui: as entradas vivem no máximo este tempo
+AUTH_PRINCIPAL_CACHE_UNSYNCED_TTL = float(
+    os.getenv("AUTH_PRINCIPAL_CACHE_UNSYNCED_TTL", os.getenv("WS_AUTH_CACHE_TTL", "15"))
+)
+
+
+@dataclass
+class VerifiedToken:
+    """Claims de um token com assinatura verificada e não revogado."""
+
+    jti: str
+    user_id: str
+    username: str
+    token_data: schemas.TokenData
+    # Preenchido pela primeira rota que precisa do usuário ativo
+    principal: Optional[schemas.UserPrincipal] = None
+
+
+def token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+
+class PrincipalCache:
+    """Tokens verificados por digest (SHA-256), até o `exp` de cada um.
+
+    Um hit dispensa `jwt.decode`, a checagem de revogação e, quando o
+    principal já foi carregado, o SELECT do usuário. Índices por JTI e por
+    usuário permitem descartar as entradas quando o token é revogado ou o
+    usuário é desativado.
+    """
+
+    def __init__(self, maxsize: int = AUTH_PRINCIPAL_CACHE_SIZE):
+        self.entries = TTLCache(maxsize=maxsize, ttl=AUTH_PRINCIPAL_CACHE_UNSYNCED_TTL, on_evict=self._unindex)
+        self._by_jti: Dict[str, bytes] = {}
+        self._by_user: Dict[str, Set[bytes]] = {}
+        # Ordem de locks: sempre este, depois o do TTLCache (on_evict roda com os dois)
+        self._lock = threading.RLock()
+        self.evictions = 0
+
+    def get(self, token: str) -> Optional[VerifiedToken]:
+        digest = token_digest(token)
+        with self._lock:
+            return self.entries.get(digest)
+
+    def put(self, token: str, jti: str, user_id: str, username: str,
+            expires_at: float, synced: bool) -> VerifiedToken:
+        """Guarda o token verificado; `synced` indica que revogações de outras instâncias chegam"""
+        entry = VerifiedToken(
+            jti=jti, user_id=user_id, username=username,
+            token_data=schemas.TokenData(username=username, user_id=user_id)
+        )
+        ttl = expires_at - time.time()
+        if not synced:
+            ttl = min(ttl, AUTH_PRINCIPAL_CACHE_UNSYNCED_TTL)
+        if ttl > 0:
+            digest = token_digest(token)
+            with self._lock:
+                self.entries.set(digest, entry, ttl=ttl)
+                self._by_jti[jti] = digest
+                self._by_user.setdefault(user_id, set()).add(digest)
+        return entry
+
+    def _unindex(self, digest: bytes, entry: VerifiedToken):
+        if self._by_jti.get(entry.jti) == digest:
+            del self._by_jti[entry.jti]
+        digests = self._by_user.get(entry.user_id)
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                del self._by_user[entry.user_id]
+
+    def evict_token(self, jti: str):
+        with self._lock:
+            digest = self._by_jti.get(jti)
+            if digest is not None and self.entries.delete(digest):
+                self.evictions += 1
+
+    def evict_user(self, user_id: str):
+        with self._lock:
+            for digest in list(self._by_user.get(user_id, ())):
+                if self.entries.delete(digest):
+                    self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self._by_jti.clear()
+            self._by_user.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.entries.get_stats(), "evictions": self.evictions}
+
+
+# Instância global do cache de principals
+principal_cache = PrincipalCache()
@@ -1,73 +1,153 @@
 # src/rate_limiter.py
-from typing import Dict, List
-from datetime import datetime, timedelta
-from collections import defaultdict
-import asyncio
+import heapq
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+# Carrega variáveis de ambiente
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# "local" (por processo) ou "redis" (limite único para todo o cluster)
+WS_RATE_LIMIT_BACKEND = os.getenv("WS_RATE_LIMIT_BACKEND", "local")
+# Acima deste número de chaves, as expiradas são descartadas na próxima inserção
+WS_RATE_LIMIT_MAX_KEYS = int(os.getenv("WS_RATE_LIMIT_MAX_KEYS", "100000"))
+
+RATE_LIMIT_KEY_PREFIX = "ratelimit:ws:"
+
+# GCRA atômico no Redis. KEYS[1] = chave; ARGV = intervalo e tolerância em ms.
+# O relógio é o do Redis, comum a todas as instâncias.
+GCRA_LUA = """
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + tonumber(t[2]) / 1000
+local tat = tonumber(redis.call('GET', KEYS[1])) or now
+if tat < now then
+    tat = now
+end
+if tat - now > tolerance then
+    return 0
+end
+local new_tat = tat + interval
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil(new_tat - now))
+return 1
+"""
+
 
 class WebSocketRateLimiter:
-    """Rate limiter para eventos WebSocket"""
-    
-    def __init__(self):
-        # Armazena timestamps dos eventos por usuário e tipo
-        self.events: Dict[str, Dict[str, List[datetime]]] = defaultdict(lambda: defaultdict(list))
-        # Configurações de limite por tipo de evento
+    """Rate limiter para eventos WebSocket (GCRA).
+
+    Cada chave (usuário, evento) guarda apenas o "theoretical arrival time":
+    permite `count` eventos em rajada e depois um a cada `window / count`
+    segundos. Chaves expiradas equivalem a chaves ausentes, então não há
+    varredura periódica.
+    """
+
+    def __init__(self, backend: str = WS_RATE_LIMIT_BACKEND, max_keys: int = WS_RATE_LIMIT_MAX_KEYS):
+        # Configurações de limite por tipo de evento (janela em segundos)
         self.limits = {
-            "chat": {"count": 20, "window": timedelta(seconds=10)},
-            "dice_roll": {"count": 20, "window": timedelta(seconds=10)},
-            "map_move": {"count": 10, "window": timedelta(seconds=5)},
-            "update_tokens": {"count": 10, "window": timedelta(seconds=5)}
+            "chat": {"count": 20, "window": 10},
+            "dice_roll": {"count": 20, "window": 10},
+            "map_move": {"count": 10, "window": 5},
+            "update_tokens": {"count": 10, "window": 5}
         }
-    
-    def is_allowed(self, user_id: str, event_type: str) -> bool:
+        if backend not in ("local", "redis"):
+            logger.warning(f"Backend de rate limit desconhecido '{backend}', usando local")
+            backend = "local"
+        self.backend = backend
+        self.max_keys = max_keys
+        # (user_id, event_type) -> TAT (time.monotonic)
+        self.tat: Dict[Tuple[str, str], float] = {}
+        # Heap (TAT, chave) para descartar só as chaves expiradas, sem varrer o dict;
+        # entradas antigas de uma chave (TAT já substituído) são ignoradas ao sair
+        self._expiry: List[Tuple[float, Tuple[str, str]]] = []
+        self._script = None
+        self._script_client = None
+        self.stats = {
+            "allowed": 0,
+            "limited": 0,
+            "redis_errors": 0
+        }
+
+    def _params(self, event_type: str) -> Tuple[float, float]:
+        """Intervalo de emissão e tolerância de rajada, em segundos"""
+        config = self.limits[event_type]
+        interval = config["window"] / config["count"]
+        return interval, config["window"] - interval
+
+    def _allow_local(self, user_id: str, event_type: str) -> bool:
+        interval, tolerance = self._params(event_type)
+        now = time.monotonic()
+        key = (user_id, event_type)
+        tat = max(self.tat.get(key, now), now)
+
+        if tat - now > tolerance:
+            return False
+
+        if key not in self.tat and len(self.tat) >= self.max_keys:
+            self._prune(now)
+        self.tat[key] = tat + interval
+        heapq.heappush(self._expiry, (tat + interval, key))
+        if len(self._expiry) > 2 * len(self.tat) + 1024:
+            self._compact()
+        return True
+
+    def _prune(self, now: float):
+        """Descarta chaves cujo TAT já passou (estado idêntico a nunca ter enviado)"""
+        expiry = self._expiry
+        while expiry and expiry[0][0] <= now:
+            tat, key = heapq.heappop(expiry)
+            if self.tat.get(key) == tat:
+                del self.tat[key]
+
+    def _compact(self):
+        # Chaves muito ativas acumulam entradas antigas no heap: refaz a partir do dict
+        self._expiry = [(tat, key) for key, tat in self.tat.items()]
+        heapq.heapify(self._expiry)
+
+    def _redis_client(self):
+        from .websocket_manager import websocket_manager
+        return websocket_manager.redis_client
+
+    async def _allow_redis(self, client, user_id: str, event_type: str) -> bool:
+        if self._script is None or self._script_client is not client:
+            self._script = client.register_script(GCRA_LUA)
+            self._script_client = client
+        interval, tolerance = self._params(event_type)
+        result = await self._script(
+            keys=[f"{RATE_LIMIT_KEY_PREFIX}{event_type}:{user_id}"],
+            args=[interval * 1000, tolerance * 1000]
+        )
+        return int(result) == 1
+
+    async def is_allowed(self, user_id: str, event_type: str) -> bool:
         """Verifica se o usuário pode executar o evento"""
         if event_type not in self.limits:
             return True
-        
-        now = datetime.now()
-        limit_config = self.limits[event_type]
-        window_start = now - limit_config["window"]
-        
-        # Remove eventos antigos
-        self.events[user_id][event_type] = [
-            timestamp for timestamp in self.events[user_id][event_type]
-            if timestamp > window_start
-        ]
-        
-        # Verifica se está dentro do limite
-        if len(self.events[user_id][event_type]) >= limit_config["count"]:
-            return False
-        
-        # Adiciona o evento atual
-        self.events[user_id][event_type].append(now)
-        return True
-    
-    def cleanup_old_events(self):
-        """Remove eventos antigos para economizar memória"""
-        now = datetime.now()
-        max_window = max(config["window"] for config in self.limits.values())
-        cutoff = now - max_window
-        
-        for user_id in list(self.events.keys()):
-            for event_type in list(self.events[user_id].keys()):
-                self.events[user_id][event_type] = [
-                    timestamp for timestamp in self.events[user_id][event_type]
-                    if timestamp > cutoff
-                ]
-                
-                # Remove listas vazias
-                if not self.events[user_id][event_type]:
-                    del self.events[user_id][event_type]
-            
-            # Remove usuários sem eventos
-            if not self.events[user_id]:
-                del self.events[user_id]
+
+        allowed: Optional[bool] = None
+        if self.backend == "redis":
+            client = self._redis_client()
+            if client is not None:
+                try:
+                    allowed = await self._allow_redis(client, user_id, event_type)
+                except Exception as e:
+                    # Redis indisponível: aplica o limite local desta instância
+                    self.stats["redis_errors"] += 1
+                    logger.warning(f"Rate limit Redis indisponível, usando local: {e}")
+        if allowed is None:
+            allowed = self._allow_local(user_id, event_type)
+
+        self.stats["allowed" if allowed else "limited"] += 1
+        return allowed
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "backend": self.backend, "local_keys": len(self.tat)}
 
 # Instância global do rate limiter
 ws_rate_limiter = WebSocketRateLimiter()
-
-# Task para limpeza periódica
-async def cleanup_task():
-    """Task que roda a cada 5 minutos para limpar eventos antigos"""
-    while True:
-        await asyncio.sleep(300)  # 5 minutos
-        ws_rate_limiter.cleanup_old_events()
\ No newline at end of file
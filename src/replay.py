@@ -0,0 +1,330 @@
+# src/replay.py
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from .ws_codec import Frame
+
+# Carrega variáveis de ambiente
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Eventos recentes guardados por sala (memória e stream Redis); 0 desativa o replay
+# (os eventos continuam numerados: a sequência da sala também numera os deltas de token)
+WS_REPLAY_BUFFER_SIZE = int(os.getenv("WS_REPLAY_BUFFER_SIZE", "500"))
+# Tempo de vida do stream e da sequência de uma sala sem eventos novos
+WS_REPLAY_STREAM_TTL = int(os.getenv("WS_REPLAY_STREAM_TTL", "3600"))
+
+REPLAY_SEQ_KEY_PREFIX = "replay:seq:"
+REPLAY_STREAM_KEY_PREFIX = "replay:stream:"
+REPLAY_POS_KEY_PREFIX = "replay:pos:"
+
+# A sequência da sala é o primeiro campo do evento: lida sem decodificar o JSON
+ROOM_SEQ_PREFIX = '{"room_seq":'
+
+# Registra um evento já numerado pela instância: avança a sequência da sala (nunca
+# para trás), dá ao evento a próxima posição da sala, grava no stream e publica.
+# A sequência (`s`, vista pelos clientes) é local e pode se repetir entre instâncias
+# que emitem ao mesmo tempo; a posição (`p`, INCR aqui dentro) é única e segue a
+# ordem em que o Redis executa, a mesma em que o canal entrega os eventos.
+# KEYS: sequência, stream, canal, posição
+# ARGV: instance_id, evento numerado, seq, tamanho, TTL (s)
+RECORD_AND_PUBLISH_LUA = """
+local seq = tonumber(ARGV[3])
+if seq > tonumber(redis.call('GET', KEYS[1]) or '0') then
+    redis.call('SET', KEYS[1], seq, 'EX', ARGV[5])
+else
+    redis.call('EXPIRE', KEYS[1], ARGV[5])
+end
+local pos = redis.call('INCR', KEYS[4])
+redis.call('EXPIRE', KEYS[4], ARGV[5])
+if tonumber(ARGV[4]) > 0 then
+    redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[4], '*',
+               's', seq, 'p', pos, 'i', ARGV[1], 'd', ARGV[2])
+    redis.call('EXPIRE', KEYS[2], ARGV[5])
+end
+redis.call('PUBLISH', KEYS[3], ARGV[1] .. ' ' .. pos .. '\\n' .. ARGV[2])
+return pos
+"""
+
+# Entradas extras lidas do stream além do intervalo pedido (eventos fora de ordem)
+STREAM_READ_SLACK = 16
+
+
+def can_sequence(frame: Frame) -> bool:
+    """Só objetos JSON não vazios recebem `room_seq`"""
+    text = frame.json
+    return text.startswith("{") and text != "{}"
+
+
+def stamp(frame: Frame, seq: int) -> Frame:
+    """Insere `room_seq` como primeiro campo (mesma forma gerada pelo script Lua)"""
+    return Frame.from_json(f"{ROOM_SEQ_PREFIX}{seq},{frame.json[1:]}")
+
+
+def unstamp(json_text: str) -> Tuple[Optional[int], str]:
+    """Separa `room_seq` do evento; retorna (None, json) para eventos sem sequência"""
+    if not json_text.startswith(ROOM_SEQ_PREFIX):
+        return None, json_text
+    seq_text, _, rest = json_text[len(ROOM_SEQ_PREFIX):].partition(",")
+    try:
+        return int(seq_text), "{" + rest
+    except ValueError:
+        return None, json_text
+
+
+class ReplayBuffer:
+    """Janela dos últimos eventos sequenciados de uma sala.
+
+    Eventos de instâncias diferentes podem chegar fora de ordem, e duas
+    instâncias que emitem ao mesmo tempo podem usar o mesmo número (ambos os
+    eventos são guardados); lacunas só fazem `since` recorrer ao stream Redis
+    ou ao snapshot.
+    """
+
+    __slots__ = ("size", "events", "first_seq", "last_seq")
+
+    def __init__(self, size: int):
+        self.size = size
+        self.events: Dict[int, List[Frame]] = {}
+        self.first_seq = 0
+        self.last_seq = 0
+
+    def append(self, seq: int, frame: Frame):
+        if self.events and seq < self.first_seq:
+            return  # Antigo demais para a janela
+        if not self.events or seq - self.last_seq > self.size:
+            # Primeiro evento ou salto maior que a janela: recomeça dela
+            self.events.clear()
+            self.first_seq = seq
+        self.events.setdefault(seq, []).append(frame)
+        self.last_seq = max(self.last_seq, seq)
+
+        # Mantém no máximo `size` posições, da mais antiga para a mais nova
+        while self.last_seq - self.first_seq >= self.size:
+            self.events.pop(self.first_seq, None)
+            self.first_seq += 1
+
+    def since(self, seq: int) -> Optional[List[Frame]]:
+        """Eventos posteriores a `seq`, ou None se a janela não cobre o intervalo.
+
+        Um número usado por duas instâncias não serve de cursor (não se sabe
+        qual dos eventos o cliente viu) e também retorna None.
+        """
+        if len(self.events.get(seq, ())) > 1:
+            return None
+        if seq == self.last_seq:
+            return []
+        if not self.events or seq < self.first_seq - 1 or seq > self.last_seq:
+            return None
+        frames = []
+        for missing_seq in range(seq + 1, self.last_seq + 1):
+            events = self.events.get(missing_seq)
+            if events is None:
+                return None
+            frames.extend(events)
+        return frames
+
+
+class RoomReplayLog:
+    """Sequência por sala, buffers de replay e o stream Redis de cada sala.
+
+    A numeração é local (sem ida ao Redis antes do broadcast): o contador da
+    sala é semeado do Redis quando ela abre nesta instância (`seed`) e avança
+    com os eventos das outras instâncias (`record_remote`). A gravação no
+    stream e a publicação saem depois, em lote (`publish`).
+
+    A ordem total da sala é a posição dada pelo script de publicação: cada
+    instância acompanha a última posição vista (`advance`) e, diante de um
+    salto, relê do stream as posições que faltam (`read_positions`).
+    """
+
+    def __init__(self, size: int = WS_REPLAY_BUFFER_SIZE, stream_ttl: int = WS_REPLAY_STREAM_TTL):
+        self.size = size
+        self.stream_ttl = stream_ttl
+        self.buffers: Dict[str, ReplayBuffer] = {}
+        # Último número usado ou visto por sala
+        self.local_seq: Dict[str, int] = {}
+        # Última posição (ordem total do cluster) vista por sala
+        self.positions: Dict[str, int] = {}
+        self._script = None
+        self._script_client = None
+        self.stats = {
+            "events_sequenced": 0,
+            "events_published": 0,
+            "resumes_from_memory": 0,
+            "resumes_from_stream": 0,
+            "resumes_snapshot": 0
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def _buffer(self, room_id: str) -> ReplayBuffer:
+        buffer = self.buffers.get(room_id)
+        if buffer is None:
+            buffer = self.buffers[room_id] = ReplayBuffer(self.size)
+        return buffer
+
+    async def seed(self, redis_client, room_id: str):
+        """Alinha o contador local com a sequência da sala no cluster"""
+        if redis_client is None:
+            return
+        try:
+            current, position = await redis_client.mget(
+                f"{REPLAY_SEQ_KEY_PREFIX}{room_id}", f"{REPLAY_POS_KEY_PREFIX}{room_id}"
+            )
+        except Exception as e:
+            logger.warning(f"Erro ao ler sequência da sala {room_id}: {e}")
+            return
+        current = int(current or 0)
+        if current > self.local_seq.get(room_id, 0):
+            self.local_seq[room_id] = current
+        self.positions.setdefault(room_id, int(position or 0))
+
+    def advance(self, room_id: str, position: int) -> Optional[int]:
+        """Registra a posição de um evento recebido do canal.
+
+        Retorna a última posição vista quando há um salto (eventos perdidos
+        entre as duas), ou None. Uma posição menor ou igual à última indica
+        contador reiniciado (chave expirada) ou evento já coberto pelo `seed`:
+        a sala passa a seguir o contador.
+        """
+        last = self.positions.get(room_id)
+        self.positions[room_id] = position
+        if last is not None and position > last + 1:
+            return last
+        return None
+
+    def reserve(self, room_id: str) -> int:
+        """Próximo número da sala, sem ida ao Redis"""
+        seq = self.local_seq.get(room_id, 0) + 1
+        self.local_seq[room_id] = seq
+        return seq
+
+    def release(self, room_id: str, seq: int):
+        """Devolve um número reservado que não chegou a ser usado, se ainda for o último"""
+        if self.local_seq.get(room_id) == seq:
+            self.local_seq[room_id] = seq - 1
+
+    def record(self, room_id: str, seq: int, frame: Frame) -> Frame:
+        stamped = stamp(frame, seq)
+        if self.enabled:
+            self._buffer(room_id).append(seq, stamped)
+        self.stats["events_sequenced"] += 1
+        return stamped
+
+    def record_remote(self, room_id: str, seq: int, stamped: Frame):
+        """Guarda um evento já numerado por outra instância"""
+        if seq > self.local_seq.get(room_id, 0):
+            self.local_seq[room_id] = seq
+        if self.enabled:
+            self._buffer(room_id).append(seq, stamped)
+
+    async def publish(self, redis_client, instance_id: str, batch: List[Tuple[str, str, Optional[int], str]]):
+        """Grava no stream e publica um lote de (canal, sala, seq, evento JSON) em uma ida ao Redis"""
+        if self._script is None or self._script_client is not redis_client:
+            self._script = redis_client.register_script(RECORD_AND_PUBLISH_LUA)
+            self._script_client = redis_client
+        pipe = redis_client.pipeline(transaction=False)
+        for channel, room_id, seq, event_json in batch:
+            if seq is None:
+                pipe.publish(channel, f"{instance_id}\n{event_json}")
+            else:
+                await self._script(
+                    keys=[
+                        f"{REPLAY_SEQ_KEY_PREFIX}{room_id}", f"{REPLAY_STREAM_KEY_PREFIX}{room_id}",
+                        channel, f"{REPLAY_POS_KEY_PREFIX}{room_id}"
+                    ],
+                    args=[instance_id, event_json, seq, self.size, self.stream_ttl],
+                    client=pipe
+                )
+        await pipe.execute()
+        self.stats["events_published"] += len(batch)
+
+    async def current_seq(self, redis_client, room_id: str) -> int:
+        local = self.local_seq.get(room_id, 0)
+        if redis_client is not None:
+            try:
+                return max(int(await redis_client.get(f"{REPLAY_SEQ_KEY_PREFIX}{room_id}") or 0), local)
+            except Exception as e:
+                logger.warning(f"Erro ao ler sequência da sala {room_id}: {e}")
+        buffer = self.buffers.get(room_id)
+        return max(local, buffer.last_seq if buffer else 0)
+
+    async def since(self, redis_client, room_id: str, seq: int) -> Optional[List[Frame]]:
+        """Eventos perdidos após `seq`: memória, depois stream Redis; None pede snapshot"""
+        buffer = self.buffers.get(room_id)
+        current = await self.current_seq(redis_client, room_id)
+        if seq > current:
+            # Cursor de outra "vida" da sala (sequência expirou ou reiniciou)
+            self.stats["resumes_snapshot"] += 1
+            return None
+
+        if buffer is not None and buffer.last_seq >= current:
+            frames = buffer.since(seq)
+            if frames is not None:
+                self.stats["resumes_from_memory"] += 1
+                return frames
+
+        if redis_client is not None and current - seq <= self.size:
+            frames = await self._read_stream(redis_client, room_id, seq, current)
+            if frames is not None:
+                self.stats["resumes_from_stream"] += 1
+                return frames
+
+        self.stats["resumes_snapshot"] += 1
+        return None
+
+    async def _read_stream(self, redis_client, room_id: str, seq: int, current: int) -> Optional[List[Frame]]:
+        try:
+            # Os eventos mais recentes cobrem o intervalo (inclusive `seq`, para detectar número repetido)
+            entries = await redis_client.xrevrange(
+                f"{REPLAY_STREAM_KEY_PREFIX}{room_id}", count=current - seq + 1 + STREAM_READ_SLACK
+            )
+        except Exception as e:
+            logger.warning(f"Erro ao ler stream de replay da sala {room_id}: {e}")
+            return None
+        by_seq: Dict[int, List[str]] = {}
+        for _, fields in reversed(entries):
+            by_seq.setdefault(int(fields["s"]), []).append(fields["d"])
+        if len(by_seq.get(seq, ())) > 1:
+            return None
+        # Falta algum número: o trecho já foi aparado do stream
+        if any(missing_seq not in by_seq for missing_seq in range(seq + 1, current + 1)):
+            return None
+        return [Frame.from_json(data) for event_seq in range(seq + 1, current + 1) for data in by_seq[event_seq]]
+
+    async def read_positions(self, redis_client, room_id: str, after: int,
+                             upto: int) -> Optional[List[Tuple[int, str, str]]]:
+        """(posição, instância, evento JSON) com posição em (after, upto], na ordem.
+
+        Pode faltar parte do intervalo (aparada do stream ou publicada sem
+        stream); None se o Redis falhar.
+        """
+        count = min(upto - after, self.size) + STREAM_READ_SLACK
+        try:
+            entries = await redis_client.xrevrange(f"{REPLAY_STREAM_KEY_PREFIX}{room_id}", count=count)
+        except Exception as e:
+            logger.warning(f"Erro ao ler stream de replay da sala {room_id}: {e}")
+            return None
+        events = []
+        for _, fields in entries:
+            position = int(fields.get("p", 0))
+            if after < position <= upto:
+                events.append((position, fields["i"], fields["d"]))
+        events.sort()
+        return events
+
+    def discard(self, room_id: str):
+        """Libera a sala desta instância (o stream Redis continua disponível)"""
+        self.buffers.pop(room_id, None)
+        self.local_seq.pop(room_id, None)
+        self.positions.pop(room_id, None)
+
+    def get_stats(self):
+        return {**self.stats, "enabled": self.enabled, "buffer_size": self.size, "rooms": len(self.buffers)}
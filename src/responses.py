@@ -0,0 +1,60 @@
+# src/responses.py
+import re
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+# orjson é opcional: sem ele as respostas usam o json da biblioteca padrão
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+# Floats que o orjson grafa diferente do json padrão: notação científica
+# (1e16 vs 1e+16, 1e-7 vs 1e-07) e 0.0000x (json escreve 1e-05). As buscas
+# começam por literais para não percorrer o corpo caractere a caractere
+_EXPONENT_RE = re.compile(rb"e-?\d+(?:[,}\]]|\Z)")
+_SMALL_FLOAT_RE = re.compile(rb"(?:^|[:,\[])-?0\.0000")
+_NUMBER_CHARS = frozenset(b"0123456789.-")
+_NUMBER_START = frozenset(b":,[")
+
+
+def _spells_floats_differently(body: bytes) -> bool:
+    """Se algum float do corpo teria outra grafia no json padrão.
+
+    Um acerto dentro de uma string (ex.: ",12e5") só custa a serialização
+    pelo caminho padrão, nunca uma resposta diferente.
+    """
+    if b"0.0000" in body and _SMALL_FLOAT_RE.search(body):
+        return True
+    for match in _EXPONENT_RE.finditer(body):
+        end = start = match.start()
+        while start and body[start - 1] in _NUMBER_CHARS:
+            start -= 1
+        # Um número JSON começa no início do corpo ou depois de ":", "," ou "["
+        if start < end and (start == 0 or body[start - 1] in _NUMBER_START):
+            return True
+    return False
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON compacto serializado uma única vez, com orjson quando disponível.
+
+    Mesmos bytes do JSONResponse (UTF-8 sem escapes, separadores compactos):
+    floats em notação científica e inteiros acima de 64 bits voltam para o
+    json padrão. Única diferença: NaN e Infinity saem como null, onde o
+    JSONResponse levanta ValueError.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            try:
+                body = orjson.dumps(content, option=_ORJSON_OPTIONS)
+            except TypeError:
+                pass
+            else:
+                if not _spells_floats_differently(body):
+                    return body
+        return super().render(content)
@@ -0,0 +1,276 @@
+# src/revocation_filter.py
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from dotenv import load_dotenv
+
+# Carrega variáveis de ambiente
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+REVOCATION_FILTER_ENABLED = os.getenv("REVOCATION_FILTER_ENABLED", "true").lower() == "true"
+# Capacidade = revogações esperadas por dia x vida do refresh token (o mais longo)
+REVOKED_TOKENS_PER_DAY = int(os.getenv("REVOKED_TOKENS_PER_DAY", "10000"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+REVOCATION_FILTER_ERROR_RATE = float(os.getenv("REVOCATION_FILTER_ERROR_RATE", "0.001"))
+# Um Bloom filter não remove itens: a reconstrução periódica descarta os JTIs já expirados
+REVOCATION_FILTER_REBUILD_INTERVAL = float(os.getenv("REVOCATION_FILTER_REBUILD_INTERVAL", "21600"))
+# Intervalo entre tentativas de reconstrução enquanto o filtro não está pronto
+REVOCATION_FILTER_RETRY_INTERVAL = float(os.getenv("REVOCATION_FILTER_RETRY_INTERVAL", "5"))
+# Canal em que cada instância anuncia os JTIs que revogou
+REVOCATION_CHANNEL = os.getenv("REVOCATION_CHANNEL", "auth:revoked")
+# Mensagens do canal com este prefixo anunciam usuário alterado/desativado, não um JTI
+USER_MESSAGE_PREFIX = "user:"
+
+
+class BloomFilter:
+    """Bloom filter de strings (duplo hashing sobre um blake2b de 128 bits)."""
+
+    __slots__ = ("capacity", "size", "hashes", "bits", "count")
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = max(1, capacity)
+        # m = -n ln p / (ln 2)^2 bits e k = m/n ln 2 funções de hash
+        self.size = max(8, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str) -> List[int]:
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationFilter:
+    """JTIs revogados e ainda não expirados, para pular a consulta exata de revogação.
+
+    Um negativo do filtro dispensa Redis e banco; positivos (revogados ou
+    falsos positivos) seguem para a consulta exata. Revogações são anunciadas
+    no canal REVOCATION_CHANNEL. Enquanto o filtro não está pronto (antes do
+    startup, sem Redis para ouvir as outras instâncias, ou depois de uma falha
+    no canal até a próxima reconstrução) todo token vai para a consulta exata.
+
+    `listeners` recebem (tipo, valor) para cada evento, locais ou de outras
+    instâncias: ("token", jti), ("user", user_id) e ("reset", None) quando
+    eventos podem ter se perdido.
+    """
+
+    def __init__(self, enabled: bool = REVOCATION_FILTER_ENABLED,
+                 capacity: int = REVOKED_TOKENS_PER_DAY * max(1, REFRESH_TOKEN_EXPIRE_DAYS),
+                 error_rate: float = REVOCATION_FILTER_ERROR_RATE):
+        self.enabled = enabled
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.filter = BloomFilter(capacity, error_rate)
+        self.ready = False
+        self.redis_client = None
+        self.task: Optional[asyncio.Task] = None
+        self._listener = None
+        self._lock = threading.Lock()
+        # JTIs recebidos durante uma reconstrução (entram também no filtro novo)
+        self._pending: Optional[Set[str]] = None
+        # Falhas do canal; uma reconstrução só deixa o filtro pronto se nenhuma ocorreu durante ela
+        self._channel_errors = 0
+        self.listeners: List[Callable[[str, Optional[str]], None]] = []
+        self.stats = {
+            "negatives": 0,
+            "positives": 0,
+            "bypassed": 0,
+            "peer_updates": 0,
+            "user_updates": 0,
+            "rebuilds": 0,
+            "channel_errors": 0
+        }
+
+    def might_be_revoked(self, jti: str) -> bool:
+        """False só quando o JTI certamente não foi revogado"""
+        if not self.ready:
+            self.stats["bypassed"] += 1
+            return True
+        if jti in self.filter:
+            self.stats["positives"] += 1
+            return True
+        self.stats["negatives"] += 1
+        return False
+
+    def add(self, jti: str):
+        with self._lock:
+            self.filter.add(jti)
+            if self._pending is not None:
+                self._pending.add(jti)
+        self._notify("token", jti)
+
+    def _notify(self, kind: str, value: Optional[str]):
+        for listener in self.listeners:
+            try:
+                listener(kind, value)
+            except Exception as e:
+                logger.error(f"Erro em listener de revogação: {e}")
+
+    def publish(self, jti: str):
+        """Anuncia a revogação às outras instâncias (cliente síncrono, rotas em threadpool)"""
+        if self.redis_client is None:
+            return
+        try:
+            self.redis_client.publish(REVOCATION_CHANNEL, jti)
+        except Exception as e:
+            logger.error(f"Erro ao anunciar revogação do token {jti}: {e}")
+
+    def user_changed(self, user_id: str):
+        """Avisa esta e as outras instâncias que um usuário foi alterado (ex.: desativado)"""
+        self._notify("user", user_id)
+        if self.redis_client is None:
+            return
+        try:
+            self.redis_client.publish(REVOCATION_CHANNEL, f"{USER_MESSAGE_PREFIX}{user_id}")
+        except Exception as e:
+            logger.error(f"Erro ao anunciar alteração do usuário {user_id}: {e}")
+
+    async def publish_async(self, jti: str):
+        """Anuncia a revogação pelo pool asyncio compartilhado (ou pelo cliente síncrono no threadpool)"""
+        from .cache import async_cache
+
+        client = async_cache.redis_client
+        if client is None:
+            await asyncio.get_running_loop().run_in_executor(None, self.publish, jti)
+            return
+        try:
+            await client.publish(REVOCATION_CHANNEL, jti)
+        except Exception as e:
+            logger.error(f"Erro ao anunciar revogação do token {jti}: {e}")
+
+    async def start(self):
+        """Assina o canal de revogações, carrega o filtro do banco e agenda as reconstruções"""
+        from .cache import cache
+
+        if not self.enabled:
+            return
+        if not cache.is_available():
+            logger.warning("Filtro de revogação desativado: sem Redis para ouvir as outras instâncias")
+            return
+
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._subscribe, cache.redis_client)
+        except Exception as e:
+            logger.warning(f"Filtro de revogação desativado: {e}")
+            return
+        # Assina antes de ler o banco: nenhuma revogação cai entre os dois
+        try:
+            await loop.run_in_executor(None, self.rebuild)
+        except Exception as e:
+            logger.error(f"Erro ao carregar o filtro de revogação (nova tentativa em breve): {e}")
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    def _subscribe(self, redis_client):
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{REVOCATION_CHANNEL: self._on_message})
+        self._listener = pubsub.run_in_thread(
+            sleep_time=1.0, daemon=True, exception_handler=self._on_channel_error
+        )
+        self.redis_client = redis_client
+
+    def _on_message(self, message: Dict[str, Any]):
+        data = message["data"]
+        if data.startswith(USER_MESSAGE_PREFIX):
+            self._notify("user", data[len(USER_MESSAGE_PREFIX):])
+            self.stats["user_updates"] += 1
+            return
+        self.add(data)
+        self.stats["peer_updates"] += 1
+
+    def _on_channel_error(self, error: Exception, pubsub, thread):
+        # Revogações de outras instâncias podem ter se perdido: volta à consulta exata
+        logger.warning(f"Erro no canal de revogações: {error}")
+        self._channel_errors += 1
+        self.stats["channel_errors"] += 1
+        self.ready = False
+        self._notify("reset", None)
+        time.sleep(1.0)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(REVOCATION_FILTER_REBUILD_INTERVAL if self.ready else REVOCATION_FILTER_RETRY_INTERVAL)
+            try:
+                await loop.run_in_executor(None, self.rebuild)
+            except Exception as e:
+                logger.error(f"Erro ao reconstruir o filtro de revogação: {e}")
+
+    def rebuild(self):
+        """Recria o filtro a partir dos tokens revogados ainda não expirados"""
+        from .database import SessionLocal
+        from .models import RevokedToken
+
+        errors_before = self._channel_errors
+        with self._lock:
+            self._pending = set()
+        try:
+            db = SessionLocal()
+            try:
+                rows = db.query(RevokedToken.jti).filter(RevokedToken.expires_at > datetime.utcnow()).all()
+            finally:
+                db.close()
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+
+        rebuilt = BloomFilter(max(self.capacity, 2 * len(rows)), self.error_rate)
+        for (jti,) in rows:
+            rebuilt.add(jti)
+        with self._lock:
+            for jti in self._pending:
+                rebuilt.add(jti)
+            self._pending = None
+            self.filter = rebuilt
+            self.ready = self._channel_errors == errors_before
+        self.stats["rebuilds"] += 1
+        logger.info(f"Filtro de revogação carregado com {len(rows)} token(s)")
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+        self.ready = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "ready": self.ready,
+            "entries": self.filter.count,
+            "capacity": self.filter.capacity,
+            "bits": self.filter.size,
+            "hashes": self.filter.hashes
+        }
+
+
+# Instância global do filtro
+revocation_filter = RevocationFilter()
@@ -0,0 +1,128 @@
+# src/room_ticker.py
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from dotenv import load_dotenv
+
+from .websocket_manager import websocket_manager
+
+# Carrega variáveis de ambiente
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Intervalo do tick por sala em ms (ex.: 33 ou 50); 0 desativa a coalescência
+WS_TICK_INTERVAL_MS = int(os.getenv("WS_TICK_INTERVAL_MS", "0"))
+
+# Recebe (room_id, itens pendentes, room_seq do frame) e retorna os eventos a enviar no tick
+TickHandler = Callable[[str, List[Any], int], Awaitable[List[Dict[str, Any]]]]
+
+
+class _PendingTick:
+    """Itens recebidos durante um tick, na ordem de chegada"""
+
+    __slots__ = ("items", "slots")
+
+    def __init__(self):
+        self.items: List[Any] = []
+        # chave de coalescência -> posição em `items`
+        self.slots: Dict[Hashable, int] = {}
+
+
+class RoomTicker:
+    """Coalesce tráfego posicional por sala e emite um único frame por tick.
+
+    Itens com a mesma chave dentro de um tick são substituídos pelo mais
+    recente, mantendo a posição original. Cada sala só tem task ativa
+    enquanto houver itens pendentes.
+    """
+
+    def __init__(self, handler: Optional[TickHandler] = None, interval_ms: int = WS_TICK_INTERVAL_MS):
+        self.handler = handler
+        self.interval = interval_ms / 1000
+        self.pending: Dict[str, _PendingTick] = {}
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.stats = {
+            "ticks": 0,
+            "items_received": 0,
+            "items_coalesced": 0
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0 and self.handler is not None
+
+    def set_handler(self, handler: TickHandler):
+        self.handler = handler
+
+    def submit(self, room_id: str, item: Any, key: Optional[Hashable] = None):
+        """Agenda um item para o próximo tick; `key` permite substituir o pendente anterior"""
+        pending = self.pending.setdefault(room_id, _PendingTick())
+        self.stats["items_received"] += 1
+
+        if key is not None and key in pending.slots:
+            pending.items[pending.slots[key]] = item
+            self.stats["items_coalesced"] += 1
+        else:
+            pending.items.append(item)
+            if key is not None:
+                pending.slots[key] = len(pending.items) - 1
+
+        task = self.tasks.get(room_id)
+        if task is None or task.done():
+            self.tasks[room_id] = asyncio.create_task(self._run(room_id))
+
+    def release(self, room_id: str, key: Optional[Hashable] = None):
+        """Impede que próximos itens com `key` (ou qualquer chave, se None) substituam os já pendentes"""
+        pending = self.pending.get(room_id)
+        if pending is None:
+            return
+        if key is None:
+            pending.slots.clear()
+        else:
+            pending.slots.pop(key, None)
+
+    async def _run(self, room_id: str):
+        try:
+            while room_id in self.pending:
+                await asyncio.sleep(self.interval)
+                await self._tick(room_id)
+        finally:
+            if self.tasks.get(room_id) is asyncio.current_task():
+                del self.tasks[room_id]
+
+    async def _tick(self, room_id: str):
+        pending = self.pending.pop(room_id, None)
+        if not pending or not pending.items:
+            return
+
+        self.stats["ticks"] += 1
+        # Os eventos do tick (ex.: deltas de token) levam a sequência do próprio frame
+        seq = websocket_manager.replay.reserve(room_id)
+        try:
+            events = await self.handler(room_id, pending.items, seq)
+            if events:
+                await websocket_manager.broadcast_to_room(room_id, {"type": "tick", "events": events}, seq=seq)
+            else:
+                websocket_manager.replay.release(room_id, seq)
+        except Exception as e:
+            websocket_manager.replay.release(room_id, seq)
+            logger.error(f"Erro no tick da sala {room_id}: {e}")
+
+    async def flush_room(self, room_id: str):
+        """Processa imediatamente os itens pendentes da sala (ex.: ao fechar a sala)"""
+        await self._tick(room_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "interval_ms": int(self.interval * 1000),
+            "rooms_pending": len(self.pending)
+        }
+
+
+# Instância global do ticker (o handler é registrado pelo router do jogo)
+room_ticker = RoomTicker()
@@ -6,13 +6,13 @@ from .. import crud, schemas, auth, database
 router = APIRouter(
     prefix="/api/v1/backup",
     tags=["backup"],
-    dependencies=[Depends(auth.get_current_active_user)]
+    dependencies=[Depends(auth.get_current_active_principal)]
 )
 
 @router.get("/export", response_model=schemas.UserBackup)
 def export_user_data(
     db: Session = Depends(database.get_db),
-    current_user: schemas.User = Depends(auth.get_current_active_user)
+    current_user: schemas.UserPrincipal = Depends(auth.get_current_active_principal)
 ):
     """Exporta todos os dados criados pelo usuário logado."""
     # Usamos as funções CRUD que já existem!
@@ -35,7 +35,7 @@ def export_user_data(
 def import_user_data(
     file: UploadFile = File(...),
     db: Session = Depends(database.get_db),
-    current_user: schemas.User = Depends(auth.get_current_active_user)
+    current_user: schemas.UserPrincipal = Depends(auth.get_current_active_principal)
 ):
     """Importa dados de um arquivo de backup JSON para o usuário logado."""
     try:
@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+
+from .. import schemas, auth
+from ..systems.dice import DiceSyntaxError, analyze
+
+router = APIRouter(
+    prefix="/api/v1/dice",
+    tags=["dice"],
+    dependencies=[Depends(auth.get_current_user_from_token)]
+)
+
+@router.get("/distribution", response_model=schemas.DiceAnalysis)
+def get_dice_distribution(
+    expression: str,
+    target: Optional[int] = None,
+    damage: Optional[str] = None
+):
+    """Distribuição exata (PMF, CDF, média e percentis) de uma expressão de dados.
+
+    Com `target` (CA ou CD) retorna a chance de sucesso; com `damage`, também o dano esperado.
+    """
+    try:
+        return analyze(expression, target=target, damage=damage)
+    except DiceSyntaxError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -1,61 +1,148 @@
 # src/routers/game_ws.py
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-import json
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 import asyncio
-from typing import Dict, List
+import logging
+import os
+import time
+from typing import Dict, List, Optional
 
-from .. import auth, models
-from ..database import get_db
+from .. import auth, models, schemas
+from ..cache import TTLCache
+from ..database import SessionLocal
 from ..websocket_manager import websocket_manager
 from ..rate_limiter import ws_rate_limiter
+from ..ws_codec import Frame, decode_client_message
+from ..token_store import TableTokenStore, token_stores, normalize_delta, TokenDeltaError
+from ..write_behind import table_state_writer
+from ..room_ticker import room_ticker
+from ..systems.dice import DiceSyntaxError, roll as roll_dice
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-@router.websocket("/ws/game/{table_id}")
-async def websocket_endpoint(
-    websocket: WebSocket,
-    table_id: str,
-    token: str = Query(...),
-    db: Session = Depends(get_db)
-):
+# Cache curto da existência das mesas consultadas no handshake
+WS_TABLE_CACHE_TTL = float(os.getenv("WS_TABLE_CACHE_TTL", "30"))
+_table_exists_cache = TTLCache(maxsize=10000, ttl=WS_TABLE_CACHE_TTL)
+
+def _table_exists(table_id: str) -> bool:
+    db = SessionLocal()
+    try:
+        return db.query(models.Table.id).filter(models.Table.id == table_id).first() is not None
+    finally:
+        db.close()
+
+def _load_tokens_state(table_id: str) -> Optional[List[Dict]]:
+    db = SessionLocal()
+    try:
+        row = db.query(models.Table.tokens_state).filter(models.Table.id == table_id).first()
+        return row.tokens_state if row else None
+    finally:
+        db.close()
+
+async def _handshake(websocket: WebSocket, table_id: str, token: str) -> Optional[schemas.TokenData]:
+    """Autentica, verifica a mesa e conecta; nenhuma consulta ao banco roda no event loop"""
+    # Instância lotada: recusa antes de gastar com JWT e banco
+    if websocket_manager.at_capacity():
+        await websocket_manager.reject_busy(websocket)
+        return None
+    
     # Valida o token JWT
     try:
-        current_user = auth.get_current_user_from_token_string(token, db)
+        current_user = await auth.get_websocket_principal(token)
         if not current_user:
             await websocket.close(code=1008, reason="Token inválido")
-            return
+            return None
     except Exception as e:
         await websocket.close(code=1008, reason=f"Erro de autenticação: {str(e)}")
-        return
+        return None
     
     # Verifica se a mesa existe
-    table = db.query(models.Table).filter(models.Table.id == table_id).first()
-    if not table:
-        await websocket.close(code=1008, reason="Mesa não encontrada")
-        return
+    if _table_exists_cache.get(table_id) is None:
+        if not await run_in_threadpool(_table_exists, table_id):
+            await websocket.close(code=1008, reason="Mesa não encontrada")
+            return None
+        _table_exists_cache.set(table_id, True)
     
     # Conecta o WebSocket com clustering
     await websocket_manager.connect(websocket, table_id, current_user.user_id)
     
+    # Estado autoritativo dos tokens: lido do banco só se a mesa ainda não está em memória.
+    # A leitura acontece após o connect, quando a sala não pode mais ser descartada.
+    await _ensure_token_store(table_id)
+    return current_user
+
+async def _ensure_token_store(table_id: str) -> TableTokenStore:
+    """Store de tokens da mesa, carregado do banco se ainda não está em memória"""
+    store = token_stores.get(table_id)
+    if store is None:
+        tokens_state = await run_in_threadpool(_load_tokens_state, table_id)
+        # O estado persistido vale a partir da sequência atual da sala
+        room_seq = await websocket_manager.replay.current_seq(websocket_manager.redis_client, table_id)
+        store = token_stores.load(table_id, tokens_state, room_seq)
+        # O banco pode estar atrás dos deltas ainda não gravados (write-behind):
+        # reaplica o que o stream da sala ainda guarda
+        websocket_manager.request_resync(table_id)
+    return store
+
+async def _sync_tokens(websocket: WebSocket, table_id: str, since: int):
+    """Envia os deltas posteriores a `since`, ou o snapshot se o histórico não cobre o intervalo"""
+    store = await _ensure_token_store(table_id)
+    deltas = store.deltas_since(since)
+    if deltas is None:
+        websocket_manager.send_to_connection(websocket, store.snapshot())
+    else:
+        for token_event in deltas:
+            websocket_manager.send_to_connection(websocket, token_event)
+
+@router.websocket("/ws/game/{table_id}")
+async def websocket_endpoint(
+    websocket: WebSocket,
+    table_id: str,
+    token: str = Query(...),
+    last_seq: Optional[int] = Query(None)
+):
     try:
+        # Falhas depois do connect (ex.: leitura do estado dos tokens) também
+        # passam pelo disconnect e pela limpeza da sala abaixo
+        handshake_start = time.perf_counter()
+        current_user = await _handshake(websocket, table_id, token)
+        websocket_manager.handshake_latency.observe((time.perf_counter() - handshake_start) * 1000)
+        if current_user is None:
+            return
+        
+        # Reconexão com `last_seq` recebe só o que perdeu; os demais recebem o snapshot
+        if last_seq is None or not await _resume(websocket, table_id, last_seq):
+            await _send_room_snapshot(websocket, table_id)
+        
         while True:
-            # Recebe mensagem do cliente
-            data = await websocket.receive_text()
+            # Recebe mensagem do cliente (texto JSON ou binário MessagePack)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            data = message.get("text")
+            if data is None:
+                data = message.get("bytes")
             
             try:
-                message_data = json.loads(data)
+                message_data = decode_client_message(data)
                 message_type = message_data.get("type")
                 
+                # Qualquer mensagem prova que a conexão está viva; pong não conta como atividade
+                websocket_manager.touch(websocket, activity=message_type != "pong")
+                if message_type == "pong":
+                    continue
+                
                 # Rate limiting por tipo de mensagem
                 user_id = current_user.user_id
                 
                 if message_type == "chat":
-                    if not ws_rate_limiter.is_allowed(user_id, "chat"):
-                        await websocket.send_text(json.dumps({
+                    if not await ws_rate_limiter.is_allowed(user_id, "chat"):
+                        websocket_manager.send_to_connection(websocket, {
                             "type": "error",
                             "message": "Rate limit excedido para chat. Aguarde um momento."
-                        }))
+                        })
                         continue
                     
                     # Processa mensagem de chat
@@ -67,55 +154,105 @@ async def websocket_endpoint(
                         "timestamp": asyncio.get_event_loop().time()
                     }
                     
+                    target_user_id = message_data.get("target_user_id")
+                    if target_user_id:
+                        # Sussurro: só o destinatário (em qualquer instância) e o remetente recebem
+                        chat_message["target_user_id"] = target_user_id
+                        chat_message["whisper"] = True
+                        if not await websocket_manager.send_to_user(target_user_id, chat_message, room_id=table_id):
+                            websocket_manager.send_to_connection(websocket, {
+                                "type": "error",
+                                "message": "Destinatário não está conectado à mesa."
+                            })
+                            continue
+                        websocket_manager.send_to_connection(websocket, chat_message)
+                        continue
+                    
                     # Envia para todos na mesa (todas as instâncias)
-                    await websocket_manager.broadcast_to_room(table_id, json.dumps(chat_message))
+                    await websocket_manager.broadcast_to_room(table_id, chat_message)
                 
                 elif message_type == "dice_roll":
-                    if not ws_rate_limiter.is_allowed(user_id, "dice_roll"):
-                        await websocket.send_text(json.dumps({
+                    if not await ws_rate_limiter.is_allowed(user_id, "dice_roll"):
+                        websocket_manager.send_to_connection(websocket, {
                             "type": "error",
                             "message": "Rate limit excedido para rolagem de dados. Aguarde um momento."
-                        }))
+                        })
+                        continue
+                    
+                    # Rolagem autoritativa: o servidor rola a expressão, o cliente só a informa
+                    dice_data = message_data.get("dice_data") or {}
+                    expression = message_data.get("expression") or (
+                        dice_data.get("expression") if isinstance(dice_data, dict) else None
+                    )
+                    try:
+                        result = roll_dice(expression)
+                    except DiceSyntaxError as e:
+                        websocket_manager.send_to_connection(websocket, {
+                            "type": "error",
+                            "message": f"Expressão de dados inválida: {e}"
+                        })
                         continue
                     
-                    # Processa rolagem de dados
                     dice_message = {
                         "type": "dice_roll",
                         "user_id": user_id,
                         "username": current_user.username,
-                        "dice_data": message_data.get("dice_data", {}),
+                        "dice_data": result.to_dict(),
                         "timestamp": asyncio.get_event_loop().time()
                     }
                     
                     # Envia para todos na mesa (todas as instâncias)
-                    await websocket_manager.broadcast_to_room(table_id, json.dumps(dice_message))
+                    await websocket_manager.broadcast_to_room(table_id, dice_message)
                 
                 elif message_type == "update_tokens":
-                    if not ws_rate_limiter.is_allowed(user_id, "update_tokens"):
-                        await websocket.send_text(json.dumps({
+                    # Com o tick ativo o tráfego posicional é coalescido em vez de rejeitado
+                    if not room_ticker.enabled and not await ws_rate_limiter.is_allowed(user_id, "update_tokens"):
+                        websocket_manager.send_to_connection(websocket, {
                             "type": "error",
                             "message": "Rate limit excedido para atualização de tokens. Aguarde um momento."
-                        }))
+                        })
                         continue
                     
-                    # Processa atualização de tokens
-                    token_message = {
-                        "type": "update_tokens",
-                        "user_id": user_id,
-                        "username": current_user.username,
-                        "token_data": message_data.get("token_data", {}),
-                        "timestamp": asyncio.get_event_loop().time()
-                    }
+                    # Aceita um delta, uma lista de deltas ou (legado) a lista completa em token_data
+                    if "deltas" in message_data:
+                        raw_deltas = message_data["deltas"]
+                    elif "delta" in message_data:
+                        raw_deltas = [message_data["delta"]]
+                    else:
+                        raw_deltas = [{"op": "replace", "tokens": message_data.get("token_data", [])}]
                     
-                    # Envia para todos na mesa (todas as instâncias)
-                    await websocket_manager.broadcast_to_room(table_id, json.dumps(token_message))
+                    if room_ticker.enabled:
+                        for raw_delta in raw_deltas:
+                            try:
+                                _submit_token_delta(table_id, normalize_delta(raw_delta))
+                            except TokenDeltaError as e:
+                                websocket_manager.send_to_connection(websocket, {
+                                    "type": "error",
+                                    "message": str(e)
+                                })
+                    else:
+                        # Envia apenas os deltas sequenciados para todos na mesa
+                        for token_event in _apply_token_deltas(table_id, raw_deltas, websocket):
+                            await websocket_manager.broadcast_to_room(table_id, token_event, seq=token_event["seq"])
+                
+                elif message_type == "sync_tokens":
+                    # Cliente informa a última sequência vista; recebe só o que perdeu
+                    await _sync_tokens(websocket, table_id, int(message_data.get("since", 0)))
+                
+                elif message_type == "resume":
+                    try:
+                        resume_seq = int(message_data.get("last_seq"))
+                    except (TypeError, ValueError):
+                        raise ValueError("last_seq inválido")
+                    if not await _resume(websocket, table_id, resume_seq):
+                        await _send_room_snapshot(websocket, table_id)
                 
                 elif message_type == "map_updated":
-                    if not ws_rate_limiter.is_allowed(user_id, "map_updated"):
-                        await websocket.send_text(json.dumps({
+                    if not room_ticker.enabled and not await ws_rate_limiter.is_allowed(user_id, "map_updated"):
+                        websocket_manager.send_to_connection(websocket, {
                             "type": "error",
                             "message": "Rate limit excedido para atualização de mapa. Aguarde um momento."
-                        }))
+                        })
                         continue
                     
                     # Processa atualização de mapa
@@ -127,32 +264,123 @@ async def websocket_endpoint(
                         "timestamp": asyncio.get_event_loop().time()
                     }
                     
-                    # Envia para todos na mesa (todas as instâncias)
-                    await websocket_manager.broadcast_to_room(table_id, json.dumps(map_message))
+                    if room_ticker.enabled:
+                        # Dentro do tick vale só a última atualização de cada camada do mapa
+                        map_data = map_message["map_data"]
+                        layer = map_data.get("layer") if isinstance(map_data, dict) else None
+                        room_ticker.submit(table_id, ("event", map_message), key=("map", layer))
+                    else:
+                        # Envia para todos na mesa (todas as instâncias)
+                        await websocket_manager.broadcast_to_room(table_id, map_message)
                 
                 else:
                     # Tipo de mensagem não reconhecido
-                    await websocket.send_text(json.dumps({
+                    websocket_manager.send_to_connection(websocket, {
                         "type": "error",
                         "message": f"Tipo de mensagem não reconhecido: {message_type}"
-                    }))
+                    })
                     
-            except json.JSONDecodeError:
-                await websocket.send_text(json.dumps({
+            except ValueError:
+                websocket_manager.send_to_connection(websocket, {
                     "type": "error",
-                    "message": "Formato de mensagem inválido. Use JSON."
-                }))
+                    "message": "Formato de mensagem inválido. Use JSON ou MessagePack."
+                })
             except Exception as e:
-                await websocket.send_text(json.dumps({
+                websocket_manager.send_to_connection(websocket, {
                     "type": "error",
                     "message": f"Erro ao processar mensagem: {str(e)}"
-                }))
+                })
                 
     except WebSocketDisconnect:
         await websocket_manager.disconnect(websocket)
     except Exception as e:
         print(f"Erro no WebSocket: {e}")
         await websocket_manager.disconnect(websocket)
+    finally:
+        # Sem conexões locais a mesa não recebe mais deltas: grava o pendente e
+        # descarta o estado em memória (a menos que alguém tenha entrado durante o flush).
+        # Handshakes recusados antes do connect não tocam na sala
+        joined = getattr(websocket, "room_id", None) == table_id
+        if joined and websocket_manager.get_room_connections_count(table_id) == 0:
+            await room_ticker.flush_room(table_id)
+            await table_state_writer.flush([table_id])
+            if websocket_manager.get_room_connections_count(table_id) == 0:
+                token_stores.discard(table_id)
+                websocket_manager.replay.discard(table_id)
+
+async def _resume(websocket: WebSocket, table_id: str, last_seq: int) -> bool:
+    """Reenvia em um único frame os eventos da sala posteriores a `last_seq`.
+
+    Retorna False quando o intervalo não está mais disponível (o cliente recebe o snapshot).
+    """
+    frames = await websocket_manager.replay.since(websocket_manager.redis_client, table_id, last_seq)
+    if frames is None:
+        return False
+    events = ",".join(frame.json for frame in frames)
+    websocket_manager.send_to_connection(websocket, Frame.from_json(
+        f'{{"type":"replay","from_seq":{last_seq},"count":{len(frames)},"events":[{events}]}}'
+    ))
+    return True
+
+async def _send_room_snapshot(websocket: WebSocket, table_id: str):
+    """Estado compacto da mesa: tokens com suas sequências e a sequência atual da sala"""
+    snapshot = token_stores.get(table_id).snapshot()
+    snapshot["room_seq"] = await websocket_manager.replay.current_seq(websocket_manager.redis_client, table_id)
+    websocket_manager.send_to_connection(websocket, snapshot)
+
+def _apply_token_deltas(table_id: str, raw_deltas: List[Dict], websocket: WebSocket = None,
+                        seq: Optional[int] = None) -> List[Dict]:
+    """Aplica deltas no store da mesa, agenda a persistência e retorna os eventos sequenciados.
+
+    Com `seq` (room_seq do tick) todos os deltas compartilham o número; sem ele,
+    cada delta reserva o número do frame em que será enviado.
+    """
+    token_events = []
+    for raw_delta in raw_deltas:
+        delta_seq = websocket_manager.replay.reserve(table_id) if seq is None else seq
+        try:
+            token_events.append(token_stores.apply(table_id, raw_delta, delta_seq))
+        except TokenDeltaError as e:
+            if seq is None:
+                websocket_manager.replay.release(table_id, delta_seq)
+            if websocket is not None:
+                websocket_manager.send_to_connection(websocket, {
+                    "type": "error",
+                    "message": str(e)
+                })
+            else:
+                logger.warning(f"Delta de token descartado na mesa {table_id}: {e}")
+    
+    if token_events:
+        # Persistência coalescida: só o estado final do intervalo vai ao banco
+        table_state_writer.mark_dirty(
+            table_id, tokens_state=token_stores.get(table_id).to_tokens_state
+        )
+    return token_events
+
+def _submit_token_delta(table_id: str, delta: Dict):
+    """Agenda um delta para o próximo tick; movimentos do mesmo token são coalescidos"""
+    if delta["op"] == "move":
+        room_ticker.submit(table_id, ("token", delta), key=("move", delta["id"]))
+        return
+    
+    # Outras operações encerram a coalescência dos movimentos já pendentes do token
+    # (ou de todos, no caso de "replace") para preservar a ordem
+    token_id = delta.get("id") or delta.get("token", {}).get("id")
+    room_ticker.release(table_id, ("move", token_id) if token_id else None)
+    room_ticker.submit(table_id, ("token", delta))
+
+async def _process_tick(table_id: str, items: List, seq: int) -> List[Dict]:
+    """Handler do tick: aplica os deltas coalescidos e devolve os eventos do frame combinado"""
+    events = []
+    for kind, payload in items:
+        if kind == "token":
+            events.extend(_apply_token_deltas(table_id, [payload], seq=seq))
+        else:
+            events.append(payload)
+    return events
+
+room_ticker.set_handler(_process_tick)
 
 async def notify_map_updated(table_id: str):
     """Função auxiliar para notificar sobre mudanças no mapa (com clustering)"""
@@ -162,6 +390,6 @@ async def notify_map_updated(table_id: str):
             "table_id": table_id,
             "timestamp": asyncio.get_event_loop().time()
         }
-        await websocket_manager.broadcast_to_room(table_id, json.dumps(message))
+        await websocket_manager.broadcast_to_room(table_id, message)
     except Exception as e:
         print(f"Erro ao notificar mudança de mapa: {e}")
\ No newline at end of file
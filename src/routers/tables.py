@@ -1,13 +1,17 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 import os
 import uuid
 import shutil
 from pathlib import Path
 
-from .. import crud, models, schemas, auth
-from ..database import get_db
+from .. import crud, crud_async, database, models, schemas, auth
+from ..cache_codec import TABLE_CODEC, TABLE_LIST_CODEC
+from ..database import SessionLocal, get_db, get_optional_async_db, new_async_session
+from ..compression import precompress_file
 from .game_ws import notify_map_updated
 
 router = APIRouter(
@@ -15,32 +19,74 @@ router = APIRouter(
     tags=["tables"]
 )
 
+# Cargas do cache single-flight: a task é compartilhada por todos os chamadores
+# e pode sobreviver à requisição que a iniciou, então abre a própria sessão em
+# vez de capturar a sessão (com escopo de requisição) do primeiro chamador
+async def _load_active_tables():
+    if database.AsyncSessionLocal is None:
+        return await run_in_threadpool(_get_tables_sync, 0, 100)
+    async with new_async_session() as db:
+        return await crud_async.get_tables(db, skip=0, limit=100)
+
+async def _load_table_details(table_id: str):
+    if database.AsyncSessionLocal is None:
+        return await run_in_threadpool(_get_table_details_sync, table_id)
+    async with new_async_session() as db:
+        # O codec do cache serializa a linha pelo schemas.Table (mesma forma da resposta)
+        return await crud_async.get_table(db, table_id, with_relationships=True)
+
+# Caminho síncrono de reserva (sem asyncpg/aiosqlite), executado no threadpool.
+# A serialização acontece com a sessão aberta: os relacionamentos são lazy
+def _get_tables_sync(skip: int, limit: int):
+    db = SessionLocal()
+    try:
+        return TABLE_LIST_CODEC.dump(crud.get_tables(db, skip=skip, limit=limit))
+    finally:
+        db.close()
+
+def _get_table_details_sync(table_id: str):
+    db = SessionLocal()
+    try:
+        table = db.query(models.Table).filter(models.Table.id == table_id).first()
+        return TABLE_CODEC.dump(table) if table is not None else None
+    finally:
+        db.close()
+
+def _get_table_sync(table_id: str):
+    db = SessionLocal()
+    try:
+        return db.query(models.Table).filter(models.Table.id == table_id).first()
+    finally:
+        db.close()
+
+def _set_map_url_sync(table_id: str, map_url: str):
+    db = SessionLocal()
+    try:
+        db.query(models.Table).filter(models.Table.id == table_id).update(
+            {models.Table.map_image_url: map_url}
+        )
+        db.commit()
+    finally:
+        db.close()
+
 # --- Endpoints Existentes de Mesas ---
 @router.get("/", response_model=List[schemas.Table])
-def get_all_tables(
+async def get_all_tables(
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db),
+    db: Optional[AsyncSession] = Depends(get_optional_async_db),
     current_user: schemas.TokenData = Depends(auth.get_current_user_from_token)
 ):
-    from ..cache import get_active_tables, cache_active_tables
-    
-    # Tenta obter do cache primeiro (apenas para skip=0 e limit padrão)
-    if skip == 0 and limit == 100:
-        cached_tables = get_active_tables()
-        if cached_tables is not None:
-            return cached_tables
-    
-    # Se não estiver no cache, busca no banco
-    tables = crud.get_tables(db, skip=skip, limit=limit)
+    from ..cache import get_active_tables_or_load
     
-    # Cacheia o resultado (apenas para consulta padrão)
-    if skip == 0 and limit == 100:
-        # Converte para dict para serialização
-        tables_dict = [table.__dict__ for table in tables]
-        cache_active_tables(tables_dict, expire_minutes=5)
+    # Apenas a consulta padrão (skip=0 e limit padrão) é cacheada
+    if skip != 0 or limit != 100:
+        if db is None:
+            return await run_in_threadpool(_get_tables_sync, skip, limit)
+        return await crud_async.get_tables(db, skip=skip, limit=limit)
     
-    return tables
+    # Requisições simultâneas após a expiração compartilham uma única consulta
+    return await get_active_tables_or_load(_load_active_tables, expire_minutes=5)
 
 @router.post("/", response_model=schemas.Table)
 def create_new_table(
@@ -48,13 +94,13 @@ def create_new_table(
     db: Session = Depends(get_db),
     current_user: schemas.TokenData = Depends(auth.get_current_user_from_token)
 ):
-    from ..cache import cache
+    from ..cache import invalidate_table_cache
     
     # Cria a mesa
     new_table = crud.create_table(db=db, table=table_data, master_id=current_user.user_id)
     
     # Invalida cache de mesas ativas
-    cache.delete("tables:active")
+    invalidate_table_cache(new_table.id)
     
     return new_table
 
@@ -118,6 +164,10 @@ def request_to_join_table(
             detail="Já existe uma solicitação pendente ou você já é jogador desta mesa"
         )
     
+    # Os detalhes cacheados da mesa incluem as solicitações
+    from ..cache import invalidate_table_cache
+    invalidate_table_cache(table_id)
+    
     return join_request
 
 @router.post("/requests/{request_id}/approve", response_model=schemas.JoinRequest)
@@ -141,7 +191,12 @@ def approve_join_request(
         )
     
     # Aprova a solicitação
+    table_id = table.id
     updated_request = crud.manage_join_request(db=db, request_id=request_id, new_status="approved")
+    
+    # Os detalhes cacheados da mesa incluem jogadores e solicitações
+    from ..cache import invalidate_table_cache
+    invalidate_table_cache(table_id)
     return updated_request
 
 @router.post("/requests/{request_id}/decline", response_model=schemas.JoinRequest)
@@ -165,7 +220,12 @@ def decline_join_request(
         )
     
     # Recusa a solicitação
+    table_id = table.id
     updated_request = crud.manage_join_request(db=db, request_id=request_id, new_status="declined")
+    
+    # Os detalhes cacheados da mesa incluem as solicitações
+    from ..cache import invalidate_table_cache
+    invalidate_table_cache(table_id)
     return updated_request
 
 # Endpoint genérico para solicitações (usado pelo teste)
@@ -227,6 +287,10 @@ def create_join_request(
             detail="Já existe uma solicitação pendente ou você já é jogador desta mesa"
         )
     
+    # Os detalhes cacheados da mesa incluem as solicitações
+    from ..cache import invalidate_table_cache
+    invalidate_table_cache(request_data.table_id)
+    
     return join_request
 
 @router.get("/{table_id}/requests", response_model=List[schemas.JoinRequest])
@@ -250,42 +314,39 @@ def get_table_join_requests(
     return crud.get_table_join_requests(db=db, table_id=table_id)
 
 @router.get("/{table_id}", response_model=schemas.Table)
-def get_table_by_id(
+async def get_table_by_id(
     table_id: str,
-    db: Session = Depends(get_db),
     current_user: schemas.TokenData = Depends(auth.get_current_user_from_token)
 ):
     """Busca uma mesa específica por ID (com cache)"""
-    from ..cache import get_table_details, cache_table_details
-    
-    # Tenta obter do cache primeiro
-    cached_table = get_table_details(table_id)
-    if cached_table is not None:
-        return cached_table
+    from ..cache import get_table_details_or_load
     
-    # Se não estiver no cache, busca no banco
-    table = db.query(models.Table).filter(models.Table.id == table_id).first()
-    if not table:
+    # Tenta o cache primeiro; misses simultâneos compartilham uma única consulta
+    table = await get_table_details_or_load(
+        table_id, lambda: _load_table_details(table_id), expire_minutes=15
+    )
+    if table is None:
         raise HTTPException(status_code=404, detail="Mesa não encontrada")
     
-    # Cacheia o resultado
-    table_dict = table.__dict__.copy()
-    # Remove atributos SQLAlchemy internos
-    table_dict.pop('_sa_instance_state', None)
-    cache_table_details(table_id, table_dict, expire_minutes=15)
-    
     return table
 
+def _save_upload(file: UploadFile, file_path: Path):
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+
 @router.post("/{table_id}/upload-map")
 async def upload_map(
     table_id: str,
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    db: Optional[AsyncSession] = Depends(get_optional_async_db),
     current_user: schemas.TokenData = Depends(auth.get_current_user_from_token)
 ):
     """Upload de mapa para uma mesa (apenas o mestre pode fazer)"""
     # Verifica se a mesa existe e se o usuário é o mestre
-    table = db.query(models.Table).filter(models.Table.id == table_id).first()
+    if db is None:
+        table = await run_in_threadpool(_get_table_sync, table_id)
+    else:
+        table = await crud_async.get_table(db, table_id)
     if not table:
         raise HTTPException(status_code=404, detail="Mesa não encontrada")
     
@@ -312,15 +373,21 @@ async def upload_map(
     file_path = maps_dir / unique_filename
     
     try:
-        # Salva o arquivo
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Salva o arquivo (I/O de disco fora do event loop)
+        await run_in_threadpool(_save_upload, file, file_path)
+        # Mapas em SVG ganham as cópias comprimidas agora, nunca por requisição
+        await run_in_threadpool(precompress_file, file_path)
         
         # Atualiza a URL do mapa na mesa
         map_url = f"/static/maps/{unique_filename}"
-        table.map_image_url = map_url
-        db.commit()
-        db.refresh(table)
+        if db is None:
+            await run_in_threadpool(_set_map_url_sync, table_id, map_url)
+        else:
+            table.map_image_url = map_url
+            await db.commit()
+        
+        from ..cache import invalidate_table_cache_async
+        await invalidate_table_cache_async(table_id)
         
         # Notifica todos os jogadores conectados sobre a mudança do mapa
         try:
@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session
 from typing import List
 from datetime import timedelta
 from .. import crud, schemas, auth, database, models
+from ..compression import precompress_file
 import shutil
 import os
 
@@ -11,38 +12,47 @@ os.makedirs(AVATAR_DIR, exist_ok=True)
 
 router = APIRouter(prefix="/api/v1/users", tags=["users"])
 
+# As rotas de /me usam o principal em cache: o token e o usuário ativo não
+# custam consultas; apenas os dados pedidos pela rota vêm do banco
 @router.get("/me", response_model=schemas.User)
-def read_users_me(current_user: models.User = Depends(auth.get_current_active_user)):
-    return current_user
+def read_users_me(
+    db: Session = Depends(database.get_db),
+    current_user: schemas.UserPrincipal = Depends(auth.get_current_active_principal)
+):
+    return crud.get_user_by_username(db, username=current_user.username)
 
 @router.put("/me", response_model=schemas.User)
 def update_user_me(
     user_update: schemas.UserUpdate,
     db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: schemas.UserPrincipal = Depends(auth.get_current_active_principal)
 ):
     return crud.update_user(db=db, user_id=current_user.id, user_update=user_update)
 
 @router.post("/me/avatar")
 def upload_avatar(
     file: UploadFile = File(...),
-    current_user: models.User = Depends(auth.get_current_active_user),
+    current_user: schemas.UserPrincipal = Depends(auth.get_current_active_principal),
     db: Session = Depends(database.get_db)
 ):
     file_path = os.path.join(AVATAR_DIR, f"{current_user.id}_{file.filename}")
     with open(file_path, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
+    precompress_file(file_path)
 
     # Salva o caminho do arquivo no banco de dados
-    current_user.avatar_url = f"/avatars/{current_user.id}_{file.filename}"
+    avatar_url = f"/avatars/{current_user.id}_{file.filename}"
+    db.query(models.User).filter(models.User.id == current_user.id).update(
+        {models.User.avatar_url: avatar_url}
+    )
     db.commit()
-    return {"filename": file.filename, "avatar_url": current_user.avatar_url}
+    return {"filename": file.filename, "avatar_url": avatar_url}
 
 @router.put("/me/notifications", response_model=schemas.User)
 def update_user_notification_settings(
     settings_update: schemas.NotificationSettingsUpdate,
     db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: schemas.UserPrincipal = Depends(auth.get_current_active_principal)
 ):
     """Atualiza as preferências de notificação do usuário logado."""
     return crud.update_user(db=db, user_id=current_user.id, user_update=settings_update)
@@ -50,7 +60,7 @@ def update_user_notification_settings(
 @router.get("/me/inventory", response_model=schemas.UserInventory)
 def get_my_full_inventory(
     db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: schemas.UserPrincipal = Depends(auth.get_current_active_principal)
 ):
     """
     Retorna uma coleção completa de todos os assets criados
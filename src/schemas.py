@@ -1,6 +1,6 @@
 # src/schemas.py
 from pydantic import BaseModel, Field, EmailStr
-from typing import Optional, List, Any
+from typing import Optional, List, Any, Dict
 from datetime import datetime
 import uuid
 
@@ -476,6 +476,31 @@ class TokenData(BaseModel):
     username: Optional[str] = None
     user_id: Optional[str] = None
 
+# Usuário autenticado sem relacionamentos (cacheado junto com o token)
+class UserPrincipal(BaseModel):
+    id: str
+    username: str
+    is_active: bool
+
+# --- Schemas de Análise de Dados ---
+class DiceDistributionSummary(BaseModel):
+    normalized: str
+    min: int
+    max: int
+    mean: float
+    stdev: float
+    percentiles: Dict[str, int]
+    pmf: List[float]  # pmf[i] = P(total == min + i)
+    cdf: List[float]
+
+class DiceAnalysis(BaseModel):
+    expression: str
+    distribution: DiceDistributionSummary
+    target: Optional[int] = None
+    success_probability: Optional[float] = None
+    damage: Optional[DiceDistributionSummary] = None
+    expected_damage: Optional[float] = None
+
 # --- Schema para Backup Completo do Usuário ---
 class UserBackup(BaseModel):
     characters: List[Character]
@@ -0,0 +1,27 @@
+from .dice_expression import (
+    DiceExpression,
+    DiceRoll,
+    DiceSyntaxError,
+    DiceTerm,
+    average_roll,
+    compile_expression,
+    hit_points_expression,
+    roll,
+    roll_hit_points,
+)
+from .distribution import DiceDistribution, analyze, distribution
+
+__all__ = [
+    'DiceDistribution',
+    'DiceExpression',
+    'DiceRoll',
+    'DiceSyntaxError',
+    'DiceTerm',
+    'analyze',
+    'average_roll',
+    'compile_expression',
+    'distribution',
+    'hit_points_expression',
+    'roll',
+    'roll_hit_points'
+]
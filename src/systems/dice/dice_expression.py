@@ -0,0 +1,353 @@
+from __future__ import annotations
+
+import math
+import random
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# NumPy é opcional: sem ele as rolagens em lote usam `random.choices`
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Limites contra expressões abusivas vindas de clientes
+MAX_DICE_PER_TERM = 1000
+MAX_SIDES = 10000
+MAX_TERMS = 20
+MAX_BATCH = 10000
+# Textos maiores são recusados antes de chegar ao cache de compilação
+MAX_EXPRESSION_LENGTH = 128
+# Explosões por dado (cada uma é uma nova rolagem do valor máximo)
+MAX_EXPLOSIONS = 100
+
+_TOKEN_RE = re.compile(
+    r"\s*(?:"
+    r"(?P<dice>(?P<count>\d*)d(?P<sides>\d+|%)(?P<mods>(?:(?:kh|kl|dh|dl|k)\d+|!)*))"
+    r"|(?P<adv>adv|dis)"
+    r"|(?P<number>\d+)"
+    r"|(?P<op>[+-])"
+    r")\s*"
+)
+_MOD_RE = re.compile(r"(kh|kl|dh|dl|k)(\d+)|!")
+# "22 (4d8 + 4)" -> "4d8 + 4"
+_HIT_POINTS_RE = re.compile(r"\(([^)]*)\)")
+
+
+class DiceSyntaxError(ValueError):
+    """Expressão de dados inválida ou acima dos limites permitidos."""
+
+
+@dataclass(frozen=True)
+class DiceTerm:
+    """Grupo de dados iguais, ex.: 4d6kh3, 1d6! ou -1d4."""
+
+    count: int
+    sides: int
+    keep: Optional[Tuple[str, int]] = None  # ("h" | "l", quantidade)
+    explode: bool = False
+    sign: int = 1
+
+    def notation(self) -> str:
+        text = f"{self.count}d{self.sides}"
+        if self.keep:
+            text += f"k{self.keep[0]}{self.keep[1]}"
+        if self.explode:
+            text += "!"
+        return text
+
+    @property
+    def kept_count(self) -> int:
+        return self.keep[1] if self.keep else self.count
+
+    def minimum(self) -> int:
+        return self.sign * self.kept_count if self.sign > 0 else -self.kept_count * self._max_face()
+
+    def maximum(self) -> int:
+        return self.sign * self.kept_count * self._max_face() if self.sign > 0 else -self.kept_count
+
+    def _max_face(self) -> int:
+        return self.sides * (MAX_EXPLOSIONS + 1) if self.explode else self.sides
+
+    def average(self) -> float:
+        """Valor esperado exato do termo (explosões consideradas ilimitadas)"""
+        sides, count = self.sides, self.count
+        if self.explode:
+            return self.sign * count * (sides + 1) / 2 * sides / (sides - 1)
+        if not self.keep or self.keep[1] == count:
+            return self.sign * count * (sides + 1) / 2
+
+        # Soma dos k maiores = soma, para cada face v, de min(k, nº de dados >= v);
+        # soma dos k menores = soma de max(0, k - nº de dados < v)
+        mode, keep = self.keep
+        expected = 0.0
+        for value in range(1, sides + 1):
+            if mode == "h":
+                p = (sides - value + 1) / sides
+                expected += sum(min(keep, j) * _binomial_pmf(count, j, p) for j in range(count + 1))
+            else:
+                p = (value - 1) / sides
+                expected += sum((keep - j) * _binomial_pmf(count, j, p) for j in range(keep))
+        return self.sign * expected
+
+
+def _binomial_pmf(n: int, j: int, p: float) -> float:
+    return math.comb(n, j) * p ** j * (1 - p) ** (n - j)
+
+
+@dataclass
+class DiceRoll:
+    """Resultado detalhado de uma rolagem."""
+
+    expression: str
+    total: int
+    modifier: int
+    terms: List[Dict[str, Any]] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "expression": self.expression,
+            "total": self.total,
+            "modifier": self.modifier,
+            "terms": self.terms,
+        }
+
+
+@dataclass(frozen=True)
+class DiceExpression:
+    """Expressão compilada: termos de dados mais um modificador constante."""
+
+    text: str
+    terms: Tuple[DiceTerm, ...]
+    modifier: int = 0
+
+    def average(self) -> float:
+        return _cached_average(self)
+
+    def minimum(self) -> int:
+        return self.modifier + sum(term.minimum() for term in self.terms)
+
+    def maximum(self) -> int:
+        return self.modifier + sum(term.maximum() for term in self.terms)
+
+    def roll(self, rng: Any = None) -> DiceRoll:
+        """Rola uma vez, guardando os dados de cada termo"""
+        rng = rng or _default_rng()
+        total = self.modifier
+        details = []
+        for term in self.terms:
+            values = [int(value) for value in _roll_term_dice(rng, term, 1)[0]]
+            kept = _kept_indices(values, term)
+            subtotal = term.sign * sum(values[i] for i in kept)
+            total += subtotal
+            details.append({
+                "dice": term.notation(),
+                "sign": term.sign,
+                "rolls": values,
+                "kept": sorted(kept),
+                "subtotal": subtotal,
+            })
+        return DiceRoll(expression=self.text, total=total, modifier=self.modifier, terms=details)
+
+    def roll_many(self, times: int, rng: Any = None) -> List[int]:
+        """Rola `times` vezes com uma chamada ao gerador por termo (ex.: PV de 40 goblins)"""
+        if times < 1:
+            return []
+        if times > MAX_BATCH:
+            raise DiceSyntaxError(f"Máximo de {MAX_BATCH} rolagens por lote")
+        rng = rng or _default_rng()
+        totals = [self.modifier] * times
+        for term in self.terms:
+            for i, subtotal in enumerate(_term_totals(_roll_term_dice(rng, term, times), term)):
+                totals[i] += term.sign * subtotal
+        return totals
+
+
+@lru_cache(maxsize=1024)
+def _cached_average(expression: DiceExpression) -> float:
+    return expression.modifier + sum(term.average() for term in expression.terms)
+
+
+_rng = None
+
+
+def _default_rng() -> Any:
+    global _rng
+    if _rng is None:
+        _rng = np.random.default_rng() if np is not None else random.Random()
+    return _rng
+
+
+def _roll_faces(rng: Any, sides: int, size: int) -> Sequence[int]:
+    if np is not None and isinstance(rng, np.random.Generator):
+        return rng.integers(1, sides + 1, size=size)
+    return rng.choices(range(1, sides + 1), k=size)
+
+
+def _roll_term_dice(rng: Any, term: DiceTerm, rows: int) -> Any:
+    """Matriz rows x count com o valor de cada dado (explosões já somadas)"""
+    count, sides = term.count, term.sides
+    faces = _roll_faces(rng, sides, rows * count)
+
+    if np is not None and isinstance(rng, np.random.Generator):
+        values = np.asarray(faces).reshape(rows, count)
+        if term.explode:
+            exploding = values == sides
+            for _ in range(MAX_EXPLOSIONS):
+                positions = np.nonzero(exploding)
+                if not positions[0].size:
+                    break
+                extra = rng.integers(1, sides + 1, size=positions[0].size)
+                values[positions] += extra
+                exploding = np.zeros_like(exploding)
+                exploding[positions] = extra == sides
+        return values
+
+    values = [list(faces[row * count:(row + 1) * count]) for row in range(rows)]
+    if term.explode:
+        for row in values:
+            for i, value in enumerate(row):
+                last = value
+                for _ in range(MAX_EXPLOSIONS):
+                    if last != sides:
+                        break
+                    last = rng.randint(1, sides)
+                    row[i] += last
+    return values
+
+
+def _term_totals(values: Any, term: DiceTerm) -> List[int]:
+    """Soma os dados mantidos de cada linha"""
+    if np is not None and isinstance(values, np.ndarray):
+        if term.keep:
+            ordered = np.sort(values, axis=1)
+            mode, keep = term.keep
+            values = ordered[:, -keep:] if mode == "h" else ordered[:, :keep]
+        return values.sum(axis=1).tolist()
+
+    if not term.keep:
+        return [sum(row) for row in values]
+    mode, keep = term.keep
+    return [sum(sorted(row, reverse=mode == "h")[:keep]) for row in values]
+
+
+def _kept_indices(values: List[int], term: DiceTerm) -> List[int]:
+    if not term.keep:
+        return list(range(len(values)))
+    mode, keep = term.keep
+    order = sorted(range(len(values)), key=lambda i: values[i], reverse=mode == "h")
+    return order[:keep]
+
+
+def _parse_term(match: re.Match, sign: int) -> DiceTerm:
+    count = int(match.group("count") or 1)
+    sides_text = match.group("sides")
+    sides = 100 if sides_text == "%" else int(sides_text)
+    if not 1 <= count <= MAX_DICE_PER_TERM:
+        raise DiceSyntaxError(f"Quantidade de dados deve estar entre 1 e {MAX_DICE_PER_TERM}")
+    if not 1 <= sides <= MAX_SIDES:
+        raise DiceSyntaxError(f"Número de faces deve estar entre 1 e {MAX_SIDES}")
+
+    keep = None
+    explode = False
+    for modifier in _MOD_RE.finditer(match.group("mods") or ""):
+        if modifier.group(0) == "!":
+            explode = True
+            continue
+        if keep is not None:
+            raise DiceSyntaxError("Apenas um modificador de manter/descartar por termo")
+        kind, amount = modifier.group(1), int(modifier.group(2))
+        if kind in ("k", "kh"):
+            keep = ("h", amount)
+        elif kind == "kl":
+            keep = ("l", amount)
+        elif kind == "dh":
+            keep = ("l", count - amount)
+        else:  # dl
+            keep = ("h", count - amount)
+        if not 1 <= keep[1] <= count:
+            raise DiceSyntaxError(f"Manter/descartar inválido para {count} dado(s)")
+
+    if explode and sides < 2:
+        raise DiceSyntaxError("Dados explosivos precisam de pelo menos 2 faces")
+    if explode and keep:
+        raise DiceSyntaxError("Dados explosivos não podem ser combinados com manter/descartar")
+    return DiceTerm(count=count, sides=sides, keep=keep, explode=explode, sign=sign)
+
+
+def compile_expression(text: str) -> DiceExpression:
+    """Compila uma expressão (ex.: "4d6kh3 + 2", "adv + 5", "1d6! - 1") uma única vez."""
+    if not isinstance(text, str) or not text.strip():
+        raise DiceSyntaxError("Expressão de dados vazia")
+    if len(text) > MAX_EXPRESSION_LENGTH:
+        raise DiceSyntaxError(f"Expressão de dados maior que {MAX_EXPRESSION_LENGTH} caracteres")
+    return _compile(text)
+
+
+@lru_cache(maxsize=1024)
+def _compile(text: str) -> DiceExpression:
+    source = text.lower()
+    terms: List[DiceTerm] = []
+    modifier = 0
+    sign = 1
+    expecting_operand = True
+    signed = False  # já houve um operador antes do próximo operando
+    position = 0
+    while position < len(source):
+        match = _TOKEN_RE.match(source, position)
+        if not match or match.end() == position:
+            raise DiceSyntaxError(f"Expressão inválida perto de '{text[position:].strip()}'")
+        position = match.end()
+
+        if match.group("op"):
+            if signed:
+                raise DiceSyntaxError("Operadores consecutivos")
+            sign = 1 if match.group("op") == "+" else -1
+            expecting_operand = signed = True
+            continue
+        if not expecting_operand:
+            raise DiceSyntaxError("Faltando operador entre termos")
+
+        if match.group("number"):
+            modifier += sign * int(match.group("number"))
+        elif match.group("adv"):
+            # Vantagem/desvantagem: 2d20 mantendo o maior/menor
+            mode = "h" if match.group("adv") == "adv" else "l"
+            terms.append(DiceTerm(count=2, sides=20, keep=(mode, 1), sign=sign))
+        else:
+            terms.append(_parse_term(match, sign))
+        sign = 1
+        expecting_operand = signed = False
+
+    if expecting_operand:
+        raise DiceSyntaxError("Expressão termina com operador")
+    if len(terms) > MAX_TERMS:
+        raise DiceSyntaxError(f"Máximo de {MAX_TERMS} termos de dados")
+    return DiceExpression(text=text.strip(), terms=tuple(terms), modifier=modifier)
+
+
+def roll(text: str, rng: Any = None) -> DiceRoll:
+    """Compila (com cache) e rola uma expressão."""
+    return compile_expression(text).roll(rng)
+
+
+def average_roll(text: str) -> int:
+    """Média arredondada para baixo; 0 se a expressão for inválida."""
+    try:
+        return math.floor(compile_expression(text).average())
+    except DiceSyntaxError:
+        return 0
+
+
+def hit_points_expression(hit_points: str) -> str:
+    """Extrai a expressão de PV de monstros/NPCs no formato "22 (4d8 + 4)"."""
+    match = _HIT_POINTS_RE.search(hit_points or "")
+    return match.group(1) if match else hit_points
+
+
+def roll_hit_points(hit_points: str, count: int = 1, rng: Any = None) -> List[int]:
+    """Rola os PV de `count` criaturas em lote (mínimo de 1 PV cada)."""
+    totals = compile_expression(hit_points_expression(hit_points)).roll_many(count, rng)
+    return [max(1, total) for total in totals]
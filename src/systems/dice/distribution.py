@@ -0,0 +1,264 @@
+from __future__ import annotations
+
+import math
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .dice_expression import DiceExpression, DiceSyntaxError, DiceTerm, compile_expression
+
+# NumPy é opcional: sem ele as convoluções rodam em Python puro (mais lentas)
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Maior suporte (valores possíveis) calculado para uma expressão
+MAX_SUPPORT = 200000
+# Limite de trabalho da programação dinâmica de manter/descartar (faces x dados² x soma)
+MAX_KEEP_WORK = 20000000
+# Probabilidade residual abaixo da qual a cauda de dados explosivos é ignorada
+EXPLODE_TAIL_EPSILON = 1e-12
+# A partir deste tamanho as convoluções usam FFT (O(n log n) em vez de O(n·m))
+FFT_MIN_SIZE = 256
+
+PERCENTILES = (5, 10, 25, 50, 75, 90, 95)
+
+
+def _array(values: Sequence[float]) -> Any:
+    return np.asarray(values, dtype=float) if np is not None else list(values)
+
+
+def _zeros(size: int) -> Any:
+    return np.zeros(size) if np is not None else [0.0] * size
+
+
+def _convolve(a: Any, b: Any) -> Any:
+    if np is not None:
+        if min(len(a), len(b)) < FFT_MIN_SIZE:
+            return np.convolve(a, b)
+        size = len(a) + len(b) - 1
+        result = np.fft.irfft(np.fft.rfft(a, size) * np.fft.rfft(b, size), size)
+        # Erro de arredondamento da FFT pode gerar probabilidades levemente negativas
+        return np.clip(result, 0.0, None)
+    result = [0.0] * (len(a) + len(b) - 1)
+    for i, pa in enumerate(a):
+        if pa:
+            for j, pb in enumerate(b):
+                result[i + j] += pa * pb
+    return result
+
+
+def _power(pmf: Any, times: int) -> Any:
+    """pmf convoluída consigo mesma `times` vezes (exponenciação por quadrados)"""
+    result = _array([1.0])
+    base = pmf
+    while times:
+        if times & 1:
+            result = _convolve(result, base)
+        times >>= 1
+        if times:
+            base = _convolve(base, base)
+    return result
+
+
+def _explode_support(sides: int) -> int:
+    """Tamanho da pmf de um dado explosivo (ver _explode_pmf)"""
+    size, repeat_probability = 0, 1.0
+    while repeat_probability > EXPLODE_TAIL_EPSILON and size < MAX_SUPPORT:
+        size += sides
+        repeat_probability /= sides
+    return size
+
+
+def _term_support(term: DiceTerm) -> int:
+    """Quantidade aproximada de valores possíveis de um termo, antes de calculá-lo"""
+    if term.explode:
+        return term.count * _explode_support(term.sides)
+    if term.keep and term.keep[1] < term.count:
+        return term.keep[1] * term.sides
+    return term.count * term.sides
+
+
+def _explode_pmf(sides: int) -> Any:
+    """Um dado explosivo: P(k*s + r) = (1/s)^(k+1), r em 1..s-1"""
+    probabilities: List[float] = []
+    repeat_probability = 1.0
+    while repeat_probability > EXPLODE_TAIL_EPSILON and len(probabilities) < MAX_SUPPORT:
+        face = repeat_probability / sides
+        probabilities.extend([face] * (sides - 1))
+        probabilities.append(0.0)  # O máximo nunca para: sempre rola de novo
+        repeat_probability = face
+    return _array(probabilities)  # índice 0 = valor 1
+
+
+def _keep_pmf(count: int, sides: int, mode: str, keep: int) -> Any:
+    """Soma dos `keep` maiores (ou menores) de `count` dados; índice = soma.
+
+    Percorre as faces da mais favorecida para a menos, escolhendo quantos dos
+    dados restantes mostram cada face (coeficientes multinomiais).
+    """
+    size = keep * sides + 1
+    if sides * count * count * size > MAX_KEEP_WORK:
+        raise DiceSyntaxError("Distribuição grande demais para manter/descartar")
+
+    face_probability = 1.0 / sides
+    # dp[j] = distribuição da soma mantida após atribuir j dados
+    dp = [None] * (count + 1)
+    dp[0] = _zeros(size)
+    dp[0][0] = 1.0
+    faces = range(sides, 0, -1) if mode == "h" else range(1, sides + 1)
+    for value in faces:
+        new_dp = [None] * (count + 1)
+        for assigned, distribution in enumerate(dp):
+            if distribution is None:
+                continue
+            remaining = count - assigned
+            kept_so_far = min(assigned, keep)
+            for shown in range(remaining + 1):
+                weight = math.comb(remaining, shown) * face_probability ** shown
+                shift = min(shown, keep - kept_so_far) * value
+                target = new_dp[assigned + shown]
+                if target is None:
+                    target = new_dp[assigned + shown] = _zeros(size)
+                if np is not None:
+                    target[shift:] += distribution[:size - shift] * weight
+                else:
+                    for i in range(size - shift):
+                        target[i + shift] += distribution[i] * weight
+        dp = new_dp
+    return dp[count]
+
+
+def _term_pmf(term: DiceTerm) -> Tuple[int, Any]:
+    """(menor valor, pmf) de um termo"""
+    if term.explode:
+        # A soma de `count` dados explosivos tem suporte ~count x o de um dado
+        if _term_support(term) > MAX_SUPPORT:
+            raise DiceSyntaxError("Distribuição grande demais")
+        offset, pmf = term.count, _power(_explode_pmf(term.sides), term.count)
+    elif term.keep and term.keep[1] < term.count:
+        mode, keep = term.keep
+        offset, pmf = keep, _keep_pmf(term.count, term.sides, mode, keep)[keep:]
+    else:
+        if term.count * term.sides > MAX_SUPPORT:
+            raise DiceSyntaxError("Distribuição grande demais")
+        offset, pmf = term.count, _power(_array([1.0 / term.sides] * term.sides), term.count)
+
+    if term.sign < 0:
+        pmf = pmf[::-1]
+        offset = -(offset + len(pmf) - 1)
+    return offset, pmf
+
+
+class DiceDistribution:
+    """Distribuição exata de uma expressão: pmf[i] = P(total == minimum + i)."""
+
+    def __init__(self, normalized: str, minimum: int, pmf: Any):
+        self.normalized = normalized
+        self.minimum = minimum
+        self.pmf = pmf
+        if np is not None:
+            self.cdf = np.cumsum(pmf)
+        else:
+            self.cdf, running = [], 0.0
+            for probability in pmf:
+                running += probability
+                self.cdf.append(running)
+        self._summary: Optional[Dict[str, Any]] = None
+
+    @property
+    def maximum(self) -> int:
+        return self.minimum + len(self.pmf) - 1
+
+    def probability(self, value: int) -> float:
+        index = value - self.minimum
+        return float(self.pmf[index]) if 0 <= index < len(self.pmf) else 0.0
+
+    def probability_at_least(self, target: int) -> float:
+        """P(total >= target), ex.: acertar a CA ou passar na CD"""
+        index = target - self.minimum
+        if index <= 0:
+            return 1.0
+        if index >= len(self.pmf):
+            return 0.0
+        return max(0.0, 1.0 - float(self.cdf[index - 1]))
+
+    def percentile(self, fraction: float) -> int:
+        """Menor valor cuja probabilidade acumulada alcança `fraction`"""
+        if np is not None:
+            index = int(np.searchsorted(self.cdf, fraction - 1e-12))
+        else:
+            index = next((i for i, value in enumerate(self.cdf) if value >= fraction - 1e-12), len(self.cdf) - 1)
+        return self.minimum + min(index, len(self.pmf) - 1)
+
+    def summary(self) -> Dict[str, Any]:
+        """Resumo serializável (calculado uma vez por distribuição)"""
+        if self._summary is None:
+            values = range(self.minimum, self.maximum + 1)
+            mean = sum(value * float(p) for value, p in zip(values, self.pmf))
+            variance = sum((value - mean) ** 2 * float(p) for value, p in zip(values, self.pmf))
+            self._summary = {
+                "normalized": self.normalized,
+                "min": self.minimum,
+                "max": self.maximum,
+                "mean": mean,
+                "stdev": math.sqrt(variance),
+                "percentiles": {f"p{q}": self.percentile(q / 100) for q in PERCENTILES},
+                "pmf": [float(p) for p in self.pmf],
+                "cdf": [min(1.0, float(c)) for c in self.cdf],
+            }
+        return self._summary
+
+
+def normalize(expression: DiceExpression) -> Tuple[Tuple[DiceTerm, ...], str]:
+    """Forma canônica: expressões equivalentes compartilham a mesma distribuição em cache.
+
+    Retorna os termos ordenados (a ordem não altera a soma) e o texto normalizado.
+    """
+    terms = tuple(sorted(
+        expression.terms, key=lambda t: (-t.sign, -t.sides, -t.count, t.keep or (), t.explode)
+    ))
+    parts = []
+    for term in terms:
+        parts.append(("-" if term.sign < 0 else "+") + term.notation())
+    if expression.modifier:
+        parts.append(f"{expression.modifier:+d}")
+    text = "".join(parts) or "+0"
+    return terms, text[1:] if text.startswith("+") else text
+
+
+@lru_cache(maxsize=512)
+def _distribution_for(terms: Tuple[DiceTerm, ...], modifier: int, normalized: str) -> DiceDistribution:
+    # Recusa antes de qualquer convolução: o custo cresce com o suporte total
+    if sum(_term_support(term) for term in terms) > MAX_SUPPORT:
+        raise DiceSyntaxError("Distribuição grande demais")
+    minimum, pmf = modifier, _array([1.0])
+    for term in terms:
+        offset, term_pmf = _term_pmf(term)
+        minimum += offset
+        pmf = _convolve(pmf, term_pmf)
+        if len(pmf) > MAX_SUPPORT:
+            raise DiceSyntaxError("Distribuição grande demais")
+    return DiceDistribution(normalized, minimum, pmf)
+
+
+def distribution(text: str) -> DiceDistribution:
+    """Distribuição exata (memoizada pela forma normalizada da expressão)."""
+    expression = compile_expression(text)
+    terms, normalized = normalize(expression)
+    return _distribution_for(terms, expression.modifier, normalized)
+
+
+def analyze(text: str, target: Optional[int] = None, damage: Optional[str] = None) -> Dict[str, Any]:
+    """Resumo da rolagem; com `target` (CA/CD) inclui a chance de sucesso e o dano esperado."""
+    roll_distribution = distribution(text)
+    result: Dict[str, Any] = {"expression": text, "distribution": roll_distribution.summary()}
+    if target is not None:
+        result["target"] = target
+        result["success_probability"] = roll_distribution.probability_at_least(target)
+    if damage:
+        damage_summary = distribution(damage).summary()
+        result["damage"] = damage_summary
+        if target is not None:
+            result["expected_damage"] = result["success_probability"] * damage_summary["mean"]
+    return result
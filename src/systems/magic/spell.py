@@ -5,6 +5,8 @@ from dataclasses import dataclass, field
 from enum import Enum, auto
 import time
 
+from ..dice import average_roll
+
 
 class SpellSchool(Enum):
     ABJURATION = auto()  # Proteção e defesa
@@ -233,12 +235,8 @@ class Spell:
                     target.add_status_effect(effect.name, effect.duration)
 
     def _average_roll(self, dice_notation: str) -> int:
-        """Calcula a média de um dado em notação NdM."""
-        try:
-            count, sides = dice_notation.lower().split("d")
-            return (int(count) * (int(sides) + 1)) // 2
-        except Exception:
-            return 0
+        """Calcula a média de uma expressão de dados (ex.: "2d6" ou "4d8 + 4")."""
+        return average_roll(dice_notation)
 
     def get_total_casts(self) -> int:
         """Retorna o número total de vezes que a magia foi lançada."""
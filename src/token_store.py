@@ -0,0 +1,246 @@
+# src/token_store.py
+import logging
+import os
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from . import schemas
+from .websocket_manager import websocket_manager
+from .ws_codec import Frame
+
+# Carrega variáveis de ambiente
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Quantos deltas recentes cada mesa guarda para reenviar a quem se atrasou
+TOKEN_DELTA_HISTORY = int(os.getenv("TOKEN_DELTA_HISTORY", "500"))
+
+TOKEN_UPDATABLE_FIELDS = ("imageUrl", "x", "y", "size", "label")
+
+# Eventos são serializados com "type" primeiro; permite filtrar sem decodificar
+TOKEN_DELTA_PREFIX = '{"type":"token_delta"'
+# Frames de tick carregam deltas de token dentro de "events"
+TICK_PREFIX = '{"type":"tick"'
+
+
+class TokenDeltaError(ValueError):
+    """Delta de token inválido ou que referencia um token inexistente"""
+
+
+def normalize_delta(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """Valida um delta enviado pelo cliente e retorna sua forma compacta"""
+    if not isinstance(raw, dict):
+        raise TokenDeltaError("Delta de token deve ser um objeto")
+
+    op = raw.get("op")
+    try:
+        if op == "move":
+            return {"op": "move", "id": str(raw["id"]), "x": int(raw["x"]), "y": int(raw["y"])}
+        if op == "add":
+            return {"op": "add", "token": schemas.TokenState(**raw["token"]).model_dump()}
+        if op == "update":
+            fields = {k: v for k, v in raw.get("fields", {}).items() if k in TOKEN_UPDATABLE_FIELDS}
+            if not fields:
+                raise TokenDeltaError("Nenhum campo atualizável informado")
+            return {"op": "update", "id": str(raw["id"]), "fields": fields}
+        if op == "remove":
+            return {"op": "remove", "id": str(raw["id"])}
+        if op == "replace":
+            tokens = [schemas.TokenState(**token).model_dump() for token in raw["tokens"]]
+            return {"op": "replace", "tokens": tokens}
+    except TokenDeltaError:
+        raise
+    except (KeyError, TypeError, ValueError) as e:
+        raise TokenDeltaError(f"Delta '{op}' inválido: {e}") from e
+
+    raise TokenDeltaError(f"Operação de token desconhecida: {op}")
+
+
+class TableTokenStore:
+    """Estado autoritativo dos tokens de uma mesa com histórico de deltas sequenciados.
+
+    A sequência é a da sala (room_seq): cada delta leva o número do frame que o
+    transporta, então deltas de um mesmo tick compartilham o número e a
+    sequência dos tokens pode ter lacunas (frames sem deltas).
+    """
+
+    def __init__(self, table_id: str, tokens: Optional[List[Dict[str, Any]]] = None,
+                 seq: int = 0, history: int = TOKEN_DELTA_HISTORY):
+        self.table_id = table_id
+        self.tokens: Dict[str, Dict[str, Any]] = {
+            token["id"]: dict(token) for token in tokens or [] if "id" in token
+        }
+        self.seq = seq
+        self.history: Deque[Dict[str, Any]] = deque(maxlen=history)
+        # Sequência a partir da qual o histórico está completo
+        self.history_floor = seq
+
+    def check(self, delta: Dict[str, Any]):
+        """Garante que o delta se aplica ao estado atual"""
+        if delta["op"] in ("move", "update", "remove") and delta["id"] not in self.tokens:
+            raise TokenDeltaError(f"Token não encontrado: {delta['id']}")
+
+    def apply(self, delta: Dict[str, Any], seq: Optional[int] = None) -> Dict[str, Any]:
+        """Aplica um delta normalizado e retorna o evento sequenciado para broadcast"""
+        self._mutate(delta)
+
+        self.seq = max(self.seq + 1 if seq is None else seq, self.seq)
+        event = {"type": "token_delta", "seq": self.seq, **delta}
+        if len(self.history) == self.history.maxlen:
+            # O delta mais antigo sai do histórico (sem histórico, nada fica coberto)
+            self.history_floor = self.history[0]["seq"] if self.history else self.seq
+        self.history.append(event)
+        return event
+
+    def replay(self, deltas: List[Dict[str, Any]]):
+        """Reaplica deltas sem gravar histórico; os que não se aplicam são ignorados"""
+        for delta in deltas:
+            try:
+                self._mutate(delta)
+            except (TokenDeltaError, KeyError):
+                pass
+
+    def _mutate(self, delta: Dict[str, Any]):
+        self.check(delta)
+        op = delta["op"]
+
+        if op == "move":
+            token = self.tokens[delta["id"]]
+            token["x"] = delta["x"]
+            token["y"] = delta["y"]
+        elif op == "add":
+            self.tokens[delta["token"]["id"]] = dict(delta["token"])
+        elif op == "update":
+            self.tokens[delta["id"]].update(delta["fields"])
+        elif op == "remove":
+            del self.tokens[delta["id"]]
+        elif op == "replace":
+            self.tokens = {token["id"]: dict(token) for token in delta["tokens"]}
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Estado completo para quem acabou de entrar na mesa"""
+        return {"type": "tokens_snapshot", "seq": self.seq, "tokens": list(self.tokens.values())}
+
+    def deltas_since(self, seq: int) -> Optional[List[Dict[str, Any]]]:
+        """Deltas posteriores a `seq`, ou None se o histórico não cobre o intervalo"""
+        if seq >= self.seq:
+            return []
+        if seq < self.history_floor:
+            return None
+        return [event for event in self.history if event["seq"] > seq]
+
+    def to_tokens_state(self) -> List[Dict[str, Any]]:
+        """Lista de tokens no formato da coluna `tokens_state`"""
+        return list(self.tokens.values())
+
+    def copy_tokens(self) -> Dict[str, Dict[str, Any]]:
+        return {token_id: dict(token) for token_id, token in self.tokens.items()}
+
+
+def _frame_deltas(frame: Frame) -> List[Tuple[Dict[str, Any], Optional[int]]]:
+    """(delta, seq) de cada delta de token levado por um frame `token_delta` ou `tick`"""
+    if frame.json.startswith(TOKEN_DELTA_PREFIX):
+        events = [frame.payload]
+    elif frame.json.startswith(TICK_PREFIX):
+        events = frame.payload.get("events", [])
+    else:
+        return []
+    return [
+        ({k: v for k, v in event.items() if k not in ("type", "seq")}, event.get("seq"))
+        for event in events
+        if isinstance(event, dict) and event.get("type") == "token_delta"
+    ]
+
+
+class TokenStoreRegistry:
+    """Stores de tokens das mesas com conexões nesta instância.
+
+    Deltas de instâncias diferentes podem usar o mesmo room_seq; a ordem que
+    vale é a posição da sala no Redis. Um delta remoto vem antes dos eventos
+    desta instância ainda sem eco (`unconfirmed_events`), que são reaplicados
+    por cima dele; se isso muda o estado já enviado, os clientes locais
+    recebem um snapshot.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.stores: Dict[str, TableTokenStore] = {}
+
+    def get(self, table_id: str) -> Optional[TableTokenStore]:
+        return self.stores.get(table_id)
+
+    def load(self, table_id: str, tokens_state: Optional[List[Dict[str, Any]]], seq: int = 0) -> TableTokenStore:
+        """Retorna o store da mesa, criando-o a partir do estado persistido (na sequência `seq` da sala)"""
+        store = self.stores.get(table_id)
+        if store is None:
+            store = TableTokenStore(table_id, tokens_state, seq)
+            self.stores[table_id] = store
+        return store
+
+    def discard(self, table_id: str):
+        self.stores.pop(table_id, None)
+
+    def apply(self, table_id: str, raw_delta: Dict[str, Any], seq: int) -> Dict[str, Any]:
+        """Valida e aplica um delta recebido de um cliente local com o room_seq do frame que o levará"""
+        store = self.stores.get(table_id)
+        if store is None:
+            raise TokenDeltaError("Mesa sem estado de tokens carregado")
+
+        return store.apply(normalize_delta(raw_delta), seq)
+
+    def apply_remote(self, room_id: str, frame: Frame):
+        """Aplica deltas publicados por outras instâncias no store local"""
+        store = self.stores.get(room_id)
+        if store is None:
+            return
+        deltas = _frame_deltas(frame)
+        if not deltas:
+            return
+
+        failed = False
+        for delta, seq in deltas:
+            try:
+                store.apply(delta, seq)
+            except (TokenDeltaError, KeyError) as e:
+                logger.warning(f"Delta remoto não aplicado na mesa {room_id}: {e}")
+                failed = True
+
+        pending = self._pending_deltas(room_id)
+        if pending:
+            self._rebase(store, store.copy_tokens(), pending)
+        if failed:
+            # Estado local divergiu do cluster: relê o stream da sala
+            self.manager.request_resync(room_id)
+
+    def rebuild(self, room_id: str, frames: List[Frame]):
+        """Reaplica os eventos relidos do stream (na ordem da sala) e os próprios pendentes"""
+        store = self.stores.get(room_id)
+        if store is None:
+            return
+        deltas = [delta for frame in frames for delta, _ in _frame_deltas(frame)]
+        self._rebase(store, store.copy_tokens(), deltas + self._pending_deltas(room_id))
+
+    def _pending_deltas(self, room_id: str) -> List[Dict[str, Any]]:
+        return [
+            delta
+            for frame in self.manager.unconfirmed_events(room_id)
+            for delta, _ in _frame_deltas(frame)
+        ]
+
+    def _rebase(self, store: TableTokenStore, sent: Dict[str, Dict[str, Any]],
+                deltas: List[Dict[str, Any]]):
+        """Reaplica `deltas`; se o estado difere do já enviado (`sent`), envia o snapshot"""
+        store.replay(deltas)
+        if store.tokens != sent:
+            # Os deltas do histórico não levam mais ao estado atual
+            store.history_floor = store.seq
+            self.manager.send_to_local_room(store.table_id, store.snapshot())
+
+
+# Instância global do registro de tokens
+token_stores = TokenStoreRegistry(websocket_manager)
+websocket_manager.add_remote_listener(token_stores.apply_remote)
+websocket_manager.add_resync_listener(token_stores.rebuild)
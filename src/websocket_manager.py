@@ -1,19 +1,178 @@
 # src/websocket_manager.py
 import asyncio
-import json
 import redis.asyncio as redis
 import logging
-from typing import Dict, List, Set, Optional, Any
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Set, Optional, Any, Tuple, Union
 from fastapi import WebSocket
 from datetime import datetime
 import os
 from dotenv import load_dotenv
 
+from .metrics import Histogram
+from .replay import RoomReplayLog, can_sequence, unstamp
+from .ws_codec import Frame, as_frame, negotiate_subprotocol
+
+# Mensagem de broadcast: dict do evento, JSON já serializado ou Frame
+Message = Union[Frame, Dict[str, Any], str]
+
 # Carrega variáveis de ambiente
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Configuração da fila de saída por conexão
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+# Política para clientes lentos: "drop_oldest", "drop_newest" ou "disconnect"
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop_oldest")
+
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "drop_newest", "disconnect")
+
+# Conexões meio abertas já são detectadas pelo ping/pong do protocolo no uvicorn
+# (--ws-ping-interval/--ws-ping-timeout). O heartbeat JSON abaixo é opcional e só
+# serve a clientes que respondem {"type": "ping"} com {"type": "pong"}: com
+# WS_HEARTBEAT_TIMEOUT > 0, envia ping após WS_HEARTBEAT_INTERVAL sem receber nada
+# e desconecta após WS_HEARTBEAT_TIMEOUT em silêncio (0 desativa)
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "20"))
+WS_HEARTBEAT_TIMEOUT = float(os.getenv("WS_HEARTBEAT_TIMEOUT", "0"))
+# Desconecta quem só responde pings por mais que isso (0 desativa)
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "0"))
+# Sockets simultâneos de um usuário na mesma mesa; o mais antigo é substituído
+WS_MAX_SOCKETS_PER_USER = int(os.getenv("WS_MAX_SOCKETS_PER_USER", "3"))
+# Conexões por instância (0 = sem limite); acima disso o handshake é recusado
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "0"))
+WS_RETRY_AFTER = int(os.getenv("WS_RETRY_AFTER", "5"))
+
+# Presença: cada instância renova suas entradas a cada intervalo; entradas
+# sem renovação por mais de WS_PRESENCE_TTL são ignoradas (instância morta)
+WS_PRESENCE_TTL = int(os.getenv("WS_PRESENCE_TTL", "45"))
+WS_PRESENCE_HEARTBEAT_INTERVAL = float(os.getenv("WS_PRESENCE_HEARTBEAT_INTERVAL", "15"))
+
+# Pool asyncio do processo, compartilhado com o cache (src/cache.py: async_cache).
+# Com todas as conexões em uso, um comando espera até REDIS_POOL_TIMEOUT por uma livre.
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+
+# Outbox de publicação: eventos por ida ao Redis e limite de pendentes (os mais
+# antigos são descartados se o Redis não acompanhar)
+WS_PUBLISH_BATCH_SIZE = int(os.getenv("WS_PUBLISH_BATCH_SIZE", "256"))
+WS_PUBLISH_QUEUE_MAX = int(os.getenv("WS_PUBLISH_QUEUE_MAX", "10000"))
+
+# Canais Redis: um por sala e um privado por instância
+ROOM_CHANNEL_PREFIX = "websocket:room:"
+INSTANCE_CHANNEL_PREFIX = "websocket:instance:"
+# Hash por usuário: campo "<instance_id>\t<room_id>" -> timestamp da última renovação
+PRESENCE_KEY_PREFIX = "websocket:presence:"
+
+
+def room_channel(room_id: str) -> str:
+    """Nome do canal Redis de uma sala"""
+    return f"{ROOM_CHANNEL_PREFIX}{room_id}"
+
+
+def instance_channel(instance_id: str) -> str:
+    """Nome do canal Redis privado de uma instância"""
+    return f"{INSTANCE_CHANNEL_PREFIX}{instance_id}"
+
+
+def presence_key(user_id: str) -> str:
+    """Chave Redis com a presença de um usuário no cluster"""
+    return f"{PRESENCE_KEY_PREFIX}{user_id}"
+
+
+class ConnectionWriter:
+    """Fila de saída limitada e task de escrita dedicada para um WebSocket"""
+
+    def __init__(self, manager: "WebSocketManager", websocket: WebSocket,
+                 max_queue_size: int = WS_SEND_QUEUE_SIZE,
+                 policy: str = WS_SLOW_CONSUMER_POLICY,
+                 send_timeout: float = WS_SEND_TIMEOUT):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            logger.warning(f"Política de cliente lento desconhecida '{policy}', usando drop_oldest")
+            policy = "drop_oldest"
+
+        self.manager = manager
+        self.websocket = websocket
+        self.subprotocol = getattr(websocket, 'subprotocol', None)
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self.dropped = 0
+        self.closed = False
+        self.task = asyncio.create_task(self._run())
+
+    def enqueue(self, message: Frame) -> bool:
+        """Enfileira uma mensagem sem bloquear. Retorna False se foi descartada"""
+        if self.closed:
+            return False
+
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        if self.policy == "drop_oldest":
+            # Degrada: descarta a mensagem mais antiga e mantém a mais recente
+            try:
+                self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+            self.queue.put_nowait(message)
+            self._record_drop()
+            return True
+
+        self._record_drop()
+
+        if self.policy == "disconnect":
+            logger.warning(
+                f"Cliente lento desconectado - Sala: {getattr(self.websocket, 'room_id', None)}, "
+                f"Usuário: {getattr(self.websocket, 'user_id', None)}"
+            )
+            self.manager.stats["slow_consumers_disconnected"] += 1
+            self.closed = True
+            asyncio.create_task(self.manager.disconnect(self.websocket, code=1013))
+
+        return False
+
+    def _record_drop(self):
+        self.dropped += 1
+        self.manager.stats["messages_dropped"] += 1
+
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    async def _run(self):
+        """Envia as mensagens da fila uma a uma para o socket"""
+        try:
+            while True:
+                frame = await self.queue.get()
+                data = frame.encode(self.subprotocol)
+                if isinstance(data, bytes):
+                    send = self.websocket.send_bytes(data)
+                else:
+                    send = self.websocket.send_text(data)
+                await asyncio.wait_for(send, timeout=self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Conexão WebSocket morta detectada: {e}")
+            self.closed = True
+            await self.manager.disconnect(self.websocket)
+
+    def close(self):
+        """Para a task de escrita (não cancela a si mesma)"""
+        self.closed = True
+        if self.task is not asyncio.current_task() and not self.task.done():
+            self.task.cancel()
+
+
+# Frame de ping compartilhado por todas as conexões
+PING_FRAME = Frame(payload={"type": "ping"})
+
+
 class WebSocketManager:
     """Gerenciador de WebSocket com clustering Redis"""
     
@@ -21,6 +180,9 @@ class WebSocketManager:
         # Conexões WebSocket locais (nesta instância)
         self.active_connections: Dict[str, List[WebSocket]] = {}
         
+        # Índice local usuário -> conexões, para mensagens diretas sem varrer as salas
+        self.user_connections: Dict[str, List[WebSocket]] = {}
+        
         # Cliente Redis para pub/sub
         self.redis_client: Optional[redis.Redis] = None
         self.pubsub = None
@@ -31,12 +193,58 @@ class WebSocketManager:
         # Task para escutar mensagens Redis
         self.redis_listener_task: Optional[asyncio.Task] = None
         
+        # Task que renova a presença dos usuários locais
+        self.presence_task: Optional[asyncio.Task] = None
+        
+        # Task de heartbeat (iniciada na primeira conexão)
+        self.heartbeat_task: Optional[asyncio.Task] = None
+        
+        # Salas cujo canal Redis está assinado nesta instância
+        self.subscribed_rooms: Set[str] = set()
+        self._subscription_lock = asyncio.Lock()
+        
+        # Callbacks chamados com (room_id, frame) para mensagens vindas de outras instâncias
+        self.remote_listeners: List[Callable[[str, Frame], None]] = []
+        
+        # Callbacks chamados com (room_id, frames) ao reler o stream da sala (`request_resync`)
+        self.resync_listeners: List[Callable[[str, List[Frame]], None]] = []
+        self.pending_resyncs: Set[str] = set()
+        
+        # Eventos numerados desta instância ainda sem eco do canal da sala, por sala:
+        # (evento numerado, evento original). Na ordem da sala vêm depois de tudo
+        # que ainda chegar de outras instâncias
+        self.unconfirmed: Dict[str, Deque[Tuple[str, Frame]]] = {}
+        
+        # Eventos recentes por sala, para retomada após reconexão
+        self.replay = RoomReplayLog()
+        
+        # Publicações pendentes (canal, sala, seq, JSON), enviadas em lote depois do broadcast local
+        self.outbox: Deque[Tuple[str, str, Optional[int], str]] = deque(maxlen=WS_PUBLISH_QUEUE_MAX)
+        self.outbox_task: Optional[asyncio.Task] = None
+        
+        # Latência do handshake (autenticação + mesa + accept), em ms
+        self.handshake_latency = Histogram()
+        
         # Estatísticas
         self.stats = {
             "total_connections": 0,
             "active_rooms": 0,
             "messages_sent": 0,
             "messages_received": 0,
+            "messages_dropped": 0,
+            "slow_consumers_disconnected": 0,
+            "direct_messages_local": 0,
+            "direct_messages_routed": 0,
+            "direct_messages_undelivered": 0,
+            "heartbeat_timeouts": 0,
+            "idle_evictions": 0,
+            "replaced_connections": 0,
+            "rejected_at_capacity": 0,
+            "publish_batches": 0,
+            "publish_errors": 0,
+            "publish_dropped": 0,
+            "gaps_filled": 0,
+            "resyncs": 0,
             "redis_available": False
         }
     
@@ -44,23 +252,33 @@ class WebSocketManager:
         """Inicializa conexão Redis para pub/sub"""
         try:
             redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
-            self.redis_client = redis.from_url(
+            pool = redis.BlockingConnectionPool.from_url(
                 redis_url,
+                max_connections=REDIS_MAX_CONNECTIONS,
+                timeout=REDIS_POOL_TIMEOUT,
                 decode_responses=True,
                 socket_connect_timeout=5,
                 socket_timeout=5
             )
+            self.redis_client = redis.Redis.from_pool(pool)
             
             # Testa a conexão
             await self.redis_client.ping()
             
-            # Configura pub/sub
+            # Configura pub/sub: o canal da instância mantém o listener ativo
+            # mesmo sem salas locais; os canais de sala são assinados sob demanda
             self.pubsub = self.redis_client.pubsub()
-            await self.pubsub.subscribe("websocket:broadcast")
+            await self.pubsub.subscribe(instance_channel(self.instance_id))
+            for room_id in list(self.active_connections.keys()):
+                await self._sync_room_subscription(room_id)
             
             # Inicia listener em background
             self.redis_listener_task = asyncio.create_task(self._redis_listener())
             
+            # Registra e mantém a presença dos usuários conectados nesta instância
+            await self._refresh_presence()
+            self.presence_task = asyncio.create_task(self._presence_heartbeat())
+            
             self.stats["redis_available"] = True
             logger.info(f"✅ WebSocket Redis clustering ativo - Instância: {self.instance_id}")
             
@@ -73,33 +291,220 @@ class WebSocketManager:
         try:
             async for message in self.pubsub.listen():
                 if message["type"] == "message":
-                    await self._handle_redis_message(message["data"])
+                    await self._handle_redis_message(message["channel"], message["data"])
         except Exception as e:
             logger.error(f"Erro no Redis listener: {e}")
     
-    async def _handle_redis_message(self, data: str):
+    async def _sync_room_subscription(self, room_id: str):
+        """Assina o canal da sala se há conexões locais, ou cancela se a sala esvaziou"""
+        if not self.pubsub:
+            return
+        
+        async with self._subscription_lock:
+            wanted = room_id in self.active_connections
+            subscribed = room_id in self.subscribed_rooms
+            try:
+                if wanted and not subscribed:
+                    await self.pubsub.subscribe(room_channel(room_id))
+                    self.subscribed_rooms.add(room_id)
+                elif subscribed and not wanted:
+                    await self.pubsub.unsubscribe(room_channel(room_id))
+                    self.subscribed_rooms.discard(room_id)
+                    # Sem o canal, posição e eventos pendentes deixam de valer
+                    self.replay.positions.pop(room_id, None)
+                    self.unconfirmed.pop(room_id, None)
+            except Exception as e:
+                logger.error(f"Erro ao atualizar assinatura da sala {room_id}: {e}")
+    
+    async def _handle_redis_message(self, channel: str, data: str):
         """Processa mensagem recebida via Redis"""
         try:
-            message_data = json.loads(data)
-            
-            # Ignora mensagens da própria instância
-            if message_data.get("instance_id") == self.instance_id:
+            if channel.startswith(INSTANCE_CHANNEL_PREFIX):
+                await self._handle_direct_message(data)
+                return
+            if not channel.startswith(ROOM_CHANNEL_PREFIX):
                 return
             
-            room_id = message_data.get("room_id")
-            message_content = message_data.get("message")
+            # Envelope "<instance_id>[ <posição>]\n<evento JSON>": o evento não é
+            # re-decodificado aqui
+            header, _, payload = data.partition("\n")
+            instance_id, _, position = header.partition(" ")
+            room_id = channel[len(ROOM_CHANNEL_PREFIX):]
+            
+            # Eventos numerados levam a posição da sala: um salto indica eventos perdidos
+            if position and room_id in self.subscribed_rooms:
+                last = self.replay.advance(room_id, int(position))
+                if last is not None:
+                    await self._fill_gap(room_id, last, int(position) - 1)
+            
+            # Mensagens da própria instância só confirmam a publicação
+            if instance_id == self.instance_id:
+                self._confirm(room_id, payload)
+                return
+            if payload:
+                self._deliver_remote(room_id, payload)
             
-            if room_id and message_content:
-                # Envia para conexões locais desta instância
-                await self._broadcast_to_local_room(room_id, message_content)
-                self.stats["messages_received"] += 1
-                
         except Exception as e:
             logger.error(f"Erro ao processar mensagem Redis: {e}")
     
+    def _deliver_remote(self, room_id: str, payload: str):
+        """Entrega um evento publicado por outra instância aos listeners e às conexões locais"""
+        frame = Frame.from_json(payload)
+        
+        # Eventos numerados: guarda no replay local; os listeners recebem o evento original
+        seq, event_json = unstamp(payload)
+        if seq is not None:
+            self.replay.record_remote(room_id, seq, frame)
+        event = frame if seq is None else Frame.from_json(event_json)
+        
+        for listener in self.remote_listeners:
+            try:
+                listener(room_id, event)
+            except Exception as e:
+                logger.error(f"Erro em listener de mensagens remotas: {e}")
+        
+        # Envia para conexões locais desta instância
+        self.send_to_local_room(room_id, frame)
+        self.stats["messages_received"] += 1
+    
+    async def _fill_gap(self, room_id: str, after: int, upto: int):
+        """Relê do stream as posições (after, upto] que não chegaram pelo canal"""
+        events = await self.replay.read_positions(self.redis_client, room_id, after, upto)
+        for _, instance_id, payload in events or ():
+            if instance_id == self.instance_id:
+                self._confirm(room_id, payload)
+            else:
+                self._deliver_remote(room_id, payload)
+        self.stats["gaps_filled"] += 1
+        if events is None or len(events) < upto - after:
+            # Parte do intervalo já saiu do stream: o estado da sala pode ter divergido
+            logger.warning(f"Eventos perdidos na sala {room_id} (posições {after + 1}-{upto})")
+            self.request_resync(room_id)
+    
+    def _confirm(self, room_id: str, payload: str):
+        """Remove um evento próprio (e os anteriores, que não voltarão) dos não confirmados"""
+        pending = self.unconfirmed.get(room_id)
+        if not pending or all(event_json != payload for event_json, _ in pending):
+            return
+        while pending.popleft()[0] != payload:
+            pass
+    
+    def unconfirmed_events(self, room_id: str) -> List[Frame]:
+        """Eventos originais publicados por esta instância ainda sem posição conhecida"""
+        return [event for _, event in self.unconfirmed.get(room_id, ())]
+    
+    def request_resync(self, room_id: str):
+        """Pede a releitura do stream da sala pelos `resync_listeners`.
+
+        O pedido passa pelo canal desta instância para ser tratado na ordem do
+        pub/sub, depois de todos os eventos da sala já entregues aqui.
+        """
+        if self.redis_client is None or room_id in self.pending_resyncs:
+            return
+        self.pending_resyncs.add(room_id)
+        marker = f"resync\n{room_id}"
+        self.outbox.append((instance_channel(self.instance_id), room_id, None, marker))
+        self._ensure_outbox_task()
+    
+    async def _resync_room(self, room_id: str):
+        self.pending_resyncs.discard(room_id)
+        if room_id not in self.subscribed_rooms:
+            return
+        events = await self.replay.read_positions(
+            self.redis_client, room_id, 0, self.replay.positions.get(room_id, 0)
+        )
+        if events is None:
+            return
+        frames = [Frame.from_json(unstamp(payload)[1]) for _, _, payload in events]
+        for listener in self.resync_listeners:
+            try:
+                listener(room_id, frames)
+            except Exception as e:
+                logger.error(f"Erro em listener de ressincronização: {e}")
+        self.stats["resyncs"] += 1
+    
+    async def _handle_direct_message(self, data: str):
+        """Entrega uma mensagem direta roteada para esta instância.
+
+        Envelope "<instance_id>\n<user_id>\n<room_id>\n<evento JSON>" (room_id pode ser vazio),
+        ou "<instance_id>\nresync\n<room_id>" publicado por `request_resync` desta instância.
+        """
+        parts = data.split("\n", 3)
+        if len(parts) == 3 and parts[0] == self.instance_id and parts[1] == "resync":
+            await self._resync_room(parts[2])
+            return
+        _, user_id, room_id, payload = parts
+        if not self._send_to_local_user(user_id, Frame.from_json(payload), room_id or None):
+            self.stats["direct_messages_undelivered"] += 1
+    
+    def add_remote_listener(self, listener: Callable[[str, Frame], None]):
+        """Registra um callback para mensagens de sala publicadas por outras instâncias"""
+        self.remote_listeners.append(listener)
+    
+    def add_resync_listener(self, listener: Callable[[str, List[Frame]], None]):
+        """Registra um callback para os eventos relidos do stream em uma ressincronização"""
+        self.resync_listeners.append(listener)
+    
+    def at_capacity(self) -> bool:
+        """True quando a instância atingiu WS_MAX_CONNECTIONS"""
+        return WS_MAX_CONNECTIONS > 0 and self.get_total_connections() >= WS_MAX_CONNECTIONS
+    
+    async def reject_busy(self, websocket: WebSocket):
+        """Recusa o handshake com indicação de quando tentar de novo (1013 Try Again Later)"""
+        self.stats["rejected_at_capacity"] += 1
+        await websocket.accept(subprotocol=negotiate_subprotocol(websocket.scope.get("subprotocols", [])))
+        try:
+            await websocket.send_text(Frame(payload={
+                "type": "error",
+                "code": "server_busy",
+                "message": "Servidor lotado. Tente novamente em instantes.",
+                "retry_after": WS_RETRY_AFTER
+            }).json)
+        finally:
+            await websocket.close(code=1013, reason=f"retry_after={WS_RETRY_AFTER}")
+    
+    def touch(self, websocket: WebSocket, activity: bool = True):
+        """Registra tráfego do cliente; `activity=False` para pongs (não contam como uso)"""
+        now = time.monotonic()
+        websocket.last_seen = now
+        if activity:
+            websocket.last_activity = now
+    
+    def _ensure_heartbeat(self):
+        # Só há varredura se o timeout de silêncio ou o de inatividade estiver ativo
+        if not (WS_HEARTBEAT_TIMEOUT or WS_IDLE_TIMEOUT) or WS_HEARTBEAT_INTERVAL <= 0:
+            return
+        if self.heartbeat_task is None or self.heartbeat_task.done():
+            self.heartbeat_task = asyncio.create_task(self._heartbeat())
+    
+    async def _heartbeat(self):
+        """Uma varredura por intervalo para todas as conexões (não uma task por socket)"""
+        while self.active_connections:
+            await asyncio.sleep(WS_HEARTBEAT_INTERVAL)
+            try:
+                await self._check_connections()
+            except Exception as e:
+                logger.error(f"Erro no heartbeat WebSocket: {e}")
+    
+    async def _check_connections(self):
+        now = time.monotonic()
+        for connections in list(self.active_connections.values()):
+            for connection in list(connections):
+                silent = now - getattr(connection, 'last_seen', now)
+                if WS_HEARTBEAT_TIMEOUT and silent >= WS_HEARTBEAT_TIMEOUT:
+                    self.stats["heartbeat_timeouts"] += 1
+                    await self.disconnect(connection, code=1001)
+                elif WS_IDLE_TIMEOUT and now - getattr(connection, 'last_activity', now) >= WS_IDLE_TIMEOUT:
+                    self.stats["idle_evictions"] += 1
+                    await self.disconnect(connection, code=1001)
+                elif WS_HEARTBEAT_TIMEOUT and silent >= WS_HEARTBEAT_INTERVAL:
+                    self.send_to_connection(connection, PING_FRAME)
+    
     async def connect(self, websocket: WebSocket, room_id: str, user_id: str = None):
-        """Conecta WebSocket a uma sala"""
-        await websocket.accept()
+        """Conecta WebSocket a uma sala, negociando o subprotocolo (JSON ou MessagePack)"""
+        subprotocol = negotiate_subprotocol(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
+        websocket.subprotocol = subprotocol
         
         if room_id not in self.active_connections:
             self.active_connections[room_id] = []
@@ -110,23 +515,58 @@ class WebSocketManager:
         websocket.user_id = user_id
         websocket.room_id = room_id
         websocket.connected_at = datetime.now()
+        websocket.writer = ConnectionWriter(self, websocket)
+        self.touch(websocket)
+        
+        if user_id:
+            # Limite por usuário e mesa: a conexão mais antiga (provavelmente morta) sai
+            same_room = [
+                connection for connection in self.user_connections.get(user_id, [])
+                if getattr(connection, 'room_id', None) == room_id
+            ]
+            excess = len(same_room) - WS_MAX_SOCKETS_PER_USER + 1
+            if WS_MAX_SOCKETS_PER_USER > 0 and excess > 0:
+                for connection in same_room[:excess]:
+                    self.stats["replaced_connections"] += 1
+                    await self.disconnect(connection, code=4000)
+            self.user_connections.setdefault(user_id, []).append(websocket)
         
         self.stats["total_connections"] += 1
         self.stats["active_rooms"] = len(self.active_connections)
         
         logger.info(f"WebSocket conectado - Sala: {room_id}, Usuário: {user_id}, Instância: {self.instance_id}")
         
-        # Notifica outras instâncias sobre nova conexão
-        await self._notify_connection_event(room_id, user_id, "connected")
+        self._ensure_heartbeat()
+        
+        # Primeira conexão local da sala: passa a receber o canal dela e, já
+        # inscrita, alinha a sequência local com a do cluster
+        first_in_room = room_id not in self.subscribed_rooms
+        await self._sync_room_subscription(room_id)
+        if first_in_room:
+            await self.replay.seed(self.redis_client, room_id)
+        
+        # Publica a presença para roteamento de mensagens diretas
+        await self._set_presence(user_id, room_id)
     
-    async def disconnect(self, websocket: WebSocket):
+    async def disconnect(self, websocket: WebSocket, code: Optional[int] = None):
         """Desconecta WebSocket"""
         room_id = getattr(websocket, 'room_id', None)
         user_id = getattr(websocket, 'user_id', None)
         
+        writer = getattr(websocket, 'writer', None)
+        if writer:
+            writer.close()
+        
+        if code is not None:
+            try:
+                await websocket.close(code=code)
+            except Exception:
+                pass  # Socket já fechado
+        
         if room_id and room_id in self.active_connections:
             try:
                 self.active_connections[room_id].remove(websocket)
+                self._remove_user_connection(user_id, websocket)
                 
                 # Remove sala se não há mais conexões
                 if not self.active_connections[room_id]:
@@ -137,127 +577,229 @@ class WebSocketManager:
                 
                 logger.info(f"WebSocket desconectado - Sala: {room_id}, Usuário: {user_id}")
                 
-                # Notifica outras instâncias sobre desconexão
-                await self._notify_connection_event(room_id, user_id, "disconnected")
+                # Sala vazia nesta instância: deixa de receber o canal dela
+                await self._sync_room_subscription(room_id)
+                
+                # Última conexão do usuário nesta sala e instância: remove a presença
+                if user_id and not self._user_in_room(user_id, room_id):
+                    await self._clear_presence(user_id, room_id)
                 
             except ValueError:
                 pass  # WebSocket já foi removido
     
-    async def broadcast_to_room(self, room_id: str, message: str, exclude_instance: bool = False):
-        """Envia mensagem para todos na sala (todas as instâncias)"""
+    async def broadcast_to_room(self, room_id: str, message: Message, exclude_instance: bool = False,
+                                seq: Optional[int] = None):
+        """Envia mensagem para todos na sala (todas as instâncias).
+
+        Numeração e entrega local não esperam o Redis; a gravação no stream de
+        replay e a publicação para as outras instâncias saem em lote pelo outbox.
+        `seq` é um número já reservado com `replay.reserve` (ex.: deltas de token).
+        """
+        # Serializa uma única vez por protocolo para todos os destinatários
+        frame = event = as_frame(message)
+        
+        # Sala sem estado nesta instância (ex.: aviso via HTTP): numera a partir do cluster
+        transient = room_id not in self.active_connections and room_id not in self.replay.local_seq
+        if can_sequence(frame):
+            if transient:
+                await self.replay.seed(self.redis_client, room_id)
+            # Numera o evento (room_seq) para que clientes reconectados peçam só o que perderam
+            seq = self.replay.reserve(room_id) if seq is None else seq
+            frame = self.replay.record(room_id, seq, frame)
+        else:
+            seq = None
+        
         # Envia para conexões locais
-        await self._broadcast_to_local_room(room_id, message)
+        self.send_to_local_room(room_id, frame)
         
-        # Envia via Redis para outras instâncias
-        if self.redis_client and not exclude_instance:
-            await self._broadcast_via_redis(room_id, message)
+        # Stream de replay e outras instâncias: fora do caminho do broadcast
+        if self.redis_client is not None and not exclude_instance:
+            self._enqueue_publish(room_id, seq, frame, event)
+        
+        if transient:
+            # Nada a guardar para uma sala que não está aberta aqui
+            self.replay.discard(room_id)
         
         self.stats["messages_sent"] += 1
     
-    async def _broadcast_to_local_room(self, room_id: str, message: str):
-        """Envia mensagem apenas para conexões locais da sala"""
-        if room_id not in self.active_connections:
+    def _enqueue_publish(self, room_id: str, seq: Optional[int], frame: Frame, event: Frame):
+        if len(self.outbox) == self.outbox.maxlen:
+            self.stats["publish_dropped"] += 1
+            self._forget(*self.outbox[0])
+        self.outbox.append((room_channel(room_id), room_id, seq, frame.json))
+        if seq is not None and room_id in self.subscribed_rooms:
+            self.unconfirmed.setdefault(room_id, deque()).append((frame.json, event))
+        self._ensure_outbox_task()
+    
+    def _ensure_outbox_task(self):
+        if self.outbox_task is None or self.outbox_task.done():
+            self.outbox_task = asyncio.create_task(self._drain_outbox())
+    
+    def _forget(self, channel: str, room_id: str, seq: Optional[int], event_json: str):
+        """Tira dos não confirmados um evento que não será publicado"""
+        pending = self.unconfirmed.get(room_id)
+        if seq is None or not pending:
             return
-        
-        # Lista de conexões a serem removidas (mortas)
-        dead_connections = []
-        
-        for connection in self.active_connections[room_id]:
+        for entry in pending:
+            if entry[0] == event_json:
+                pending.remove(entry)
+                break
+    
+    async def _drain_outbox(self):
+        """Publica o outbox em lotes, na ordem de emissão desta instância"""
+        while self.outbox and self.redis_client is not None:
+            batch = [self.outbox.popleft() for _ in range(min(len(self.outbox), WS_PUBLISH_BATCH_SIZE))]
             try:
-                await connection.send_text(message)
+                await self.replay.publish(self.redis_client, self.instance_id, batch)
+                self.stats["publish_batches"] += 1
             except Exception as e:
-                logger.warning(f"Conexão WebSocket morta detectada: {e}")
-                dead_connections.append(connection)
-        
-        # Remove conexões mortas
-        for dead_conn in dead_connections:
-            await self.disconnect(dead_conn)
+                self.stats["publish_errors"] += 1
+                logger.error(f"Erro ao publicar {len(batch)} evento(s) via Redis: {e}")
+                for entry in batch:
+                    self._forget(*entry)
     
-    async def _broadcast_via_redis(self, room_id: str, message: str):
-        """Envia mensagem via Redis pub/sub"""
-        if not self.redis_client:
+    def send_to_local_room(self, room_id: str, message: Message):
+        """Enfileira mensagem para as conexões locais da sala sem aguardar o envio"""
+        if room_id not in self.active_connections:
             return
         
+        message = as_frame(message)
+        # Cópia da lista: a política "disconnect" pode remover conexões durante o laço
+        for connection in list(self.active_connections[room_id]):
+            self.send_to_connection(connection, message)
+    
+    def send_to_connection(self, websocket: WebSocket, message: Message) -> bool:
+        """Enfileira mensagem para um único WebSocket (resposta direta ao cliente)"""
+        writer = getattr(websocket, 'writer', None)
+        if writer is None:
+            return False
+        return writer.enqueue(as_frame(message))
+    
+    def _remove_user_connection(self, user_id: Optional[str], websocket: WebSocket):
+        connections = self.user_connections.get(user_id)
+        if not connections:
+            return
         try:
-            redis_message = {
-                "instance_id": self.instance_id,
-                "room_id": room_id,
-                "message": message,
-                "timestamp": datetime.now().isoformat()
-            }
-            
-            await self.redis_client.publish(
-                "websocket:broadcast", 
-                json.dumps(redis_message)
-            )
-            
+            connections.remove(websocket)
+        except ValueError:
+            pass
+        if not connections:
+            del self.user_connections[user_id]
+    
+    def _user_in_room(self, user_id: str, room_id: str) -> bool:
+        return any(
+            getattr(connection, 'room_id', None) == room_id
+            for connection in self.user_connections.get(user_id, [])
+        )
+    
+    def _presence_field(self, room_id: str) -> str:
+        return f"{self.instance_id}\t{room_id}"
+    
+    async def _set_presence(self, user_id: Optional[str], room_id: str):
+        """Registra (instância, sala) do usuário no Redis"""
+        if not self.redis_client or not user_id:
+            return
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.hset(presence_key(user_id), self._presence_field(room_id), int(time.time()))
+                pipe.expire(presence_key(user_id), WS_PRESENCE_TTL)
+                await pipe.execute()
         except Exception as e:
-            logger.error(f"Erro ao enviar via Redis: {e}")
+            logger.error(f"Erro ao registrar presença: {e}")
     
-    async def _notify_connection_event(self, room_id: str, user_id: str, event_type: str):
-        """Notifica outras instâncias sobre eventos de conexão"""
+    async def _clear_presence(self, user_id: str, room_id: str):
         if not self.redis_client:
             return
-        
         try:
-            event_message = {
-                "type": "connection_event",
-                "event": event_type,
-                "room_id": room_id,
-                "user_id": user_id,
-                "instance_id": self.instance_id,
-                "timestamp": datetime.now().isoformat()
-            }
-            
-            await self.redis_client.publish(
-                "websocket:events", 
-                json.dumps(event_message)
-            )
-            
+            await self.redis_client.hdel(presence_key(user_id), self._presence_field(room_id))
         except Exception as e:
-            logger.error(f"Erro ao notificar evento: {e}")
+            logger.error(f"Erro ao remover presença: {e}")
     
-    async def send_to_user(self, user_id: str, message: str, room_id: str = None):
-        """Envia mensagem para um usuário específico"""
-        sent = False
+    def _local_presence(self) -> List[Tuple[str, str]]:
+        """Pares (usuário, sala) conectados nesta instância"""
+        return list({
+            (user_id, getattr(connection, 'room_id', None))
+            for user_id, connections in self.user_connections.items()
+            for connection in connections
+        })
+    
+    async def _refresh_presence(self):
+        """Renova em um único pipeline a presença de todos os usuários locais"""
+        pairs = self._local_presence()
+        if not self.redis_client or not pairs:
+            return
+        now = int(time.time())
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for user_id, room_id in pairs:
+                pipe.hset(presence_key(user_id), self._presence_field(room_id), now)
+                pipe.expire(presence_key(user_id), WS_PRESENCE_TTL)
+            await pipe.execute()
+    
+    async def _presence_heartbeat(self):
+        while True:
+            await asyncio.sleep(WS_PRESENCE_HEARTBEAT_INTERVAL)
+            try:
+                await self._refresh_presence()
+            except Exception as e:
+                logger.error(f"Erro ao renovar presença: {e}")
+    
+    async def get_user_presence(self, user_id: str) -> List[Dict[str, str]]:
+        """Instâncias e salas em que o usuário está conectado (todo o cluster)"""
+        if not self.redis_client:
+            return [
+                {"instance_id": self.instance_id, "room_id": getattr(connection, 'room_id', None)}
+                for connection in self.user_connections.get(user_id, [])
+            ]
         
-        # Procura nas conexões locais
-        for room, connections in self.active_connections.items():
-            if room_id and room != room_id:
+        entries = await self.redis_client.hgetall(presence_key(user_id))
+        oldest = time.time() - WS_PRESENCE_TTL
+        presence = []
+        for field, heartbeat in entries.items():
+            if float(heartbeat) < oldest:
+                continue  # Instância parou de renovar
+            instance_id, _, room_id = field.partition("\t")
+            presence.append({"instance_id": instance_id, "room_id": room_id})
+        return presence
+    
+    def _send_to_local_user(self, user_id: str, message: Frame, room_id: Optional[str] = None) -> bool:
+        sent = False
+        for connection in self.user_connections.get(user_id, []):
+            if room_id and getattr(connection, 'room_id', None) != room_id:
                 continue
-                
-            for connection in connections:
-                if getattr(connection, 'user_id', None) == user_id:
-                    try:
-                        await connection.send_text(message)
-                        sent = True
-                    except Exception as e:
-                        logger.warning(f"Erro ao enviar para usuário {user_id}: {e}")
-                        await self.disconnect(connection)
-        
-        # Se não encontrou localmente, tenta via Redis
-        if not sent and self.redis_client:
-            await self._send_to_user_via_redis(user_id, message, room_id)
-    
-    async def _send_to_user_via_redis(self, user_id: str, message: str, room_id: str = None):
-        """Envia mensagem para usuário via Redis"""
-        try:
-            redis_message = {
-                "type": "user_message",
-                "target_user_id": user_id,
-                "room_id": room_id,
-                "message": message,
-                "instance_id": self.instance_id,
-                "timestamp": datetime.now().isoformat()
-            }
-            
-            await self.redis_client.publish(
-                "websocket:user_messages", 
-                json.dumps(redis_message)
-            )
-            
-        except Exception as e:
-            logger.error(f"Erro ao enviar mensagem de usuário via Redis: {e}")
+            if self.send_to_connection(connection, message):
+                sent = True
+        return sent
+    
+    async def send_to_user(self, user_id: str, message: Message, room_id: str = None) -> bool:
+        """Envia mensagem para um usuário específico, em qualquer instância.
+
+        Conexões locais são encontradas pelo índice de usuários; as remotas pelo
+        registro de presença, com publicação apenas no canal da instância dona.
+        """
+        message = as_frame(message)
+        sent = self._send_to_local_user(user_id, message, room_id)
+        if sent:
+            self.stats["direct_messages_local"] += 1
+        
+        if self.redis_client:
+            try:
+                instances = {
+                    entry["instance_id"]
+                    for entry in await self.get_user_presence(user_id)
+                    if entry["instance_id"] != self.instance_id
+                    and (not room_id or entry["room_id"] == room_id)
+                }
+                envelope = f"{self.instance_id}\n{user_id}\n{room_id or ''}\n{message.json}"
+                for instance_id in instances:
+                    await self.redis_client.publish(instance_channel(instance_id), envelope)
+                    self.stats["direct_messages_routed"] += 1
+                    sent = True
+            except Exception as e:
+                logger.error(f"Erro ao rotear mensagem de usuário via Redis: {e}")
+        
+        if not sent:
+            self.stats["direct_messages_undelivered"] += 1
+        return sent
     
     def get_room_connections_count(self, room_id: str) -> int:
         """Retorna número de conexões locais em uma sala"""
@@ -273,15 +815,59 @@ class WebSocketManager:
     
     def get_stats(self) -> Dict[str, Any]:
         """Retorna estatísticas do WebSocket manager"""
+        queue_depths = [
+            connection.writer.depth()
+            for connections in self.active_connections.values()
+            for connection in connections
+            if getattr(connection, 'writer', None)
+        ]
         self.stats.update({
             "active_rooms": len(self.active_connections),
             "total_connections": self.get_total_connections(),
+            "subscribed_rooms": len(self.subscribed_rooms),
+            "send_queue_depth": sum(queue_depths),
+            "max_send_queue_depth": max(queue_depths, default=0),
+            "slow_consumer_policy": WS_SLOW_CONSUMER_POLICY,
+            "max_connections": WS_MAX_CONNECTIONS,
+            "handshake_latency_ms": self.handshake_latency.snapshot(),
+            "local_users": len(self.user_connections),
+            "replay": self.replay.get_stats(),
             "instance_id": self.instance_id
         })
         return self.stats.copy()
     
     async def cleanup(self):
         """Limpa recursos"""
+        # Para as tasks de escrita das conexões locais
+        for connections in self.active_connections.values():
+            for connection in connections:
+                writer = getattr(connection, 'writer', None)
+                if writer:
+                    writer.close()
+        
+        if self.heartbeat_task:
+            self.heartbeat_task.cancel()
+        
+        # Para a renovação de presença e remove as entradas desta instância
+        if self.presence_task:
+            self.presence_task.cancel()
+            try:
+                await self.presence_task
+            except asyncio.CancelledError:
+                pass
+        if self.redis_client:
+            try:
+                async with self.redis_client.pipeline(transaction=False) as pipe:
+                    for user_id, room_id in self._local_presence():
+                        pipe.hdel(presence_key(user_id), self._presence_field(room_id))
+                    await pipe.execute()
+            except Exception as e:
+                logger.error(f"Erro ao remover presença da instância: {e}")
+        
+        # Publica o que ainda está no outbox
+        if self.outbox_task:
+            await self.outbox_task
+        
         # Para o listener Redis
         if self.redis_listener_task:
             self.redis_listener_task.cancel()
@@ -294,7 +880,8 @@ class WebSocketManager:
         if self.pubsub:
             await self.pubsub.close()
         
-        # Fecha cliente Redis
+        # Fecha cliente Redis (e o pool, compartilhado com o cache asyncio)
+        self.stats["redis_available"] = False
         if self.redis_client:
             await self.redis_client.close()
         
@@ -0,0 +1,123 @@
+# src/write_behind.py
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Iterable, Optional
+
+from dotenv import load_dotenv
+
+from . import crud
+from .cache import invalidate_tables_cache_async
+from .database import SessionLocal
+
+# Carrega variáveis de ambiente
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Intervalo (segundos) entre gravações em lote do estado das mesas
+TABLE_STATE_FLUSH_INTERVAL = float(os.getenv("TABLE_STATE_FLUSH_INTERVAL", "2"))
+
+
+class TableStateWriter:
+    """Persistência write-behind do estado das mesas (tokens e mapa).
+
+    As atualizações ficam em memória e só a versão mais recente de cada mesa é
+    gravada, em uma única transação, a cada intervalo, ao fechar a sala ou no
+    shutdown. Um crash perde no máximo um intervalo de estado.
+    """
+
+    def __init__(self, interval: float = TABLE_STATE_FLUSH_INTERVAL):
+        self.interval = interval
+        # table_id -> {coluna: valor}; valores podem ser callables avaliados no flush
+        self.dirty: Dict[str, Dict[str, Any]] = {}
+        self.task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self.stats = {
+            "updates_received": 0,
+            "flushes": 0,
+            "tables_written": 0,
+            "flush_errors": 0,
+            "last_flush_ms": 0.0
+        }
+
+    def mark_dirty(self, table_id: str, **fields: Any):
+        """Registra o novo estado de uma mesa; sobrescreve o pendente anterior"""
+        self.dirty.setdefault(table_id, {}).update(fields)
+        self.stats["updates_received"] += 1
+
+    def start(self):
+        """Inicia o flush periódico"""
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Erro no flush write-behind: {e}")
+
+    async def flush(self, table_ids: Optional[Iterable[str]] = None) -> int:
+        """Grava as mesas pendentes (todas ou apenas `table_ids`). Retorna quantas foram gravadas"""
+        async with self._flush_lock:
+            if table_ids is None:
+                ids = list(self.dirty)
+            else:
+                ids = [table_id for table_id in table_ids if table_id in self.dirty]
+            if not ids:
+                return 0
+
+            # Resolve os valores no event loop, antes de entregar ao thread do banco
+            batch = {table_id: self._resolve(self.dirty.pop(table_id)) for table_id in ids}
+
+            start_time = time.perf_counter()
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._write, batch)
+            except Exception as e:
+                # Devolve para a próxima tentativa sem sobrescrever valores mais novos
+                for table_id, fields in batch.items():
+                    self.dirty[table_id] = {**fields, **self.dirty.get(table_id, {})}
+                self.stats["flush_errors"] += 1
+                logger.error(f"Erro ao gravar estado de {len(batch)} mesa(s): {e}")
+                return 0
+
+            self.stats["flushes"] += 1
+            self.stats["tables_written"] += len(batch)
+            self.stats["last_flush_ms"] = (time.perf_counter() - start_time) * 1000
+
+        # Os detalhes cacheados incluem tokens_state: descarta as cópias antigas
+        await invalidate_tables_cache_async(batch)
+        return len(batch)
+
+    @staticmethod
+    def _resolve(fields: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: value() if callable(value) else value for key, value in fields.items()}
+
+    @staticmethod
+    def _write(batch: Dict[str, Dict[str, Any]]):
+        db = SessionLocal()
+        try:
+            crud.bulk_update_table_states(db, batch)
+        finally:
+            db.close()
+
+    async def stop(self):
+        """Para o flush periódico e grava tudo o que estiver pendente"""
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "pending_tables": len(self.dirty), "interval": self.interval}
+
+
+# Instância global do write-behind
+table_state_writer = TableStateWriter()
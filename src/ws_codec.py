@@ -0,0 +1,109 @@
+# src/ws_codec.py
+import json
+import logging
+from typing import Any, Dict, Iterable, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# MessagePack é opcional: sem ele apenas o protocolo JSON é oferecido
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Subprotocolos WebSocket suportados (Sec-WebSocket-Protocol)
+JSON_SUBPROTOCOL = "dk.json"
+MSGPACK_SUBPROTOCOL = "dk.msgpack"
+
+
+def supported_subprotocols() -> list:
+    """Subprotocolos disponíveis neste servidor"""
+    protocols = [JSON_SUBPROTOCOL]
+    if msgpack is not None:
+        protocols.append(MSGPACK_SUBPROTOCOL)
+    return protocols
+
+
+def negotiate_subprotocol(requested: Iterable[str]) -> Optional[str]:
+    """Escolhe o primeiro subprotocolo pedido pelo cliente que o servidor suporta.
+
+    Retorna None quando o cliente não pediu nenhum conhecido; nesse caso a
+    conexão segue com JSON em frames de texto, como antes.
+    """
+    supported = supported_subprotocols()
+    for protocol in requested:
+        if protocol in supported:
+            return protocol
+    return None
+
+
+def encode_json(payload: Any) -> str:
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+
+
+class Frame:
+    """Evento de broadcast serializado no máximo uma vez por protocolo.
+
+    A mesma instância é enfileirada para todos os destinatários; cada
+    codificação é calculada na primeira vez que é pedida e reaproveitada.
+    """
+
+    __slots__ = ("_payload", "_json", "_msgpack")
+
+    def __init__(self, payload: Any = None, json_text: Optional[str] = None):
+        self._payload = payload
+        self._json = json_text
+        self._msgpack: Optional[bytes] = None
+
+    @classmethod
+    def from_json(cls, json_text: str) -> "Frame":
+        """Cria um frame a partir de JSON já serializado (ex.: vindo do Redis)"""
+        return cls(json_text=json_text)
+
+    @property
+    def payload(self) -> Any:
+        if self._payload is None and self._json is not None:
+            self._payload = json.loads(self._json)
+        return self._payload
+
+    @property
+    def json(self) -> str:
+        if self._json is None:
+            self._json = encode_json(self._payload)
+        return self._json
+
+    @property
+    def msgpack(self) -> bytes:
+        if self._msgpack is None:
+            self._msgpack = msgpack.packb(self.payload, use_bin_type=True)
+        return self._msgpack
+
+    def encode(self, subprotocol: Optional[str]) -> Union[str, bytes]:
+        """Retorna o frame pronto para envio no subprotocolo da conexão"""
+        if subprotocol == MSGPACK_SUBPROTOCOL:
+            return self.msgpack
+        return self.json
+
+
+def as_frame(message: Union[Frame, Dict[str, Any], str]) -> Frame:
+    """Normaliza dict, JSON em texto ou Frame para Frame"""
+    if isinstance(message, Frame):
+        return message
+    if isinstance(message, str):
+        return Frame.from_json(message)
+    return Frame(payload=message)
+
+
+def decode_client_message(data: Union[str, bytes]) -> Dict[str, Any]:
+    """Decodifica uma mensagem recebida do cliente (texto JSON ou binário MessagePack).
+
+    Levanta ValueError se o conteúdo não puder ser decodificado.
+    """
+    if isinstance(data, str):
+        return json.loads(data)
+    if msgpack is None:
+        raise ValueError("Frames binários exigem o subprotocolo MessagePack")
+    try:
+        return msgpack.unpackb(data, raw=False)
+    except Exception as e:
+        raise ValueError(f"MessagePack inválido: {e}") from e
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Benchmark de Middleware - Dungeon Keeper
+Mede o custo por requisição do pipeline HTTP contra a pilha antiga de
+camadas BaseHTTPMiddleware, chamando a aplicação ASGI diretamente (sem rede).
+
+Uso: python tests/automation/middleware_benchmark.py [requisições]
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+# Adicionar o diretório raiz ao path para importações
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from src.compression import Compression
+from src.middleware import HTTPPipelineMiddleware, HTTPMetrics, ResponseHeaderPolicy
+
+SMALL_PAYLOAD = {"status": "healthy", "version": "1.0.0"}
+# Semelhante a uma listagem de monstros
+LARGE_PAYLOAD = [
+    {"id": str(i), "name": f"Goblin {i}", "hit_points": "7 (2d6)", "armor_class": 15, "tags": ["humanoid", "goblinoid"]}
+    for i in range(300)
+]
+
+
+async def small(request):
+    return JSONResponse(SMALL_PAYLOAD)
+
+
+async def large(request):
+    return JSONResponse(LARGE_PAYLOAD)
+
+
+def build_app() -> Starlette:
+    return Starlette(routes=[Route("/api/v1/small", small), Route("/api/v1/large", large)])
+
+
+class _PassThrough(BaseHTTPMiddleware):
+    """Camada BaseHTTPMiddleware que só adiciona um header (custo estrutural da pilha antiga)"""
+
+    async def dispatch(self, request, call_next):
+        response = await call_next(request)
+        response.headers["X-Layer"] = "1"
+        return response
+
+
+def legacy_app() -> Starlette:
+    # Mesma estrutura da pilha antiga: cinco BaseHTTPMiddleware + GZipMiddleware
+    app = build_app()
+    app.add_middleware(_PassThrough)
+    app.add_middleware(_PassThrough)
+    app.add_middleware(GZipMiddleware, minimum_size=1000)
+    app.add_middleware(_PassThrough)
+    app.add_middleware(_PassThrough)
+    app.add_middleware(_PassThrough)
+    return app
+
+
+def pipeline_app() -> Starlette:
+    app = build_app()
+    app.add_middleware(
+        HTTPPipelineMiddleware,
+        metrics=HTTPMetrics(log_every=10 ** 9),
+        header_policy=ResponseHeaderPolicy(),
+        compression=Compression(minimum_size=500),
+    )
+    return app
+
+
+async def request(app, path: str, accept_encoding: bytes) -> int:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": [(b"host", b"bench"), (b"accept-encoding", accept_encoding)],
+        "client": ("127.0.0.1", 1234), "server": ("bench", 80),
+    }
+    received = 0
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal received
+        if message["type"] == "http.response.body":
+            received += len(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return received
+
+
+async def measure(app, path: str, accept_encoding: bytes, count: int):
+    for _ in range(200):  # aquecimento
+        await request(app, path, accept_encoding)
+    samples = []
+    for _ in range(count):
+        started = time.perf_counter()
+        size = await request(app, path, accept_encoding)
+        samples.append((time.perf_counter() - started) * 1e6)
+    return statistics.median(samples), statistics.mean(samples), size
+
+
+async def main(count: int):
+    import logging
+    logging.getLogger("src.middleware").setLevel(logging.WARNING)
+
+    apps = {"sem middleware": build_app(), "BaseHTTPMiddleware x6": legacy_app(), "pipeline ASGI": pipeline_app()}
+    cases = [("/api/v1/small", b"identity"), ("/api/v1/large", b"identity"), ("/api/v1/large", b"gzip")]
+    for path, encoding in cases:
+        print(f"\n{path} (accept-encoding: {encoding.decode()}) - {count} requisições")
+        baseline = None
+        for name, app in apps.items():
+            median, mean, size = await measure(app, path, encoding, count)
+            baseline = median if baseline is None else baseline
+            print(f"  {name:24s} mediana {median:8.1f} µs  média {mean:8.1f} µs  "
+                  f"overhead {median - baseline:8.1f} µs  corpo {size} bytes")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
@@ -0,0 +1,92 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("redis")
+
+from src import crud, auth  # crud antes de auth: import circular
+from src.routers import game_ws
+from src.token_store import token_stores
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    messages = []
+    monkeypatch.setattr(game_ws.websocket_manager, "send_to_connection",
+                        lambda websocket, message: messages.append(message))
+    return messages
+
+
+def test_sync_tokens_loads_missing_store(monkeypatch, sent):
+    table_id = "mesa-sem-store"
+    token_stores.discard(table_id)
+    monkeypatch.setattr(game_ws, "_load_tokens_state",
+                        lambda _: [{"id": "t1", "imageUrl": "/a.png", "x": 1, "y": 2}])
+    try:
+        asyncio.run(game_ws._sync_tokens(object(), table_id, 0))
+        assert sent == []  # nada novo desde a sequência 0
+        assert token_stores.get(table_id).tokens["t1"]["x"] == 1
+    finally:
+        token_stores.discard(table_id)
+
+
+def test_sync_tokens_sends_missed_deltas_or_snapshot(sent):
+    table_id = "mesa-com-store"
+    store = token_stores.load(table_id, [{"id": "t1", "imageUrl": "/a.png", "x": 0, "y": 0}])
+    try:
+        store.history = type(store.history)(maxlen=1)
+        store.apply({"op": "move", "id": "t1", "x": 1, "y": 1})
+        store.apply({"op": "move", "id": "t1", "x": 2, "y": 2})
+
+        asyncio.run(game_ws._sync_tokens(object(), table_id, 1))
+        assert [event["seq"] for event in sent] == [2]
+
+        sent.clear()
+        asyncio.run(game_ws._sync_tokens(object(), table_id, 0))
+        assert sent[0]["type"] == "tokens_snapshot" and sent[0]["seq"] == 2
+    finally:
+        token_stores.discard(table_id)
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.scope = {"subprotocols": []}
+        self.closed = None
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def close(self, code=1000, reason=None):
+        self.closed = code
+
+
+def test_failed_handshake_after_connect_leaves_the_room(monkeypatch):
+    table_id = "mesa-handshake"
+    manager = game_ws.websocket_manager
+
+    # Token já verificado; o usuário vem do crud, sem consultar o banco
+    auth.principal_cache.put("t", jti="jti-handshake", user_id="u1", username="ana",
+                             expires_at=time.time() + 60, synced=True)
+    monkeypatch.setattr(crud, "get_user_by_username", lambda db, username: SimpleNamespace(
+        id="u1", username=username, is_active=True
+    ))
+
+    def broken_load(table_id):
+        raise RuntimeError("banco fora do ar")
+
+    monkeypatch.setattr(game_ws, "_load_tokens_state", broken_load)
+    game_ws._table_exists_cache.set(table_id, True)
+    websocket = FakeWebSocket()
+
+    try:
+        asyncio.run(game_ws.websocket_endpoint(websocket, table_id, token="t", last_seq=None))
+    finally:
+        auth.principal_cache.evict_token("jti-handshake")
+    assert websocket.closed is None  # autenticou: a falha foi depois do connect
+    assert manager.get_room_connections_count(table_id) == 0
+    assert websocket not in manager.user_connections.get("u1", [])
+    assert token_stores.get(table_id) is None
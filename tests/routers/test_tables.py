@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("redis")
+
+from src.routers import tables
+
+
+class FakeSession:
+    def __init__(self, opened):
+        self.closed = False
+        opened.append(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.closed = True
+
+
+def test_table_loader_outlives_cancelled_first_caller(monkeypatch):
+    opened = []
+    queried = []
+    release = None
+
+    async def get_table(db, table_id, with_relationships=False):
+        await release.wait()
+        queried.append(db.closed)
+        return None  # mesa inexistente: nada é cacheado
+
+    monkeypatch.setattr(tables.database, "AsyncSessionLocal", object())
+    monkeypatch.setattr(tables, "new_async_session", lambda: FakeSession(opened))
+    monkeypatch.setattr(tables.crud_async, "get_table", get_table)
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        first = asyncio.ensure_future(tables.get_table_by_id("mesa-x", current_user=None))
+        second = asyncio.ensure_future(tables.get_table_by_id("mesa-x", current_user=None))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(tables.HTTPException):
+            await second
+
+    asyncio.run(scenario())
+    # Uma única carga, com sessão própria ainda aberta durante a consulta
+    assert len(opened) == 1
+    assert queried == [False]
+    assert opened[0].closed
+
+
+def test_table_loader_uses_sync_session_without_async_driver(monkeypatch):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+
+    from src import models
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False},
+                           poolclass=StaticPool)
+    models.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    with session_factory() as db:
+        db.add(models.Table(id="mesa-sync", title="Mesa", description="d", master_id="u1"))
+        db.commit()
+
+    def no_async_session():
+        raise AssertionError("sessão assíncrona aberta sem driver")
+
+    monkeypatch.setattr(tables.database, "AsyncSessionLocal", None)
+    monkeypatch.setattr(tables, "new_async_session", no_async_session)
+    monkeypatch.setattr(tables, "SessionLocal", session_factory)
+
+    table = asyncio.run(tables.get_table_by_id("mesa-sync", current_user=None))
+    assert table["id"] == "mesa-sync"
+    assert table["players"] == []
+    with pytest.raises(tables.HTTPException):
+        asyncio.run(tables.get_table_by_id("mesa-inexistente", current_user=None))
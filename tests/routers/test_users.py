@@ -0,0 +1,47 @@
+import time
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("jose")
+
+from src import crud, schemas, auth  # crud antes de auth: import circular
+from src.routers import users
+
+
+class NoDatabase:
+    """Sessão que falha em qualquer uso"""
+
+    def __getattr__(self, name):
+        raise AssertionError(f"acesso ao banco: {name}")
+
+
+def test_cached_principal_needs_no_database(monkeypatch):
+    token = auth.create_access_token({"sub": "ana", "user_id": "u-cache"})
+    entry = auth.principal_cache.put(
+        token, jti="jti-cache", user_id="u-cache", username="ana",
+        expires_at=time.time() + 60, synced=True
+    )
+    entry.principal = schemas.UserPrincipal(id="u-cache", username="ana", is_active=True)
+
+    def no_lookup(*args, **kwargs):
+        raise AssertionError("SELECT do usuário")
+
+    monkeypatch.setattr(crud, "get_user_by_username", no_lookup)
+    monkeypatch.setattr(auth, "is_token_revoked", no_lookup)
+
+    try:
+        principal = auth.get_current_active_principal(token=token, db=NoDatabase())
+    finally:
+        auth.principal_cache.evict_token("jti-cache")
+    assert principal.id == "u-cache"
+
+
+def test_user_routes_authenticate_through_principal():
+    for route in users.router.routes:
+        if not route.path.startswith("/api/v1/users/me"):
+            continue
+        calls = {dependant.call for dependant in route.dependant.dependencies}
+        assert auth.get_current_active_principal in calls, route.path
+        assert auth.get_current_active_user not in calls, route.path
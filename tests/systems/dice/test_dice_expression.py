@@ -0,0 +1,76 @@
+import random
+
+import pytest
+from src.systems.dice import (
+    DiceSyntaxError,
+    average_roll,
+    compile_expression,
+    hit_points_expression,
+    roll_hit_points,
+)
+
+@pytest.fixture
+def rng():
+    return random.Random(42)
+
+def test_compile_is_cached():
+    assert compile_expression("4d6kh3 + 2") is compile_expression("4d6kh3 + 2")
+
+def test_compile_terms_and_modifier():
+    expression = compile_expression("2d6 - 1d4 + 3")
+    assert [(t.count, t.sides, t.sign) for t in expression.terms] == [(2, 6, 1), (1, 4, -1)]
+    assert expression.modifier == 3
+
+def test_drop_is_keep_of_the_rest():
+    assert compile_expression("4d6dl1").terms[0].keep == ("h", 3)
+    assert compile_expression("4d6dh1").terms[0].keep == ("l", 3)
+
+@pytest.mark.parametrize("text", ["", "1d", "2d6 3", "1d6+", "--1", "0d6", "1d6kh2", "1d1!", "4d6kh3!"])
+def test_invalid_expressions(text):
+    with pytest.raises(DiceSyntaxError):
+        compile_expression(text)
+
+def test_long_expression_is_rejected_before_cache():
+    from src.systems.dice.dice_expression import MAX_EXPRESSION_LENGTH, _compile
+    before = _compile.cache_info().misses
+    with pytest.raises(DiceSyntaxError):
+        compile_expression("1" + " " * MAX_EXPRESSION_LENGTH)
+    assert _compile.cache_info().misses == before
+
+def test_roll_respects_bounds(rng):
+    expression = compile_expression("4d6kh3 + 2")
+    for _ in range(200):
+        result = expression.roll(rng)
+        assert 5 <= result.total <= 20
+        assert len(result.terms[0]["rolls"]) == 4
+        assert len(result.terms[0]["kept"]) == 3
+
+def test_advantage_keeps_highest(rng):
+    result = compile_expression("adv").roll(rng)
+    assert result.total == max(result.terms[0]["rolls"])
+
+def test_roll_many_matches_average(rng):
+    totals = compile_expression("4d6kh3").roll_many(5000, rng)
+    assert len(totals) == 5000
+    assert abs(sum(totals) / len(totals) - compile_expression("4d6kh3").average()) < 0.2
+
+def test_exploding_dice_can_exceed_sides(rng):
+    totals = compile_expression("1d4!").roll_many(2000, rng)
+    assert min(totals) >= 1
+    assert max(totals) > 4
+
+def test_exact_averages():
+    assert compile_expression("2d20kh1").average() == pytest.approx(13.825)
+    assert compile_expression("2d20kl1").average() == pytest.approx(7.175)
+    assert compile_expression("4d8 + 4").average() == 22
+
+def test_average_roll_handles_modifiers():
+    assert average_roll("2d6") == 7
+    assert average_roll("4d8 + 4") == 22
+    assert average_roll("invalid") == 0
+
+def test_roll_hit_points_batch(rng):
+    assert hit_points_expression("22 (4d8 + 4)") == "4d8 + 4"
+    hit_points = roll_hit_points("22 (4d8 + 4)", count=40, rng=rng)
+    assert len(hit_points) == 40
+    assert all(8 <= hp <= 36 for hp in hit_points)
@@ -0,0 +1,46 @@
+import time
+
+import pytest
+from src.systems.dice import DiceSyntaxError, analyze, distribution
+
+def test_distribution_sums_to_one():
+    for text in ["1d6", "2d6 + 3", "4d6kh3", "adv", "1d6!", "1d20 - 1d4"]:
+        assert sum(distribution(text).pmf) == pytest.approx(1.0)
+
+def test_two_d6_pmf():
+    dist = distribution("2d6")
+    assert dist.minimum == 2 and dist.maximum == 12
+    assert dist.probability(7) == pytest.approx(6 / 36)
+    assert dist.percentile(0.5) == 7
+
+def test_advantage_against_ac():
+    dist = distribution("adv + 5")
+    # P(max(d20, d20) >= 10) = 1 - (9/20)^2
+    assert dist.probability_at_least(15) == pytest.approx(1 - (9 / 20) ** 2)
+    assert dist.probability_at_least(6) == 1.0
+    assert dist.probability_at_least(26) == 0.0
+
+def test_keep_and_explode_means():
+    assert distribution("4d6kh3").summary()["mean"] == pytest.approx(15869 / 1296)
+    assert distribution("1d6!").summary()["mean"] == pytest.approx(4.2)
+
+def test_memoized_by_normalized_expression():
+    assert distribution("5 + adv") is distribution("2d20kh1+5")
+    assert distribution("1d4 + 1d6") is distribution("1d6+1d4")
+
+def test_analyze_expected_damage():
+    result = analyze("1d20 + 5", target=15, damage="1d8 + 3")
+    assert result["success_probability"] == pytest.approx(0.55)
+    assert result["expected_damage"] == pytest.approx(0.55 * 7.5)
+
+def test_distribution_too_large():
+    with pytest.raises(DiceSyntaxError):
+        distribution("1000d10000")
+
+def test_exploding_distribution_size():
+    assert sum(distribution("50d100!").pmf) == pytest.approx(1.0)
+    for text in ["1000d100!", "1000d10000!"]:
+        started = time.perf_counter()
+        with pytest.raises(DiceSyntaxError):
+            distribution(text)
+        assert time.perf_counter() - started < 1.0
@@ -0,0 +1,119 @@
+import time
+
+import pytest
+
+pytest.importorskip("redis")
+
+from src import cache as cache_module
+from src.cache import CACHE_L1_TTL, RedisCache, TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        pass
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache_module, "time", clock)
+    return clock
+
+
+def test_entries_expire_after_their_ttl(clock):
+    evicted = []
+    local = TTLCache(maxsize=10, ttl=30, on_evict=lambda key, value: evicted.append(key))
+    local.set("a", 1)
+    local.set("b", 2, ttl=5)
+
+    clock.now += 5
+    assert local.get("b") is None  # expira exatamente no TTL
+    assert local.get("a") == 1
+    clock.now += 25
+    assert local.get("a") is None
+    assert evicted == ["b", "a"]
+    assert len(local) == 0
+    assert local.get_stats()["hits"] == 1 and local.get_stats()["misses"] == 2
+
+
+def test_least_recently_used_entry_leaves_at_maxsize(clock):
+    local = TTLCache(maxsize=2, ttl=30)
+    local.set("a", 1)
+    local.set("b", 2)
+    assert local.get("a") == 1  # "a" passa a ser o mais recente
+    local.set("c", 3)
+    assert local.get("b") is None
+    assert local.get("a") == 1 and local.get("c") == 3
+
+
+def test_byte_budget_evicts_oldest_but_keeps_newest(clock):
+    evicted = []
+    local = TTLCache(maxsize=100, ttl=30, maxbytes=100,
+                     on_evict=lambda key, value: evicted.append(key))
+    local.set("a", "x", size=40)
+    local.set("b", "x", size=40)
+    local.set("c", "x", size=40)
+    assert evicted == ["a"]
+    assert local.get_stats()["bytes"] == 80
+
+    # Substituir uma entrada devolve o tamanho anterior ao orçamento
+    local.set("b", "y", size=10)
+    assert local.get_stats()["bytes"] == 50
+
+    # Uma entrada maior que o orçamento fica sozinha em vez de esvaziar o cache
+    local.set("grande", "x", size=500)
+    assert list(local._data) == ["grande"]
+    assert local.get_stats()["bytes"] == 500
+
+
+@pytest.fixture
+def shared_redis(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        cache_module.redis, "from_url",
+        lambda url, **kwargs: fakeredis.FakeRedis(server=server, decode_responses=True)
+    )
+    caches = []
+    yield caches
+    for redis_cache in caches:
+        if redis_cache._invalidation_thread is not None:
+            redis_cache._invalidation_thread.stop()
+
+
+def test_l1_ttl_never_outlives_the_redis_key(shared_redis, clock):
+    redis_cache = RedisCache()
+    shared_redis.append(redis_cache)
+    redis_cache.redis_client.set("curta", '"v"', ex=2)
+    redis_cache.redis_client.set("longa", '"v"')
+
+    assert redis_cache.get("curta") == "v"
+    assert redis_cache.get("longa") == "v"
+    assert redis_cache.get("ausente") is None
+    assert redis_cache.l2_hits == 2 and redis_cache.l2_misses == 1
+
+    clock.now += 2
+    assert redis_cache.local.get("curta") is None  # TTL do Redis, não o do L1
+    assert redis_cache.local.get("longa") == '"v"'
+    clock.now += CACHE_L1_TTL
+    assert redis_cache.local.get("longa") is None
+
+
+def test_write_on_one_worker_invalidates_the_others_l1(shared_redis):
+    reader, writer = RedisCache(), RedisCache()
+    shared_redis.extend([reader, writer])
+    writer.set("chave", {"v": 1})
+    assert reader.get("chave") == {"v": 1}
+
+    writer.set("chave", {"v": 2})
+    deadline = time.monotonic() + 3
+    while reader.local.get("chave") is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert reader.get("chave") == {"v": 2}
+    assert reader.invalidations_received >= 1
@@ -0,0 +1,123 @@
+import gzip
+import os
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+
+from starlette.applications import Starlette
+from starlette.datastructures import Headers
+from starlette.responses import PlainTextResponse
+from starlette.routing import Mount, Route
+from starlette.testclient import TestClient
+
+from src import compression
+from src.compression import (
+    AVAILABLE_ENCODINGS, Compression, Encoder, PrecompressedStaticFiles, negotiate, precompress_file
+)
+from src.middleware import HTTPPipelineMiddleware
+
+ALL_ENCODINGS = ("zstd", "br", "gzip")
+ASSET = b"function tick(state) { return state.tokens.map(token => token.id); }\n" * 200
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ("gzip, br, zstd", "zstd"),  # mesmo q: preferência do servidor
+    ("gzip, deflate, br", "br"),
+    ("br;q=0.5, gzip;q=0.8", "gzip"),
+    ("zstd;q=0, *", "br"),
+    ("*;q=0.1, gzip;q=0", "zstd"),
+    ("identity", None),
+    ("gzip;q=0", None),
+    ("GZIP ; Q=0.9", "gzip"),
+])
+def test_negotiate_honours_q_values_then_server_preference(accept_encoding, expected):
+    assert negotiate(accept_encoding, ALL_ENCODINGS) == expected
+
+
+def test_negotiate_offers_only_what_is_available():
+    assert negotiate("zstd, br, gzip", ("gzip",)) == "gzip"
+    assert negotiate("zstd", ("br", "gzip")) is None
+
+
+def _decompress(encoding, data):
+    if encoding == "br":
+        return compression.brotli.decompress(data)
+    if encoding == "zstd":
+        return compression.zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return gzip.decompress(data)
+
+
+@pytest.mark.parametrize("encoding", AVAILABLE_ENCODINGS)
+def test_streaming_encoder_round_trips(encoding):
+    encoder = Encoder(encoding, 3)
+    chunks = [encoder.process(ASSET[:1000], final=False), encoder.process(ASSET[1000:], final=True)]
+    assert _decompress(encoding, b"".join(chunks)) == ASSET
+
+
+def test_compression_skips_precompressed_prefixes():
+    response_compression = Compression(skip_prefixes=("/static/", "/avatars/"))
+    headers = Headers({"accept-encoding": "gzip"})
+    assert response_compression.negotiate("/static/app.js", headers) is None
+    assert response_compression.negotiate("/avatars/u1.png", headers) is None
+    assert response_compression.negotiate("/api/v1/tables", headers) == "gzip"
+    assert response_compression.negotiate("/api/v1/tables", Headers({})) is None
+
+
+@pytest.fixture
+def client(tmp_path):
+    asset = tmp_path / "app.js"
+    asset.write_bytes(ASSET)
+    precompress_file(asset)
+    (tmp_path / "plain.js").write_bytes(ASSET)  # sem cópias pré-comprimidas
+
+    async def api(request):
+        return PlainTextResponse(ASSET.decode())
+
+    app = Starlette(routes=[
+        Route("/api/data", api),
+        Mount("/static", PrecompressedStaticFiles(directory=str(tmp_path)))
+    ])
+    app = HTTPPipelineMiddleware(
+        app, compression=Compression(skip_prefixes=("/static/", "/avatars/")), request_id=False
+    )
+    client = TestClient(app)
+    client.asset = asset
+    return client
+
+
+def _get(client, path, accept_encoding):
+    # Sem decodificar: o teste confere o corpo como foi enviado
+    with client.stream("GET", path, headers={"Accept-Encoding": accept_encoding}) as response:
+        return response, b"".join(response.iter_raw())
+
+
+@pytest.mark.parametrize("encoding", AVAILABLE_ENCODINGS)
+def test_static_file_served_from_precompressed_sibling(client, encoding):
+    response, body = _get(client, "/static/app.js", encoding)
+    sibling = compression.precompressed_path(client.asset, encoding)
+    assert response.headers["content-encoding"] == encoding
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert body == sibling.read_bytes()
+    assert int(response.headers["content-length"]) == len(body)
+
+
+def test_stale_sibling_is_ignored(client):
+    gz = compression.precompressed_path(client.asset, "gzip")
+    source_mtime = os.stat(client.asset).st_mtime
+    os.utime(gz, (source_mtime - 60, source_mtime - 60))
+    response, body = _get(client, "/static/app.js", "gzip")
+    assert "content-encoding" not in response.headers
+    assert body == ASSET
+
+
+def test_static_paths_are_not_compressed_per_request(client):
+    response, body = _get(client, "/static/plain.js", "gzip")
+    assert "content-encoding" not in response.headers
+    assert body == ASSET
+
+    response, body = _get(client, "/api/data", "gzip")
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert gzip.decompress(body) == ASSET
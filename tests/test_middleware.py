@@ -0,0 +1,177 @@
+import asyncio
+import gzip
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from starlette.datastructures import Headers
+
+from src.compression import Compression
+from src.middleware import HTTPMetrics, HTTPPipelineMiddleware, ResponseHeaderPolicy, static_etag
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BODY = b'{"tokens": [' + b'{"id": "t1", "x": 10, "y": 20},' * 100 + b'{}]}'
+
+
+def _app(messages):
+    """App ASGI que envia as mensagens dadas, como uma resposta em streaming faria"""
+    async def app(scope, receive, send):
+        for message in messages:
+            await send(message)
+    return app
+
+
+def _start(content_type="application/json", extra=()):
+    return {
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", content_type.encode()), *extra],
+    }
+
+
+def _chunks(body, size):
+    parts = [body[i:i + size] for i in range(0, len(body), size)]
+    return [
+        {"type": "http.response.body", "body": part, "more_body": i < len(parts) - 1}
+        for i, part in enumerate(parts)
+    ]
+
+
+def _run(middleware, path="/api/v1/stories", accept_encoding="gzip"):
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    scope = {
+        "type": "http", "method": "GET", "path": path, "client": ("127.0.0.1", 1),
+        "headers": [(b"accept-encoding", accept_encoding.encode())] if accept_encoding else [],
+    }
+    asyncio.run(middleware(scope, receive, send))
+    return Headers(raw=sent[0]["headers"]), sent[1:]
+
+
+def test_streaming_body_is_compressed_chunk_by_chunk():
+    start = _start(extra=[(b"content-length", str(len(BODY)).encode())])
+    chunks = _chunks(BODY, 1000)
+    middleware = HTTPPipelineMiddleware(_app([start, *chunks]), compression=Compression())
+    headers, bodies = _run(middleware)
+
+    assert headers["content-encoding"] == "gzip"
+    assert "content-length" not in headers  # o tamanho comprimido não é conhecido no início
+    assert [body["more_body"] for body in bodies] == [True] * (len(bodies) - 1) + [False]
+    assert len(bodies) == len(chunks)
+    assert gzip.decompress(b"".join(body["body"] for body in bodies)) == BODY
+
+
+def test_single_body_gets_compressed_content_length():
+    start = _start(extra=[(b"content-length", str(len(BODY)).encode())])
+    middleware = HTTPPipelineMiddleware(
+        _app([start, {"type": "http.response.body", "body": BODY}]), compression=Compression()
+    )
+    headers, bodies = _run(middleware)
+
+    assert len(bodies) == 1
+    assert int(headers["content-length"]) == len(bodies[0]["body"])
+    assert gzip.decompress(bodies[0]["body"]) == BODY
+
+
+@pytest.mark.parametrize("start, accept_encoding", [
+    (_start("image/png"), "gzip"),  # tipo não comprimível
+    (_start(extra=[(b"content-encoding", b"br")]), "gzip"),  # já comprimido pela rota
+    (_start("text/event-stream"), "gzip"),
+    (_start(), None),  # cliente não aceita compressão
+])
+def test_skipped_compression_passes_the_stream_through(start, accept_encoding):
+    start = {**start, "headers": [*start["headers"], (b"content-length", str(len(BODY)).encode())]}
+    chunks = _chunks(BODY, 1000)
+    middleware = HTTPPipelineMiddleware(_app([start, *chunks]), compression=Compression())
+    headers, bodies = _run(middleware, accept_encoding=accept_encoding)
+
+    assert headers.get("content-encoding") in (None, "br")
+    assert headers["content-length"] == str(len(BODY))
+    assert bodies == chunks
+
+
+def test_small_body_is_not_compressed():
+    body = {"type": "http.response.body", "body": b'{"ok": true}'}
+    middleware = HTTPPipelineMiddleware(_app([_start(), body]), compression=Compression())
+    headers, bodies = _run(middleware)
+    assert "content-encoding" not in headers
+    assert bodies == [body]
+
+
+def test_header_policy_runs_before_compression():
+    start = _start(extra=[(b"x-frame-options", b"SAMEORIGIN")])
+    metrics = HTTPMetrics()
+    middleware = HTTPPipelineMiddleware(
+        _app([start, {"type": "http.response.body", "body": BODY}]),
+        metrics=metrics, header_policy=ResponseHeaderPolicy(), compression=Compression()
+    )
+    headers, _ = _run(middleware)
+
+    # Vary da política de API já cobre Accept-Encoding: a compressão não duplica
+    assert headers.getlist("vary") == ["Accept-Encoding, Authorization"]
+    assert headers["cache-control"] == "public, max-age=300"
+    assert headers["x-frame-options"] == "SAMEORIGIN"  # header da rota não é sobrescrito
+    assert headers["x-content-type-options"] == "nosniff"
+    assert headers["content-encoding"] == "gzip"
+    assert "x-request-id" in headers and "x-process-time" in headers
+    assert metrics.request_count == 1
+
+
+def test_dynamic_endpoint_gets_compression_vary_and_no_cache():
+    middleware = HTTPPipelineMiddleware(
+        _app([_start(), {"type": "http.response.body", "body": BODY}]),
+        header_policy=ResponseHeaderPolicy(), compression=Compression()
+    )
+    headers, _ = _run(middleware, path="/api/v1/tables/mesa-1")
+    assert headers["cache-control"] == "no-cache, no-store, must-revalidate"
+    assert headers["vary"] == "Accept-Encoding"
+
+
+def test_static_etag_is_a_stable_digest():
+    start = _start("application/javascript", extra=[
+        (b"content-length", b"1200"), (b"last-modified", b"Sun, 18 Oct 2026 06:00:00 GMT")
+    ])
+    middleware = HTTPPipelineMiddleware(
+        _app([start, {"type": "http.response.body", "body": b""}]),
+        header_policy=ResponseHeaderPolicy(), request_id=False
+    )
+    headers, _ = _run(middleware, path="/static/app.js", accept_encoding=None)
+
+    etag = static_etag("/static/app.js", "1200", "Sun, 18 Oct 2026 06:00:00 GMT")
+    assert headers["etag"] == etag
+    assert etag != static_etag("/static/app.js", "1201", "Sun, 18 Oct 2026 06:00:00 GMT")
+    assert etag != static_etag("/static/app.js", "1200", "Sun, 18 Oct 2026 07:00:00 GMT")
+    assert headers["cache-control"].endswith("immutable")
+
+
+def test_existing_etag_is_kept():
+    start = _start("application/javascript", extra=[(b"etag", b'"from-file"')])
+    middleware = HTTPPipelineMiddleware(
+        _app([start, {"type": "http.response.body", "body": b""}]),
+        header_policy=ResponseHeaderPolicy(), request_id=False
+    )
+    headers, _ = _run(middleware, path="/static/app.js", accept_encoding=None)
+    assert headers["etag"] == '"from-file"'
+
+
+def test_static_etag_does_not_depend_on_the_process():
+    # hash() de str muda a cada processo (PYTHONHASHSEED); o ETag não pode mudar
+    code = "from src.middleware import static_etag; print(static_etag('/static/app.js', '1200'))"
+    etags = {
+        subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True,
+            env={**os.environ, "PYTHONHASHSEED": seed}, cwd=ROOT
+        ).stdout.strip()
+        for seed in ("1", "2")
+    }
+    assert etags == {static_etag("/static/app.js", "1200")}
@@ -0,0 +1,67 @@
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("passlib")
+
+from src.password_hasher import PasswordHasher, PasswordHasherBusy
+
+
+def _occupy(hasher):
+    """Ocupa uma vaga do hasher até o evento retornado ser sinalizado"""
+    release = threading.Event()
+    future, _ = hasher._submit(release.wait, 5)
+    return release, future
+
+
+def test_full_queue_rejects_immediately_and_frees_the_slot():
+    hasher = PasswordHasher(workers=0, max_pending=1)
+    release, future = _occupy(hasher)
+    try:
+        with pytest.raises(PasswordHasherBusy) as error:
+            asyncio.run(hasher.hash("segredo"))
+        assert error.value.retry_after >= 1
+        with pytest.raises(PasswordHasherBusy):
+            hasher.verify_sync("segredo", "$2b$12$invalido")
+    finally:
+        release.set()
+        future.result()
+
+    assert hasher.get_stats()["pending"] == 0
+    hashed = hasher.hash_sync("segredo")
+    assert asyncio.run(hasher.verify("segredo", hashed))
+    stats = hasher.get_stats()
+    assert (stats["submitted"], stats["rejected"], stats["completed"]) == (3, 2, 2)
+    hasher.stop()
+
+
+def test_busy_hasher_answers_503_with_retry_after():
+    pytest.importorskip("httpx")
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from src import main
+
+    # O app real registra o handler; a rota de teste usa um hasher com a fila cheia
+    assert main.app.exception_handlers[PasswordHasherBusy] is main._password_hasher_busy_handler
+    hasher = PasswordHasher(workers=0, max_pending=1)
+    app = FastAPI()
+    app.add_exception_handler(PasswordHasherBusy, main._password_hasher_busy_handler)
+
+    @app.post("/login")
+    async def login():
+        return {"hash": await hasher.hash("segredo")}
+
+    release, future = _occupy(hasher)
+    try:
+        response = TestClient(app).post("/login")
+    finally:
+        release.set()
+        future.result()
+        hasher.stop()
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == str(PasswordHasherBusy().retry_after)
+    assert response.json() == {"detail": "Serviço de autenticação sobrecarregado"}
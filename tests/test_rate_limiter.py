@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("redis")
+
+from src import rate_limiter
+from src.rate_limiter import WebSocketRateLimiter
+
+
+class FakeClock:
+    """Relógio controlado, usado como `time.monotonic` local e `TIME` do Redis"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return 1_700_000_000 + self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    return clock
+
+
+def _limiter(backend="local"):
+    limiter = WebSocketRateLimiter(backend=backend)
+    limiter.limits = {"chat": {"count": 5, "window": 10}}  # rajada de 5, depois 1 a cada 2 s
+    return limiter
+
+
+def _run(limiter, clock, steps):
+    """Decisões para uma sequência de (segundos a avançar, eventos enviados)"""
+    async def scenario():
+        decisions = []
+        for advance, events in steps:
+            clock.now += advance
+            for _ in range(events):
+                decisions.append(await limiter.is_allowed("u1", "chat"))
+        return decisions
+
+    return asyncio.run(scenario())
+
+
+STEPS = [(0, 7), (1.5, 1), (1, 2), (4.5, 3), (30, 6)]
+EXPECTED = [
+    True, True, True, True, True, False, False,  # rajada
+    False,  # 1,5 s: ainda sem intervalo livre
+    True, False,  # 2,5 s: um evento liberado
+    True, True, False,  # 7 s: mais dois
+    True, True, True, True, True, False  # janela inteira parada: rajada completa
+]
+
+
+def test_burst_then_one_event_per_interval(clock):
+    limiter = _limiter()
+    assert _run(limiter, clock, STEPS) == EXPECTED
+    assert limiter.stats["allowed"] == EXPECTED.count(True)
+    assert limiter.stats["limited"] == EXPECTED.count(False)
+
+
+def test_users_and_unlimited_events_are_independent(clock):
+    limiter = _limiter()
+
+    async def scenario():
+        for _ in range(5):
+            assert await limiter.is_allowed("u1", "chat")
+        assert not await limiter.is_allowed("u1", "chat")
+        assert await limiter.is_allowed("u2", "chat")
+        assert await limiter.is_allowed("u1", "ping")
+
+    asyncio.run(scenario())
+
+
+def test_expired_keys_are_pruned_at_capacity(clock):
+    limiter = _limiter()
+    limiter.max_keys = 2
+
+    async def scenario():
+        await limiter.is_allowed("u1", "chat")
+        await limiter.is_allowed("u2", "chat")
+        clock.now += 3  # TAT das duas chaves já passou
+        await limiter.is_allowed("u3", "chat")
+
+    asyncio.run(scenario())
+    assert set(limiter.tat) == {("u3", "chat")}
+
+
+def test_redis_script_agrees_with_local_limiter(clock, monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    from fakeredis.commands_mixins import server_mixin
+
+    monkeypatch.setattr(server_mixin, "time", clock)
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    limiter = _limiter("redis")
+    monkeypatch.setattr(limiter, "_redis_client", lambda: client)
+
+    assert _run(limiter, clock, STEPS) == EXPECTED
+    assert limiter.stats["redis_errors"] == 0
+    assert limiter.tat == {}  # nada decidido localmente
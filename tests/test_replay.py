@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("redis")
+
+from src.replay import ReplayBuffer, RoomReplayLog
+from src.token_store import TableTokenStore
+from src.websocket_manager import WebSocketManager
+from src.ws_codec import Frame
+
+
+def test_reserve_follows_remote_events_and_release_returns_unused_number():
+    log = RoomReplayLog(size=10)
+    assert log.reserve("sala") == 1
+    log.record_remote("sala", 5, Frame.from_json('{"room_seq":5,"type":"x"}'))
+    seq = log.reserve("sala")
+    assert seq == 6
+    log.release("sala", seq)
+    assert log.reserve("sala") == 6
+
+
+def test_repeated_number_is_kept_but_not_a_valid_cursor():
+    buffer = ReplayBuffer(10)
+    buffer.append(1, Frame.from_json('{"room_seq":1,"a":1}'))
+    buffer.append(2, Frame.from_json('{"room_seq":2,"a":2}'))
+    buffer.append(2, Frame.from_json('{"room_seq":2,"b":2}'))
+    assert [frame.json for frame in buffer.since(1)] == ['{"room_seq":2,"a":2}', '{"room_seq":2,"b":2}']
+    assert buffer.since(2) is None
+
+
+def test_token_history_with_room_sequence_gaps():
+    store = TableTokenStore("mesa", [{"id": "t1", "imageUrl": "/a.png", "x": 0, "y": 0}], seq=10, history=2)
+    store.apply({"op": "move", "id": "t1", "x": 1, "y": 1}, 12)
+    store.apply({"op": "move", "id": "t1", "x": 2, "y": 2}, 12)  # mesmo tick
+    assert [event["seq"] for event in store.deltas_since(10)] == [12, 12]
+    assert store.deltas_since(9) is None
+
+    store.apply({"op": "move", "id": "t1", "x": 3, "y": 3}, 15)
+    assert store.deltas_since(10) is None  # um delta do número 12 já saiu do histórico
+    assert [event["seq"] for event in store.deltas_since(12)] == [15]
+
+
+class _Writer:
+    def __init__(self):
+        self.frames = []
+
+    def enqueue(self, frame):
+        self.frames.append(frame.json)
+        return True
+
+
+def test_broadcast_delivers_locally_before_publishing():
+    manager = WebSocketManager()
+    release = asyncio.Event()
+    published = []
+
+    async def publish(redis_client, instance_id, batch):
+        await release.wait()
+        published.extend(batch)
+
+    manager.replay.publish = publish
+    manager.redis_client = object()
+    websocket = type("FakeWebSocket", (), {})()
+    websocket.writer = _Writer()
+    manager.active_connections["sala"] = [websocket]
+
+    async def scenario():
+        await manager.broadcast_to_room("sala", {"type": "a"})
+        await manager.broadcast_to_room("sala", {"type": "b"})
+        # Entregue localmente e numerado sem esperar o Redis
+        assert websocket.writer.frames == ['{"room_seq":1,"type":"a"}', '{"room_seq":2,"type":"b"}']
+        assert published == []
+        release.set()
+        await manager.outbox_task
+
+    asyncio.run(scenario())
+    # Um único lote, na ordem de emissão
+    assert [(seq, data) for _, _, seq, data in published] == [
+        (1, '{"room_seq":1,"type":"a"}'), (2, '{"room_seq":2,"type":"b"}')
+    ]
+    assert manager.stats["publish_batches"] == 1
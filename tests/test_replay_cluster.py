@@ -0,0 +1,156 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("redis")
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")  # scripts Lua no fakeredis
+
+from src.token_store import TokenStoreRegistry
+from src.websocket_manager import WebSocketManager, instance_channel
+
+T1 = {"id": "t1", "imageUrl": "/a.png", "x": 0, "y": 0}
+T2 = {"id": "t2", "imageUrl": "/b.png", "x": 5, "y": 5, "size": 1, "label": "B"}
+ADD_T2 = {"op": "add", "token": T2}
+
+
+class _Writer:
+    def __init__(self):
+        self.frames = []
+
+    def enqueue(self, frame):
+        self.frames.append(frame.payload)
+        return True
+
+    def snapshots(self):
+        return [frame for frame in self.frames if frame.get("type") == "tokens_snapshot"]
+
+
+async def _node(server, name, tokens):
+    """Instância com uma conexão na sala e um registro de tokens próprio"""
+    manager = WebSocketManager()
+    manager.instance_id = name
+    manager.redis_client = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+    manager.pubsub = manager.redis_client.pubsub()
+    await manager.pubsub.subscribe(instance_channel(name))
+
+    websocket = type("FakeWebSocket", (), {})()
+    websocket.writer = _Writer()
+    websocket.room_id = "sala"
+    manager.active_connections["sala"] = [websocket]
+    await manager._sync_room_subscription("sala")
+    await manager.replay.seed(manager.redis_client, "sala")
+
+    stores = TokenStoreRegistry(manager)
+    manager.add_remote_listener(stores.apply_remote)
+    manager.add_resync_listener(stores.rebuild)
+    stores.load("sala", [dict(token) for token in tokens])
+    return manager, websocket.writer, stores
+
+
+async def _pump(manager, drop=0):
+    """Processa as mensagens pendentes do pub/sub, descartando as `drop` primeiras"""
+    while True:
+        message = await manager.pubsub.get_message(timeout=0.05)
+        if message is None:
+            return
+        if message["type"] != "message":
+            continue
+        if drop:
+            drop -= 1
+            continue
+        await manager._handle_redis_message(message["channel"], message["data"])
+
+
+def _emit(manager, stores, raw_delta):
+    """Aplica um delta de cliente local e o difunde, como o endpoint faz"""
+    seq = manager.replay.reserve("sala")
+    event = stores.apply("sala", raw_delta, seq)
+    return manager.broadcast_to_room("sala", event, seq=seq)
+
+
+def _position(tokens, token_id):
+    return tokens[token_id]["x"], tokens[token_id]["y"]
+
+
+def _snapshot_tokens(snapshot):
+    return {token["id"]: token for token in snapshot["tokens"]}
+
+
+def test_two_instances_converge_on_concurrent_moves():
+    async def scenario():
+        server = fakeredis.FakeServer()
+        a, writer_a, stores_a = await _node(server, "A", [T1])
+        b, writer_b, stores_b = await _node(server, "B", [T1])
+
+        # Ambas reservam o mesmo room_seq e aplicam localmente antes de publicar
+        await _emit(a, stores_a, {"op": "move", "id": "t1", "x": 1, "y": 1})
+        await _emit(b, stores_b, {"op": "move", "id": "t1", "x": 2, "y": 2})
+        assert a.replay.local_seq["sala"] == b.replay.local_seq["sala"] == 1
+        await a.outbox_task
+        await b.outbox_task
+        await _pump(a)
+        await _pump(b)
+
+        # A ordem da sala é a das posições: o movimento de B vem depois
+        events = await a.replay.read_positions(a.redis_client, "sala", 0, 2)
+        assert [(position, instance_id) for position, instance_id, _ in events] == [
+            (1, "A"), (2, "B")
+        ]
+        assert _position(stores_a.get("sala").tokens, "t1") == (2, 2)
+        assert _position(stores_b.get("sala").tokens, "t1") == (2, 2)
+
+        # A recebeu o movimento de B normalmente; o cliente de B viu (2, 2) e depois
+        # (1, 1), então recebe o snapshot corretivo
+        assert writer_a.snapshots() == []
+        snapshots = writer_b.snapshots()
+        assert [_position(_snapshot_tokens(snapshot), "t1") for snapshot in snapshots] == [(2, 2)]
+        assert not a.unconfirmed["sala"] and not b.unconfirmed["sala"]
+
+    asyncio.run(scenario())
+
+
+def test_lost_message_is_filled_from_the_stream():
+    async def scenario():
+        server = fakeredis.FakeServer()
+        a, writer_a, stores_a = await _node(server, "A", [T1])
+        b, _, stores_b = await _node(server, "B", [T1])
+
+        await _emit(b, stores_b, ADD_T2)
+        await b.outbox_task
+        await _pump(a, drop=1)  # a mensagem se perde no pub/sub
+        assert "t2" not in stores_a.get("sala").tokens
+
+        await _emit(b, stores_b, {"op": "move", "id": "t2", "x": 6, "y": 6})
+        await b.outbox_task
+        await _pump(a)
+
+        assert _position(stores_a.get("sala").tokens, "t2") == (6, 6)
+        assert [frame["op"] for frame in writer_a.frames] == ["add", "move"]
+        assert a.stats["gaps_filled"] == 1
+        assert a.stats["resyncs"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_failed_remote_apply_resyncs_from_the_stream():
+    async def scenario():
+        server = fakeredis.FakeServer()
+        b, _, stores_b = await _node(server, "B", [T1])
+        await _emit(b, stores_b, ADD_T2)
+        await b.outbox_task
+
+        # A abre a sala depois, com um estado persistido que ainda não tem t2
+        a, writer_a, stores_a = await _node(server, "A", [T1])
+        await _emit(b, stores_b, {"op": "move", "id": "t2", "x": 6, "y": 6})
+        await b.outbox_task
+        await _pump(a)  # move falha, pede a ressincronização
+        await a.outbox_task
+        await _pump(a)  # pedido volta pelo canal da instância
+
+        assert a.stats["resyncs"] == 1
+        assert stores_a.get("sala").tokens == stores_b.get("sala").tokens
+        assert _position(_snapshot_tokens(writer_a.snapshots()[-1]), "t2") == (6, 6)
+
+    asyncio.run(scenario())
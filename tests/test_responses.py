@@ -0,0 +1,52 @@
+import math
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from fastapi.responses import JSONResponse
+
+from src import responses
+from src.responses import FastJSONResponse
+
+# Forma de uma listagem de mesas/monstros e de uma análise de dados
+PAYLOAD = {
+    "id": "8e0bf44a-3c2e-4e1d-9f0a-1e5b7c9d2a10",
+    "title": "Mesa do Dragão — sessão nº 3",
+    "bio": "linha\ncom \"aspas\", \\barra\\ e controle \x01",
+    "is_active": True,
+    "scheduled_date": None,
+    "max_players": 6,
+    "tokens_state": [{"id": "t1", "x": 10, "y": -3.5, "imageUrl": "/static/t.png"}],
+    "players": [],
+    "huge_id": 2 ** 70,
+    "distribution": {
+        "mean": 10.5,
+        "stddev": 2.958039891549808,
+        "probabilities": [0.1, 1e-05, 2.5e-09, 0.0001, 1e+16, 1e15, 0.30000000000000004, -0.0],
+    },
+    "tags": ["1e5", "0.00001"],
+}
+
+
+def test_same_bytes_as_json_response():
+    assert FastJSONResponse(PAYLOAD).body == JSONResponse(PAYLOAD).body
+
+
+@pytest.mark.skipif(responses.orjson is None, reason="orjson não instalado")
+def test_plain_payload_stays_on_orjson(monkeypatch):
+    content = {key: value for key, value in PAYLOAD.items() if key not in ("distribution", "huge_id")}
+
+    def standard_render(self, content):
+        raise AssertionError("caminho padrão")
+
+    monkeypatch.setattr(JSONResponse, "render", standard_render)
+    assert FastJSONResponse(content).body == responses.orjson.dumps(content)
+
+
+@pytest.mark.skipif(responses.orjson is None, reason="orjson não instalado")
+def test_non_finite_floats_become_null():
+    # Diferença documentada: o JSONResponse levanta ValueError
+    with pytest.raises(ValueError):
+        JSONResponse({"value": math.nan})
+    assert FastJSONResponse({"value": math.nan, "inf": math.inf}).body == b'{"value":null,"inf":null}'
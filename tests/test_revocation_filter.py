@@ -0,0 +1,116 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("jose")
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src import crud, auth, database, models  # crud antes de auth: import circular
+from src import revocation_filter as revocation
+from src.revocation_filter import RevocationFilter
+
+
+class NoDatabase:
+    """Sessão que falha em qualquer uso"""
+
+    def __getattr__(self, name):
+        raise AssertionError(f"acesso ao banco: {name}")
+
+
+def _revoked(jti, expires_in):
+    return models.RevokedToken(
+        id=f"id-{jti}", jti=jti, user_id="u1", token_type="access",
+        expires_at=datetime.utcnow() + timedelta(seconds=expires_in)
+    )
+
+
+@pytest.fixture
+def session_factory(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False},
+                           poolclass=StaticPool)
+    models.Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    with factory() as db:
+        db.add_all([_revoked("revogado", 3600), _revoked("expirado", -60)])
+        db.commit()
+    monkeypatch.setattr(database, "SessionLocal", factory)
+    return factory
+
+
+@pytest.fixture
+def ready_filter(monkeypatch, session_factory):
+    revocation_filter = RevocationFilter(enabled=True, capacity=100)
+    revocation_filter.rebuild()
+    monkeypatch.setattr(auth, "revocation_filter", revocation_filter)
+    monkeypatch.setattr(auth, "_cache_revoked", lambda jti, expires_at: None)
+    return revocation_filter
+
+
+def test_revoked_jti_is_rejected(monkeypatch, ready_filter, session_factory):
+    def no_lookup(*args, **kwargs):
+        raise AssertionError("usuário carregado para token revogado")
+
+    monkeypatch.setattr("src.cache.is_token_revoked_cache", lambda jti: False)
+    monkeypatch.setattr(crud, "get_user_by_username", no_lookup)
+    token = auth.jwt.encode(
+        {"sub": "ana", "user_id": "u1", "jti": "revogado", "exp": int(time.time()) + 60},
+        auth.SECRET_KEY, algorithm=auth.ALGORITHM
+    )
+
+    with session_factory() as db:
+        assert auth.is_token_revoked("revogado", db)
+        with pytest.raises(auth.HTTPException) as error:
+            auth.get_current_active_principal(token=token, db=db)
+    assert error.value.status_code == 401
+    assert ready_filter.stats["positives"] == 2
+
+
+def test_filter_negative_skips_cache_and_database(monkeypatch, ready_filter):
+    def no_cache(jti):
+        raise AssertionError("consulta ao cache de revogação")
+
+    monkeypatch.setattr("src.cache.is_token_revoked_cache", no_cache)
+    assert not auth.is_token_revoked("nunca-revogado", NoDatabase())
+    assert ready_filter.stats["negatives"] == 1
+
+
+def test_rebuild_drops_expired_and_keeps_revocations_made_during_it(session_factory, monkeypatch):
+    revocation_filter = RevocationFilter(enabled=True, capacity=100)
+    # Antes da primeira carga todo token vai para a consulta exata
+    assert revocation_filter.might_be_revoked("qualquer")
+    assert revocation_filter.stats["bypassed"] == 1
+
+    def session_with_concurrent_revocation():
+        revocation_filter.add("durante")  # anunciada enquanto o banco é lido
+        return session_factory()
+
+    monkeypatch.setattr(database, "SessionLocal", session_with_concurrent_revocation)
+    revocation_filter.rebuild()
+
+    assert revocation_filter.ready
+    assert revocation_filter.might_be_revoked("revogado")
+    assert revocation_filter.might_be_revoked("durante")
+    assert not revocation_filter.might_be_revoked("expirado")
+    assert revocation_filter.filter.count == 2
+
+
+def test_rebuild_stays_unready_after_channel_error_during_it(session_factory, monkeypatch):
+    revocation_filter = RevocationFilter(enabled=True, capacity=100)
+    monkeypatch.setattr(revocation.time, "sleep", lambda seconds: None)
+
+    def session_with_channel_error():
+        revocation_filter._on_channel_error(ConnectionError("canal caiu"), None, None)
+        return session_factory()
+
+    monkeypatch.setattr(database, "SessionLocal", session_with_channel_error)
+    revocation_filter.rebuild()
+    assert not revocation_filter.ready
+
+    monkeypatch.setattr(database, "SessionLocal", session_factory)
+    revocation_filter.rebuild()
+    assert revocation_filter.ready
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("redis")
+
+from src import room_ticker as ticker_module
+from src.room_ticker import RoomTicker
+
+
+@pytest.fixture
+def broadcasts(monkeypatch):
+    frames = []
+
+    async def broadcast_to_room(room_id, message, exclude_instance=False, seq=None):
+        frames.append((room_id, message, seq))
+
+    manager = ticker_module.websocket_manager
+    monkeypatch.setattr(manager, "broadcast_to_room", broadcast_to_room)
+    yield frames
+    manager.replay.discard("sala-tick")
+
+
+def _ticker(received, events=None):
+    async def handler(room_id, items, seq):
+        received.append(list(items))
+        return [{"item": item} for item in items] if events is None else events
+
+    return RoomTicker(handler, interval_ms=5)
+
+
+async def _drain(ticker):
+    while ticker.tasks:
+        await asyncio.sleep(0.005)
+
+
+def test_repeated_ticks_are_coalesced_in_place(broadcasts):
+    received = []
+    ticker = _ticker(received)
+
+    async def scenario():
+        for x in range(5):
+            ticker.submit("sala-tick", ("move", "t1", x), key=("move", "t1"))
+        ticker.submit("sala-tick", ("chat", "oi"))
+        ticker.submit("sala-tick", ("move", "t2", 9), key=("move", "t2"))
+        ticker.submit("sala-tick", ("move", "t1", 7), key=("move", "t1"))
+        await _drain(ticker)
+
+    asyncio.run(scenario())
+    # t1 fica na posição do primeiro envio, com o valor mais recente
+    assert received == [[("move", "t1", 7), ("chat", "oi"), ("move", "t2", 9)]]
+    assert ticker.stats == {"ticks": 1, "items_received": 8, "items_coalesced": 5}
+    [(room_id, frame, seq)] = broadcasts
+    assert room_id == "sala-tick"
+    assert frame == {"type": "tick", "events": [{"item": item} for item in received[0]]}
+    assert seq == ticker_module.websocket_manager.replay.local_seq["sala-tick"]
+    assert ticker.pending == {} and ticker.tasks == {}
+
+
+def test_release_stops_coalescing_with_items_already_pending(broadcasts):
+    received = []
+    ticker = _ticker(received)
+
+    async def scenario():
+        ticker.submit("sala-tick", ("move", "t1", 1), key=("move", "t1"))
+        ticker.release("sala-tick", ("move", "t1"))
+        ticker.submit("sala-tick", ("remove", "t1"))
+        ticker.submit("sala-tick", ("move", "t1", 2), key=("move", "t1"))
+        ticker.submit("sala-tick", ("move", "t1", 3), key=("move", "t1"))
+        await _drain(ticker)
+
+    asyncio.run(scenario())
+    assert received == [[("move", "t1", 1), ("remove", "t1"), ("move", "t1", 3)]]
+
+
+def test_following_ticks_start_fresh(broadcasts):
+    received = []
+    ticker = _ticker(received)
+
+    async def scenario():
+        ticker.submit("sala-tick", "a", key="k")
+        await _drain(ticker)
+        ticker.submit("sala-tick", "b", key="k")
+        await _drain(ticker)
+
+    asyncio.run(scenario())
+    assert received == [["a"], ["b"]]
+    assert [seq for _, _, seq in broadcasts] == sorted({seq for _, _, seq in broadcasts})
+
+
+def test_empty_tick_releases_its_sequence_number(broadcasts):
+    ticker = _ticker([], events=[])
+    replay = ticker_module.websocket_manager.replay
+    before = replay.local_seq.get("sala-tick", 0)
+
+    async def scenario():
+        ticker.submit("sala-tick", "ignorado")
+        await _drain(ticker)
+
+    asyncio.run(scenario())
+    assert broadcasts == []
+    assert replay.local_seq.get("sala-tick", 0) == before
@@ -0,0 +1,206 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("redis")
+
+from src.websocket_manager import ConnectionWriter, WebSocketManager
+from src.ws_codec import Frame
+
+
+class FakeWebSocket:
+    """Socket cujo envio só avança quando `release` é sinalizado"""
+
+    def __init__(self):
+        self.sent = []
+        self.closed_with = []
+        self.release = asyncio.Event()
+
+    async def send_text(self, data):
+        await self.release.wait()
+        self.sent.append(data)
+
+    async def close(self, code=1000):
+        self.closed_with.append(code)
+
+
+def _frames(count):
+    return [Frame(payload={"n": n}) for n in range(count)]
+
+
+def _queued(writer):
+    return [frame.payload["n"] for frame in writer.queue._queue]
+
+
+def test_drop_oldest_keeps_the_most_recent_messages():
+    async def scenario():
+        manager = WebSocketManager()
+        websocket = FakeWebSocket()
+        writer = ConnectionWriter(manager, websocket, max_queue_size=2, policy="drop_oldest")
+        results = [writer.enqueue(frame) for frame in _frames(5)]
+
+        assert results == [True] * 5
+        assert writer.depth() == 2
+        assert _queued(writer) == [3, 4]
+        assert writer.dropped == manager.stats["messages_dropped"] == 3
+
+        websocket.release.set()
+        while writer.depth():
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        writer.close()
+        return websocket.sent
+
+    assert asyncio.run(scenario()) == ['{"n":3}', '{"n":4}']
+
+
+def test_drop_newest_refuses_messages_beyond_the_bound():
+    async def scenario():
+        manager = WebSocketManager()
+        writer = ConnectionWriter(manager, FakeWebSocket(), max_queue_size=2, policy="drop_newest")
+        results = [writer.enqueue(frame) for frame in _frames(4)]
+
+        assert results == [True, True, False, False]
+        assert writer.depth() == 2
+        assert _queued(writer) == [0, 1]
+        assert writer.dropped == manager.stats["messages_dropped"] == 2
+        assert not writer.closed
+        writer.close()
+
+    asyncio.run(scenario())
+
+
+def test_disconnect_policy_closes_the_slow_consumer():
+    async def scenario():
+        manager = WebSocketManager()
+        websocket = FakeWebSocket()
+        websocket.room_id = "sala"
+        manager.active_connections["sala"] = [websocket]
+        writer = ConnectionWriter(manager, websocket, max_queue_size=2, policy="disconnect")
+        websocket.writer = writer
+
+        assert [writer.enqueue(frame) for frame in _frames(3)] == [True, True, False]
+        assert writer.closed
+        assert not writer.enqueue(Frame(payload={"n": 9}))  # já fechado: nem conta como descarte
+        await asyncio.sleep(0)
+
+        assert websocket.closed_with == [1013]
+        assert "sala" not in manager.active_connections
+        assert manager.stats["slow_consumers_disconnected"] == 1
+        assert manager.stats["messages_dropped"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_unknown_policy_falls_back_to_drop_oldest():
+    async def scenario():
+        writer = ConnectionWriter(WebSocketManager(), FakeWebSocket(), policy="block")
+        assert writer.policy == "drop_oldest"
+        writer.close()
+
+    asyncio.run(scenario())
+
+
+class RoomWebSocket(FakeWebSocket):
+    """Socket aceito pelo manager (handshake sem subprotocolo)"""
+
+    def __init__(self):
+        super().__init__()
+        self.scope = {"subprotocols": []}
+
+    async def accept(self, subprotocol=None):
+        pass
+
+
+def test_room_channel_is_released_when_last_local_member_leaves():
+    fakeredis = pytest.importorskip("fakeredis")
+    from src.websocket_manager import instance_channel, room_channel
+
+    async def subscribers(manager, room_id):
+        [(_, count)] = await manager.redis_client.pubsub_numsub(room_channel(room_id))
+        return count
+
+    async def scenario():
+        manager = WebSocketManager()
+        manager.redis_client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        manager.pubsub = manager.redis_client.pubsub()
+        await manager.pubsub.subscribe(instance_channel(manager.instance_id))
+
+        first, second, other = RoomWebSocket(), RoomWebSocket(), RoomWebSocket()
+        await manager.connect(first, "sala", "u1")
+        await manager.connect(second, "sala", "u2")
+        await manager.connect(other, "outra", "u3")
+        assert manager.subscribed_rooms == {"sala", "outra"}
+        assert await subscribers(manager, "sala") == 1  # um canal por sala, não por conexão
+
+        await manager.disconnect(first)
+        assert await subscribers(manager, "sala") == 1
+
+        await manager.disconnect(second)
+        assert manager.subscribed_rooms == {"outra"}
+        assert await subscribers(manager, "sala") == 0
+        assert await subscribers(manager, "outra") == 1
+
+        # Volta a assinar quando alguém entra de novo
+        await manager.connect(RoomWebSocket(), "sala", "u1")
+        assert await subscribers(manager, "sala") == 1
+        await manager.cleanup()
+
+    asyncio.run(scenario())
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+def test_presence_entries_expire_without_renewal(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    from src import websocket_manager as manager_module
+    from src.websocket_manager import WS_PRESENCE_TTL, instance_channel, presence_key
+
+    clock = FakeClock()
+    monkeypatch.setattr(manager_module, "time", clock)
+    server = fakeredis.FakeServer()
+
+    async def node(name):
+        manager = WebSocketManager()
+        manager.instance_id = name
+        manager.redis_client = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+        manager.pubsub = manager.redis_client.pubsub()
+        await manager.pubsub.subscribe(instance_channel(name))
+        return manager
+
+    async def scenario():
+        a, b = await node("A"), await node("B")
+        await a.connect(RoomWebSocket(), "sala", "u1")
+        ttl = await a.redis_client.ttl(presence_key("u1"))
+        assert 0 < ttl <= WS_PRESENCE_TTL
+        assert await b.get_user_presence("u1") == [{"instance_id": "A", "room_id": "sala"}]
+
+        # A parou de renovar (instância morta): a entrada deixa de valer antes do TTL da chave
+        clock.now += WS_PRESENCE_TTL + 1
+        assert await b.get_user_presence("u1") == []
+        assert not await b.send_to_user("u1", {"type": "whisper"})
+        assert b.stats["direct_messages_routed"] == 0
+
+        # A renovação do heartbeat traz a entrada de volta
+        await a._refresh_presence()
+        assert await b.get_user_presence("u1") == [{"instance_id": "A", "room_id": "sala"}]
+        assert await b.send_to_user("u1", {"type": "whisper"})
+        assert b.stats["direct_messages_routed"] == 1
+
+        # Última conexão do usuário na sala: a entrada sai na hora
+        await a.disconnect(a.active_connections["sala"][0])
+        assert await b.get_user_presence("u1") == []
+        await a.cleanup()
+        await b.cleanup()
+
+    asyncio.run(scenario())
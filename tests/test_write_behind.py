@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("redis")
+
+from src import write_behind
+
+
+def test_flush_invalidates_cached_tables_after_write(monkeypatch):
+    written = []
+    invalidated = []
+
+    async def invalidate(table_ids):
+        invalidated.append(sorted(table_ids))
+        return 0
+
+    monkeypatch.setattr(write_behind.TableStateWriter, "_write", staticmethod(written.append))
+    monkeypatch.setattr(write_behind, "invalidate_tables_cache_async", invalidate)
+
+    writer = write_behind.TableStateWriter()
+    writer.mark_dirty("mesa-1", tokens_state=[])
+    writer.mark_dirty("mesa-2", tokens_state=lambda: [{"id": "t1"}])
+
+    assert asyncio.run(writer.flush()) == 2
+    assert written == [{"mesa-1": {"tokens_state": []}, "mesa-2": {"tokens_state": [{"id": "t1"}]}}]
+    assert invalidated == [["mesa-1", "mesa-2"]]
+
+
+def test_failed_flush_keeps_cache(monkeypatch):
+    invalidated = []
+
+    def fail(batch):
+        raise RuntimeError("banco fora do ar")
+
+    async def invalidate(table_ids):
+        invalidated.append(list(table_ids))
+        return 0
+
+    monkeypatch.setattr(write_behind.TableStateWriter, "_write", staticmethod(fail))
+    monkeypatch.setattr(write_behind, "invalidate_tables_cache_async", invalidate)
+
+    writer = write_behind.TableStateWriter()
+    writer.mark_dirty("mesa-1", tokens_state=[])
+
+    assert asyncio.run(writer.flush()) == 0
+    assert invalidated == []
+    assert "mesa-1" in writer.dirty
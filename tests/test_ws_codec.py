@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("redis")
+
+from src import ws_codec
+from src.websocket_manager import ConnectionWriter, WebSocketManager
+from src.ws_codec import (
+    JSON_SUBPROTOCOL, MSGPACK_SUBPROTOCOL, Frame, decode_client_message, negotiate_subprotocol
+)
+
+
+class FakeWebSocket:
+    def __init__(self, subprotocol):
+        self.subprotocol = subprotocol
+        self.sent = []
+
+    async def send_text(self, data):
+        self.sent.append(data)
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+
+def test_broadcast_encodes_each_protocol_once(monkeypatch):
+    msgpack = pytest.importorskip("msgpack")
+    calls = {"json": 0, "msgpack": 0}
+    encode_json, packb = ws_codec.encode_json, msgpack.packb
+
+    def counting_encode_json(payload):
+        calls["json"] += 1
+        return encode_json(payload)
+
+    def counting_packb(payload, **kwargs):
+        calls["msgpack"] += 1
+        return packb(payload, **kwargs)
+
+    monkeypatch.setattr(ws_codec, "encode_json", counting_encode_json)
+    monkeypatch.setattr(ws_codec.msgpack, "packb", counting_packb)
+
+    async def scenario():
+        manager = WebSocketManager()
+        protocols = [None] + [JSON_SUBPROTOCOL] * 2 + [MSGPACK_SUBPROTOCOL] * 2
+        sockets = [FakeWebSocket(protocol) for protocol in protocols]
+        for websocket in sockets:
+            websocket.writer = ConnectionWriter(manager, websocket)
+        manager.active_connections["sala"] = sockets
+
+        await manager.broadcast_to_room("sala", {"type": "chat", "text": "olá"})
+        while any(websocket.writer.depth() for websocket in sockets):
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        for websocket in sockets:
+            websocket.writer.close()
+        return sockets
+
+    sockets = asyncio.run(scenario())
+    # Um JSON (o room_seq entra no texto já serializado) e um MessagePack para os 5 destinatários
+    assert calls == {"json": 1, "msgpack": 1}
+    texts = [websocket.sent[0] for websocket in sockets[:3]]
+    assert texts == ['{"room_seq":1,"type":"chat","text":"olá"}'] * 3
+    binaries = [websocket.sent[0] for websocket in sockets[3:]]
+    assert binaries[0] is binaries[1]
+    assert msgpack.unpackb(binaries[0]) == {"room_seq": 1, "type": "chat", "text": "olá"}
+
+
+def test_frame_from_json_is_forwarded_without_reencoding(monkeypatch):
+    def no_encode(payload):
+        raise AssertionError("JSON re-serializado")
+
+    monkeypatch.setattr(ws_codec, "encode_json", no_encode)
+    frame = Frame.from_json('{"type":"tick"}')
+    assert frame.encode(None) == frame.encode(JSON_SUBPROTOCOL) == '{"type":"tick"}'
+
+
+def test_negotiation_prefers_client_order_among_supported(monkeypatch):
+    pytest.importorskip("msgpack")
+    requested = ["v2", MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL]
+    assert negotiate_subprotocol(requested) == MSGPACK_SUBPROTOCOL
+    assert negotiate_subprotocol([JSON_SUBPROTOCOL, MSGPACK_SUBPROTOCOL]) == JSON_SUBPROTOCOL
+    assert negotiate_subprotocol([]) is None
+
+    # Sem msgpack instalado só o JSON é oferecido
+    monkeypatch.setattr(ws_codec, "msgpack", None)
+    assert negotiate_subprotocol([MSGPACK_SUBPROTOCOL]) is None
+    assert negotiate_subprotocol([MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL]) == JSON_SUBPROTOCOL
+
+
+def test_client_messages_decode_from_text_and_binary(monkeypatch):
+    msgpack = pytest.importorskip("msgpack")
+    message = {"type": "chat", "text": "olá"}
+    assert decode_client_message('{"type": "chat", "text": "olá"}') == message
+    assert decode_client_message(msgpack.packb(message)) == message
+    with pytest.raises(ValueError):
+        decode_client_message(b"\xc1")  # byte reservado no MessagePack
+
+    monkeypatch.setattr(ws_codec, "msgpack", None)
+    with pytest.raises(ValueError):
+        decode_client_message(b"\x81")